@@ -1,81 +1,127 @@
+# app.py - Flask application and Socket.IO server
+#
+# Everything with side effects (configuration, the database schema, blueprints,
+# Socket.IO) happens in create_app(), not at import. The FRT job queue starts
+# its worker processes with 'spawn', which re-imports this module as
+# __mp_main__ in every worker when the server runs as `python app.py`; those
+# imports must stay cheap and must not touch the database.
+
 import os
 from flask import Flask, session, jsonify, request, render_template
-from flask_session import Session
 from datetime import timedelta
-from flask_socketio import SocketIO, join_room, leave_room
-import traceback
-from setup_tables import setup_encryption_tables
-import chatbot  # Import the new chatbot module
-
-try:
-    from config import SECRET_KEY, DB_CONFIG
-except ImportError:
-    print("WARNING: Using config_template.py instead of config.py.")
-    print("Please create a config.py file with your actual configuration settings.")
-    print("See config_template.py for reference.")
-    from config_template import SECRET_KEY, DB_CONFIG
-
-app = Flask(__name__)
-app.secret_key = SECRET_KEY
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
-Session(app)
-
-# Initialize SocketIO with the app
-socketio = SocketIO(app, cors_allowed_origins="*")
+from flask_socketio import join_room, leave_room
 
 # Create uploads directory
 UPLOAD_DIR = 'uploads'
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Import and register blueprints from routes package
-from routes import register_blueprints
-register_blueprints(app)
 
-# Import auth blueprint and register it
-from auth import auth_bp
-app.register_blueprint(auth_bp, url_prefix='/auth')
+def create_app():
+    """Build the Flask app, with its Socket.IO server in app.extensions['socketio']"""
+    from flask_session import Session
+    from flask_socketio import SocketIO
+    from setup_tables import ensure_schema
+    import chatbot  # noqa: F401  Import the new chatbot module
 
-# Initialize socketio for chat routes
-from routes.chat_routes import init_socketio
-init_socketio(socketio)
+    try:
+        from config import SECRET_KEY
+    except ImportError:
+        print("WARNING: Using config_template.py instead of config.py.")
+        print("Please create a config.py file with your actual configuration settings.")
+        print("See config_template.py for reference.")
+        from config_template import SECRET_KEY
+
+    app = Flask(__name__)
+    # Stream uploaded videos to disk, hashing them on the way, instead of buffering them
+    from video_upload import UploadRequest
+    app.request_class = UploadRequest
+    app.secret_key = SECRET_KEY
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
+    Session(app)
+
+    # One pooled database connection per request, committed or rolled back when the request ends
+    from database import init_unit_of_work
+    init_unit_of_work(app)
+
+    # Bring the database schema up to date once, so request handlers never check it;
+    # the app does not start without it
+    ensure_schema()
+
+    # Initialize SocketIO with the app
+    socketio = SocketIO(app, cors_allowed_origins="*")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    # Import and register blueprints from routes package
+    from routes import register_blueprints
+    register_blueprints(app)
+
+    # Import auth blueprint and register it
+    from auth import auth_bp
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+
+    # Initialize socketio for chat routes
+    from routes.chat_routes import init_socketio
+    init_socketio(socketio)
+
+    # Initialize socketio for FRT job notifications
+    from routes.frt_routes import init_socketio as init_frt_socketio
+    init_frt_socketio(socketio)
+
+    # Application-level routes and WebSocket event handlers, defined below
+    app.add_url_rule('/init-app', view_func=init_app_route, methods=['GET'])
+    app.add_url_rule('/api/db/pool-stats', view_func=db_pool_stats_route, methods=['GET'])
+    app.add_url_rule('/chat', view_func=chat_legacy, methods=['POST'])
+    app.add_url_rule('/api/doctor-info', view_func=doctor_info_legacy)
+    app.add_url_rule('/faqs', view_func=faqs)
+    app.add_url_rule('/api/patient/dashboard-stats', view_func=get_dashboard_stats)
+    socketio.on_event('connect', handle_connect)
+    socketio.on_event('disconnect', handle_disconnect)
+    return app
 
 # Simple initialization function to be called when needed
 def initialize_app():
     """Initialize database tables needed for the application"""
-    setup_encryption_tables()
+    from setup_tables import ensure_schema
+    ensure_schema()
 
 # Add this initialization route (accessible to doctors)
-@app.route('/init-app', methods=['GET'])
 def init_app_route():
     if 'user_id' in session and session.get('role') == 'Doctor':
-        initialize_app()
+        try:
+            initialize_app()
+        except Exception as e:
+            return jsonify({'error': f"Could not initialize the database schema: {str(e)}"}), 500
         return jsonify({'message': 'Application initialized successfully'}), 200
     return jsonify({'error': 'Not authorized'}), 401
 
+# Database connection pool counters (accessible to doctors)
+def db_pool_stats_route():
+    if 'user_id' in session and session.get('role') == 'Doctor':
+        from database import get_pool
+        return jsonify(get_pool().stats()), 200
+    return jsonify({'error': 'Not authorized'}), 401
+
 # Add compatibility routes for existing frontend
-@app.route('/chat', methods=['POST'])
 def chat_legacy():
     """Legacy route that forwards to the new chatbot endpoint"""
     from routes.chat_routes import chat_with_bot
     return chat_with_bot()
 
-@app.route('/api/doctor-info')
 def doctor_info_legacy():
     """Legacy route that forwards to the new doctor info endpoint"""
     from routes.doctor_routes import get_doctor_info
     return get_doctor_info()
 
-@app.route('/faqs')
 def faqs():
     return render_template('faqs.html')
 
 # Add dashboard statistics endpoint
-@app.route('/api/patient/dashboard-stats')
 def get_dashboard_stats():
     """API endpoint to get dashboard statistics data for the patient dashboard"""
-    from datetime import datetime
-    import sqlite3
+    import pyodbc
+    from database import request_connection
+    from stats_rollup import patient_dashboard_stats
     
     try:
         if 'user_id' not in session:
@@ -83,61 +129,29 @@ def get_dashboard_stats():
             
         user_id = session.get('user_id')
         
-        # Connect to the database using a context manager to ensure connection is closed
-        with sqlite3.connect('instance/database.db') as conn:
-            conn.row_factory = sqlite3.Row
-            db = conn.cursor()
-            
-            # Get the last assessment data
-            last_assessment_query = """
-                SELECT date, risk_level FROM FunctionalReachTests 
-                WHERE patient_id = ? ORDER BY date DESC LIMIT 1
-            """
-            last_assessment = db.execute(last_assessment_query, (user_id,)).fetchone()
-            
-            # Get tests count
-            tests_count_query = """
-                SELECT COUNT(*) as count FROM FunctionalReachTests 
-                WHERE patient_id = ?
-            """
-            tests_count = db.execute(tests_count_query, (user_id,)).fetchone()
-            total_count = tests_count['count'] if tests_count else 0
-            
-            # Get current month vs previous month comparison
-            current_month = datetime.now().month
-            current_year = datetime.now().year
-            
-            # Format response data with user-friendly empty states
-            response_data = {
-                'lastAssessment': {
-                    'date': last_assessment['date'] if last_assessment else "No tests yet",
-                    'status': last_assessment['risk_level'] if last_assessment else "No data"
-                },
-                'testsCompleted': {
-                    'count': total_count,
-                    'change': None  # We'll leave this null for now
-                },
-                'avgDistance': {
-                    'value': None,
-                    'change': None
-                }
+        # A single row of the patient's rollup, kept up to date as results are saved
+        stats = patient_dashboard_stats(request_connection().cursor(), user_id)
+        tests, measured_tests, reach_sum, last_test_at, last_risk_level = stats or (0, 0, 0, None, None)
+        
+        # Format response data with user-friendly empty states
+        response_data = {
+            'lastAssessment': {
+                'date': last_test_at.strftime("%Y-%m-%d %H:%M:%S") if last_test_at else "No tests yet",
+                'status': last_risk_level if last_risk_level else "No data"
+            },
+            'testsCompleted': {
+                'count': tests,
+                'change': None  # We'll leave this null for now
+            },
+            'avgDistance': {
+                'value': round(reach_sum / measured_tests, 1) if measured_tests else None,
+                'change': None
             }
-            
-            # Only calculate average distance if there are tests
-            if total_count > 0:
-                # Get average distance
-                avg_distance_query = """
-                    SELECT AVG(max_distance) as avg_distance FROM FunctionalReachTests 
-                    WHERE patient_id = ? AND max_distance > 0
-                """
-                avg_distance = db.execute(avg_distance_query, (user_id,)).fetchone()
-                
-                if avg_distance and avg_distance['avg_distance']:
-                    response_data['avgDistance']['value'] = round(avg_distance['avg_distance'], 1)
+        }
         
         return jsonify(response_data)
         
-    except sqlite3.Error as e:
+    except pyodbc.Error as e:
         print(f"Database error in dashboard stats: {e}")
         return jsonify({
             'lastAssessment': {'date': "No tests yet", 'status': "Database error"},
@@ -154,7 +168,6 @@ def get_dashboard_stats():
         })
 
 # WebSocket event handlers
-@socketio.on('connect')
 def handle_connect():
     if 'user_id' not in session:
         return False  # Reject the connection
@@ -163,12 +176,15 @@ def handle_connect():
     join_room(f"user_{session['user_id']}")
     print(f"User {session['user_id']} connected to WebSocket")
 
-@socketio.on('disconnect')
 def handle_disconnect():
+    # Give the live FRT stream's Pose graph back to the pool
+    from frt_stream import close_stream as close_frt_stream
+    close_frt_stream(request.sid)
     if 'user_id' in session:
         leave_room(f"user_{session['user_id']}")
         print(f"User {session['user_id']} disconnected from WebSocket")
 
 # Update the app.run() to use SocketIO
 if __name__ == "__main__":
-    socketio.run(app, debug=True)
\ No newline at end of file
+    app = create_app()
+    app.extensions['socketio'].run(app, debug=True)
\ No newline at end of file
@@ -2,7 +2,7 @@
 
 from flask import Blueprint, request, session, jsonify
 from flask_bcrypt import Bcrypt
-from database import get_db_connection
+from database import get_db_connection, request_connection, unit_of_work
 import pyodbc  # Ensure this is imported for handling database exceptions
 import random
 import smtplib
@@ -12,6 +12,7 @@ import os
 from datetime import datetime, timedelta
 import string
 from email_config import EMAIL_CONFIG
+from stats_rollup import record_doctor_change
 
 auth_bp = Blueprint('auth', __name__)
 bcrypt = Bcrypt()
@@ -52,30 +53,27 @@ def send_email(to_email, subject, message):
 
 def generate_doc_id():
     """Generate a unique 6-character doctor ID"""
-    for attempt in range(10):  # Try a maximum of 10 times
-        # Generate a random 6-character string (letters and numbers)
-        doc_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        
-        # Check if this ID already exists in DoctorProfiles table instead of Users
-        conn = get_db_connection()
+    # One connection for every attempt, shared with the request that needs the ID
+    with unit_of_work() as conn:
         cursor = conn.cursor()
-        
+
         # First check if DoctorProfiles table exists
         cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'DoctorProfiles'")
         doctor_profiles_exists = cursor.fetchone()[0] > 0
-        
-        # If using normalized schema, check DoctorProfiles table
-        if doctor_profiles_exists:
-            cursor.execute("SELECT 1 FROM DoctorProfiles WHERE DoctorID = ?", (doc_id,))
-        else:
-            # For backwards compatibility with old schema
-            cursor.execute("SELECT 1 FROM Users WHERE DoctorID = ?", (doc_id,))
-            
-        exists = cursor.fetchone()
-        conn.close()
-        
-        if not exists:
-            return doc_id
+
+        for attempt in range(10):  # Try a maximum of 10 times
+            # Generate a random 6-character string (letters and numbers)
+            doc_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+
+            # If using normalized schema, check DoctorProfiles table
+            if doctor_profiles_exists:
+                cursor.execute("SELECT 1 FROM DoctorProfiles WHERE DoctorID = ?", (doc_id,))
+            else:
+                # For backwards compatibility with old schema
+                cursor.execute("SELECT 1 FROM Users WHERE DoctorID = ?", (doc_id,))
+
+            if not cursor.fetchone():
+                return doc_id
     
     # If we get here, we couldn't generate a unique ID after 10 attempts
     raise ValueError("Could not generate a unique doctor ID after multiple attempts")
@@ -169,11 +167,9 @@ def signup():
     
     # Validate doctor_id if patient is associated with a doctor
     if role == 'Patient' and has_doctor and doctor_id:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = request_connection().cursor()
         cursor.execute("SELECT 1 FROM DoctorProfiles WHERE DoctorID = ?", (doctor_id,))
         valid_doctor = cursor.fetchone()
-        conn.close()
         
         if not valid_doctor:
             return jsonify({'error': 'Invalid Doctor ID'}), 400
@@ -189,13 +185,11 @@ def signup():
     
     hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
     
-    conn = get_db_connection()
+    # The request's connection, already used by the checks above
+    conn = request_connection()
     cursor = conn.cursor()
     
     try:
-        # Begin transaction
-        conn.autocommit = False
-        
         # Insert user into the Users table
         print("Inserting into Users table...")
         cursor.execute("""
@@ -215,6 +209,7 @@ def signup():
                 INSERT INTO PatientProfiles (UserID, HasDoctor, DoctorID)
                 VALUES (?, ?, ?)
             """, (user_id, has_doctor, doctor_id))
+            record_doctor_change(cursor, user_id, None, doctor_id)
         else:  # Doctor
             print(f"Creating doctor profile with doctor_id: {doctor_id}, pmdc_no: {pmdc_no}")
             # Accept any PMDC number without validation
@@ -233,7 +228,7 @@ def signup():
                 print(f"Error inserting doctor profile: {str(e)}")
                 raise e
             
-        # Commit the transaction
+        # Commit now: the email below must only go out for a saved account
         conn.commit()
         print("Transaction committed successfully")
         
@@ -269,10 +264,6 @@ def signup():
         conn.rollback()
         print(f"Unexpected error in signup: {str(e)}")
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
-    finally:
-        conn.autocommit = True
-        conn.close()
-        print("Database connection closed")
 
 # 🔹 User Login (Authentication)
 @auth_bp.route('/login', methods=['POST'])
@@ -0,0 +1,367 @@
+# benchmark_frt.py - Offline CPU benchmark of the FRT engine on synthetic clips
+#
+# Generates clips of a stick figure performing a scripted Functional Reach
+# Test, runs each engine variant on them in a fresh process, and prints a JSON
+# report: frames/sec, per-stage latency (decode, resize, color conversion,
+# inference, validation, scoring), peak RSS, and how stable the results are
+# across repeats and variants.
+#
+# With --pose replay (the default) inference is replaced by a stub that
+# replays the scripted landmarks, so the numbers isolate the engine itself and
+# the expected reach is known exactly. With --pose mediapipe the real model
+# runs on the clips (it will mostly not recognise the stick figure, but the
+# decode and inference costs are real).
+#
+#   python benchmark_frt.py --seconds 10 --reach 10 20 30 --repeats 3 --output bench.json
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+# Engine variants: the per-frame engine used by process_frt/live_frt and
+# rendered uploads, and the two-phase engine used by analyze_frt
+VARIANTS = {
+    'per_frame': {'engine': 'per_frame', 'sample_stride': 1, 'prefetch': False, 'roi': False},
+    'per_frame_prefetch': {'engine': 'per_frame', 'sample_stride': 1, 'prefetch': True, 'roi': False},
+    'two_phase': {'engine': 'two_phase', 'sample_stride': 1, 'prefetch': False, 'roi': False},
+    'two_phase_adaptive': {'engine': 'two_phase', 'sample_stride': 6, 'prefetch': True, 'roi': False},
+    'two_phase_adaptive_roi': {'engine': 'two_phase', 'sample_stride': 6, 'prefetch': True, 'roi': True}
+}
+
+# Script of the synthetic test, in seconds
+NOBODY_UNTIL = 0.5
+REACH_START = 3.5
+REACH_PEAK = 5.5
+REACH_HOLD_END = 6.5
+REACH_END = 7.5
+
+# Standing posture that passes validate_posture, as normalized (x, y) per landmark
+STANDING_POSE = {
+    0: (0.50, 0.18), 1: (0.49, 0.16), 2: (0.48, 0.16), 3: (0.47, 0.16), 4: (0.51, 0.16), 5: (0.52, 0.16),
+    6: (0.53, 0.16), 7: (0.46, 0.17), 8: (0.54, 0.17), 9: (0.49, 0.21), 10: (0.51, 0.21),
+    11: (0.45, 0.30), 12: (0.55, 0.30), 13: (0.38, 0.42), 14: (0.65, 0.30), 15: (0.36, 0.52),
+    16: (0.75, 0.29), 17: (0.35, 0.54), 18: (0.77, 0.28), 19: (0.36, 0.55), 20: (0.78, 0.29),
+    21: (0.37, 0.54), 22: (0.77, 0.30), 23: (0.46, 0.55), 24: (0.54, 0.55), 25: (0.46, 0.72),
+    26: (0.54, 0.72), 27: (0.46, 0.90), 28: (0.54, 0.90), 29: (0.45, 0.91), 30: (0.55, 0.91),
+    31: (0.46, 0.92), 32: (0.54, 0.92)
+}
+
+
+# Define the function to get the scripted landmarks at time t, or None while nobody is in view
+def scripted_landmarks(t, reach_cm, frame_index=0, noise=0.0):
+    if t < NOBODY_UNTIL:
+        return None
+
+    from frt_processing import scene_width_cm, reach_offset_cm
+    peak = (reach_cm + reach_offset_cm) / scene_width_cm
+    if t < REACH_START or t >= REACH_END:
+        dx = 0.0
+    elif t < REACH_PEAK:
+        dx = peak * (t - REACH_START) / (REACH_PEAK - REACH_START)
+    elif t < REACH_HOLD_END:
+        dx = peak
+    else:
+        dx = peak * (REACH_END - t) / (REACH_END - REACH_HOLD_END)
+
+    points = np.array([STANDING_POSE[i] for i in range(33)], dtype=np.float64)
+    points[14, 0] += dx / 2
+    points[[16, 18, 20, 22], 0] += dx
+    if noise:
+        # Seeded per frame so every variant sees the same jitter on the same frame
+        points += np.random.default_rng(frame_index).normal(0, noise, points.shape)
+    return points
+
+# Define the functions to encode a frame index in the background colour, and read it back
+def encode_index(i):
+    return (8 + 16 * (i % 16), 8 + 16 * (i // 16 % 16), 8 + 16 * (i // 256 % 16))
+
+def decode_index(rgb_patch):
+    r, g, b = rgb_patch.reshape(-1, 3).mean(axis=0)
+    return int(round((b - 8) / 16)) + 16 * int(round((g - 8) / 16)) + 256 * int(round((r - 8) / 16))
+
+
+def make_clip(path, seconds, fps, width, height, reach_cm, noise):
+    """Render the scripted test as a stick figure; returns the clip description"""
+    from mediapipe.python.solutions.pose_connections import POSE_CONNECTIONS
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    frames = int(seconds * fps)
+    for i in range(frames):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = encode_index(i)
+        points = scripted_landmarks(i / fps, reach_cm, i, noise)
+        if points is not None:
+            pixels = (points * [width, height]).astype(int)
+            for a, b in POSE_CONNECTIONS:
+                cv2.line(frame, tuple(pixels[a]), tuple(pixels[b]), (235, 235, 235), max(2, width // 120))
+            for x, y in pixels:
+                cv2.circle(frame, (x, y), max(3, width // 100), (60, 60, 235), -1)
+        writer.write(frame)
+    writer.release()
+
+    return {'path': path, 'name': os.path.basename(path), 'frames': frames, 'fps': fps,
+            'resolution': f"{width}x{height}", 'reachCm': reach_cm, 'noise': noise}
+
+
+def as_landmarks(points):
+    return [types.SimpleNamespace(x=x, y=y, z=0.0, visibility=0.99) for x, y in points]
+
+
+class ReplayPose:
+    """Stand-in for mp.solutions.pose.Pose that replays the scripted landmarks"""
+
+    def __init__(self, clip):
+        self.clip = clip
+
+    def process(self, image):
+        i = decode_index(image[:4, :4])
+        points = scripted_landmarks(i / self.clip['fps'], self.clip['reachCm'], i, self.clip['noise'])
+        landmarks = None
+        if points is not None:
+            landmarks = types.SimpleNamespace(landmark=as_landmarks(points))
+        return types.SimpleNamespace(pose_landmarks=landmarks)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _open_pose(pose_mode, clip):
+    import frt_processing as frt
+
+    if pose_mode == 'replay':
+        return ReplayPose(clip), None
+    pool = frt.get_pose_pool()
+    return pool.acquire(), pool
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+def _latency(samples):
+    samples = np.asarray(samples) * 1000
+    if not samples.size:
+        return None
+    return {'meanMs': round(float(samples.mean()), 3), 'p95Ms': round(float(np.percentile(samples, 95)), 3)}
+
+
+def run_variant(clip, variant_name, pose_mode, stage_timings=False):
+    """Run one engine variant on one clip; executed in a fresh process so RSS is per run"""
+    import frt_processing as frt
+    from stage_timer import StageTimer, NULL_STAGE_TIMER
+
+    variant = VARIANTS[variant_name]
+    # The replay stub answers in full-frame coordinates, so it cannot be cropped
+    frt.roi_cropping = variant['roi'] and pose_mode != 'replay'
+    pose, pool = _open_pose(pose_mode, clip)
+    timer = StageTimer() if stage_timings else NULL_STAGE_TIMER
+
+    started = time.perf_counter()
+    cap = cv2.VideoCapture(clip['path'])
+    try:
+        if variant['engine'] == 'per_frame':
+            analysis = frt._run_frt(cap, pose, sample_stride=variant['sample_stride'], prefetch=variant['prefetch'],
+                                    timer=timer)
+        else:
+            series = frt.extract_landmark_series(cap, pose, sample_stride=variant['sample_stride'],
+                                                 prefetch=variant['prefetch'], timer=timer)
+            scoring_started = time.perf_counter()
+            analysis = frt.score_landmark_series(series)
+            timer.add('scoring', time.perf_counter() - scoring_started)
+            analysis['framesDecoded'] = series['framesDecoded']
+            analysis['framesInferred'] = len(series['times'])
+            analysis['pipeline'] = dict(series['pipeline'],
+                                        scoringSeconds=round(time.perf_counter() - scoring_started, 4))
+    finally:
+        cap.release()
+        if pool is not None:
+            pool.release(pose)
+    elapsed = time.perf_counter() - started
+
+    run = {
+        'riskLevel': analysis['riskLevel'],
+        'maxDistance': analysis['maxDistance'],
+        'termination': analysis.get('termination'),
+        'elapsedSeconds': round(elapsed, 4),
+        'framesDecoded': analysis['framesDecoded'],
+        'framesInferred': analysis['framesInferred'],
+        'fps': round(analysis['framesDecoded'] / elapsed, 1) if elapsed else None,
+        'pipeline': analysis['pipeline'],
+        'peakRssMb': _peak_rss_mb()
+    }
+    if timer.enabled:
+        run['stageTimings'] = timer.summary()
+    return run
+
+def measure_stages(clip, pose_mode):
+    """Time each stage separately, frame by frame, on the clip"""
+    import frt_processing as frt
+
+    pose, pool = _open_pose(pose_mode, clip)
+    stages = {'decode': [], 'resize': [], 'color': [], 'inference': [], 'validation': []}
+    session = frt.FRTSession()
+    times = []
+    series = []
+
+    cap = cv2.VideoCapture(clip['path'])
+    try:
+        i = 0
+        while True:
+            t0 = time.perf_counter()
+            ret, frame = cap.read()
+            t1 = time.perf_counter()
+            if not ret:
+                break
+            resized = cv2.resize(frame, (frt.desired_width, frt.desired_height))
+            t2 = time.perf_counter()
+            image = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+            t3 = time.perf_counter()
+            pose.process(image)
+            t4 = time.perf_counter()
+
+            # Validators always run on the scripted landmarks so their cost is measured in both modes
+            points = scripted_landmarks(i / clip['fps'], clip['reachCm'], i, clip['noise'])
+            t5 = time.perf_counter()
+            landmarks = frt.landmarks_to_array(as_landmarks(points)) if points is not None else None
+            session.feed(landmarks, i / clip['fps'])
+            t6 = time.perf_counter()
+
+            stages['decode'].append(t1 - t0)
+            stages['resize'].append(t2 - t1)
+            stages['color'].append(t3 - t2)
+            stages['inference'].append(t4 - t3)
+            stages['validation'].append(t6 - t5)
+            times.append(i / clip['fps'])
+            series.append(landmarks if landmarks is not None
+                          else np.full((frt.NUM_LANDMARKS, 4), np.nan, dtype=np.float32))
+            i += 1
+    finally:
+        cap.release()
+        if pool is not None:
+            pool.release(pose)
+
+    started = time.perf_counter()
+    frt.score_landmark_series({'times': np.array(times), 'points': np.stack(series)})
+    scoring = time.perf_counter() - started
+
+    result = {stage: _latency(samples) for stage, samples in stages.items()}
+    result['scoring'] = {'totalMs': round(scoring * 1000, 3), 'perFrameMs': round(scoring * 1000 / len(times), 4)}
+    return result
+
+
+def _stability(runs, expected):
+    distances = [run['maxDistance'] for run in runs]
+    return {
+        'riskLevels': sorted({str(run['riskLevel']) for run in runs}),
+        'stable': len({(run['riskLevel'], run['maxDistance']) for run in runs}) == 1,
+        'maxDistanceMean': round(float(np.mean(distances)), 3),
+        'maxDistanceSpread': round(max(distances) - min(distances), 3),
+        'maxDistanceError': round(float(np.mean(distances)) - expected, 3) if expected is not None else None
+    }
+
+def run_benchmark(args):
+    from frt_processing import risk_level
+
+    clips_dir = args.clips_dir or tempfile.mkdtemp(prefix='frt_bench_')
+    os.makedirs(clips_dir, exist_ok=True)
+    width, height = (int(v) for v in args.resolution.split('x'))
+    context = multiprocessing.get_context('spawn')
+
+    report = {
+        'generatedAt': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'platform': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpuCount': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__
+        },
+        'config': {'pose': args.pose, 'seconds': args.seconds, 'fps': args.fps, 'resolution': args.resolution,
+                   'repeats': args.repeats, 'variants': args.variants, 'stageTimings': args.stage_timings},
+        'clips': []
+    }
+
+    try:
+        for reach_cm in args.reach:
+            path = os.path.join(clips_dir, f"frt_{args.resolution}_{reach_cm}cm.mp4")
+            print(f"Generating {path}", file=sys.stderr)
+            clip = make_clip(path, args.seconds, args.fps, width, height, reach_cm, args.noise)
+
+            # In replay mode the true result is known; the real model gives no ground truth
+            expected = reach_cm if args.pose == 'replay' else None
+            clip['expected'] = {'maxDistance': expected, 'riskLevel': risk_level(expected) if expected else None}
+
+            # Every task runs in a new process so peak RSS and model warm-up are per run
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                clip['stages'] = pool.apply(measure_stages, (clip, args.pose))
+                clip['variants'] = {}
+                all_runs = []
+                for name in args.variants:
+                    print(f"  {clip['name']}: {name}", file=sys.stderr)
+                    runs = [pool.apply(run_variant, (clip, name, args.pose, args.stage_timings))
+                            for _ in range(args.repeats)]
+                    all_runs.extend(runs)
+                    elapsed = [run['elapsedSeconds'] for run in runs]
+                    clip['variants'][name] = {
+                        'fps': float(np.median([run['fps'] for run in runs])),
+                        'elapsedSecondsMedian': round(float(np.median(elapsed)), 4),
+                        'elapsedSecondsMin': min(elapsed),
+                        'peakRssMb': max((run['peakRssMb'] for run in runs), default=None),
+                        'stability': _stability(runs, expected),
+                        'runs': runs
+                    }
+                clip['stability'] = _stability(all_runs, expected)
+            report['clips'].append(clip)
+    finally:
+        if not args.clips_dir:
+            shutil.rmtree(clips_dir, ignore_errors=True)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the FRT engine on synthetic clips")
+    parser.add_argument('--pose', choices=['replay', 'mediapipe'], default='replay',
+                        help="replay scripted landmarks through a stub, or run the real MediaPipe model")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--resolution', default='720x1280', help="WIDTHxHEIGHT of the generated clips")
+    parser.add_argument('--reach', type=float, nargs='+', default=[10, 20, 30],
+                        help="scripted reach of each clip, in cm")
+    parser.add_argument('--noise', type=float, default=0.001, help="landmark jitter, in normalized units")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--variants', nargs='+', choices=sorted(VARIANTS), default=list(VARIANTS))
+    parser.add_argument('--stage-timings', action='store_true',
+                        help="also time the stages inside each variant's own loop (adds a little overhead)")
+    parser.add_argument('--clips-dir', help="keep the generated clips in this directory")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
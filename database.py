@@ -1,9 +1,441 @@
 # database.py - Handles database connection
+#
+# Connections come from a process-wide pool, so a request no longer pays for
+# the ODBC handshake and Windows authentication. get_db_connection() keeps its
+# old contract: callers use the connection and call close(), which now rolls
+# back anything left uncommitted and hands the connection back to the pool.
+#
+#   with db_connection() as conn:   # commits on success, rolls back on error
+#       conn.cursor().execute(...)
+#
+# Within a Flask request, request_connection() / unit_of_work() share one
+# pooled connection between the handler and every helper it calls; it is
+# committed once when the request succeeds and rolled back otherwise.
+
+import os
+import threading
+import time
+from contextlib import contextmanager
 
 import pyodbc
+from flask import g, has_request_context, jsonify
 from config import DB_CONFIG
 
+# Pool settings
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 20))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 10))
+DB_POOL_IDLE_SECONDS = float(os.environ.get('DB_POOL_IDLE_SECONDS', 300))
+
+# A connection idle for longer than this is pinged before it is handed out
+DB_POOL_PING_AFTER_SECONDS = float(os.environ.get('DB_POOL_PING_AFTER_SECONDS', 30))
+
+
 # Establish connection to MS SQL Server
-def get_db_connection():
-    conn_str = f"DRIVER={DB_CONFIG['DRIVER']};SERVER={DB_CONFIG['SERVER']};DATABASE={DB_CONFIG['DATABASE']};Trusted_Connection=yes"
+def connect():
+    conn_str = f"DRIVER={DB_CONFIG['DRIVER']};SERVER={DB_CONFIG['SERVER']};DATABASE={DB_CONFIG['DATABASE']};Trusted_Connection=yes;MARS_Connection=yes"
     return pyodbc.connect(conn_str)
+
+
+class PoolTimeoutError(Exception):
+    """No connection became available within the pool timeout"""
+
+
+class PooledConnection:
+    """A checked-out pyodbc connection; close() returns it to the pool instead of closing it.
+
+    Everything else (cursor, commit, rollback, autocommit, ...) goes to the
+    underlying connection. Used as a context manager it commits on success,
+    rolls back on error and returns the connection.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise pyodbc.ProgrammingError('Attempt to use a closed connection.')
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_pool', '_conn'):
+            object.__setattr__(self, name, value)
+        elif self._conn is None:
+            raise pyodbc.ProgrammingError('Attempt to use a closed connection.')
+        else:
+            setattr(self._conn, name, value)
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        conn = self._conn
+        if conn is None:
+            return
+        try:
+            if exc_type is None:
+                conn.commit()
+            else:
+                conn.rollback()
+        except pyodbc.Error:
+            self.close()
+            raise
+        # The transaction is already over, so the pool can skip its reset rollback
+        self._conn = None
+        self._pool.release(conn, clean=not conn.autocommit)
+
+    def __del__(self):
+        # A handler that forgot close() must not leak its slot
+        if self.__dict__.get('_conn') is not None:
+            PooledConnection.close(self)
+
+
+class SharedConnection(PooledConnection):
+    """The connection of a request's unit of work; close() is a no-op, the unit of work returns it"""
+
+    def close(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Commit and rollback belong to the unit of work
+        pass
+
+
+class ConnectionPool:
+    """Thread-safe pool of database connections.
+
+    Connections are opened on demand up to max_size and handed out most
+    recently used first, so under light load a few warm connections serve
+    every request and the rest go idle. Idle connections beyond min_size are
+    closed after idle_seconds; one that has been idle for longer than
+    ping_after is checked with SELECT 1 before it is handed out and replaced
+    if the server dropped it. Callers that find the pool exhausted wait up to
+    timeout seconds, and that wait is counted in stats().
+    """
+
+    def __init__(self, connect, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT_SECONDS, idle_seconds=DB_POOL_IDLE_SECONDS,
+                 ping_after=DB_POOL_PING_AFTER_SECONDS):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size, 1)
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.ping_after = ping_after
+        self._idle = []  # (connection, time returned), most recently used last
+        self._created = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        # Counters
+        self.started = time.monotonic()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.opened = 0
+        self.closed = 0
+        self.evicted = 0
+        self.health_check_failures = 0
+        self.peak_in_use = 0
+        self.busy_seconds = 0.0  # integral of connections in use over time
+        self._last_change = self.started
+
+    def _track_locked(self, delta):
+        now = time.monotonic()
+        self.busy_seconds += self._in_use * (now - self._last_change)
+        self._last_change = now
+        self._in_use += delta
+        self.peak_in_use = max(self.peak_in_use, self._in_use)
+
+    def _open(self):
+        conn = self.connect()
+        with self._cond:
+            self.opened += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+        with self._cond:
+            self.closed += 1
+
+    def _evict_locked(self):
+        # The oldest idle connections are at the front; keep at least min_size open
+        now = time.monotonic()
+        evicted = []
+        while (self._idle and self._created > self.min_size
+               and now - self._idle[0][1] > self.idle_seconds):
+            evicted.append(self._idle.pop(0)[0])
+            self._created -= 1
+            self.evicted += 1
+        return evicted
+
+    def _healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def warm(self):
+        """Open connections until min_size are available"""
+        while True:
+            with self._cond:
+                if self._created >= self.min_size:
+                    return
+                self._created += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def acquire(self, timeout=None, wrapper=PooledConnection):
+        """Check out a healthy connection, opening one if the pool has not reached max_size"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            evicted = self._evict_locked()
+            while True:
+                if self._idle:
+                    conn, returned = self._idle.pop()
+                    break
+                if self._created < self.max_size:
+                    # Reserve the slot; the connection is opened outside the lock
+                    self._created += 1
+                    conn, returned = None, None
+                    break
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeoutError(f"No database connection became available within {timeout} s "
+                                           f"({self.max_size} in use)")
+                waited = True
+                self._cond.wait(remaining)
+
+            self._track_locked(1)
+            self.checkouts += 1
+            if waited:
+                wait = time.monotonic() - started
+                self.waits += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        for old in evicted:
+            self._discard(old)
+
+        try:
+            if conn is not None and time.monotonic() - returned > self.ping_after and not self._healthy(conn):
+                with self._cond:
+                    self.health_check_failures += 1
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            self._release_slot()
+            raise
+        return wrapper(self, conn)
+
+    def _release_slot(self):
+        with self._cond:
+            self._created -= 1
+            self._track_locked(-1)
+            self._cond.notify()
+
+    def release(self, conn, clean=False):
+        """Return a connection to the pool, dropping it if it cannot be reset"""
+        try:
+            # End whatever transaction the caller left open so the next user starts clean
+            if clean:
+                pass
+            elif not conn.autocommit:
+                conn.rollback()
+            else:
+                conn.autocommit = False
+        except pyodbc.Error:
+            self._discard(conn)
+            self._release_slot()
+            return
+
+        with self._cond:
+            self._track_locked(-1)
+            self._idle.append((conn, time.monotonic()))
+            evicted = self._evict_locked()
+            self._cond.notify()
+        for old in evicted:
+            self._discard(old)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        with conn:
+            yield conn
+
+    def stats(self):
+        with self._cond:
+            self._track_locked(0)
+            elapsed = time.monotonic() - self.started
+            return {
+                'size': self._created,
+                'inUse': self._in_use,
+                'idle': len(self._idle),
+                'minSize': self.min_size,
+                'maxSize': self.max_size,
+                'utilization': round(self._in_use / self.max_size, 3),
+                'avgUtilization': round(self.busy_seconds / (elapsed * self.max_size), 4) if elapsed else 0,
+                'peakInUse': self.peak_in_use,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'waitSeconds': round(self.wait_seconds, 3),
+                'avgWaitMs': round(1000 * self.wait_seconds / self.checkouts, 3) if self.checkouts else 0,
+                'maxWaitMs': round(1000 * self.max_wait_seconds, 3),
+                'timeouts': self.timeouts,
+                'opened': self.opened,
+                'closed': self.closed,
+                'evictedIdle': self.evicted,
+                'healthCheckFailures': self.health_check_failures
+            }
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(connect)
+    return _pool
+
+# Check out a pooled connection to MS SQL Server; close() returns it to the pool
+def get_db_connection():
+    return get_pool().acquire()
+
+# Define the function to use a pooled connection as a unit: commit on success, roll back on error
+@contextmanager
+def db_connection(timeout=None):
+    with get_pool().connection(timeout) as conn:
+        yield conn
+
+
+class UnitOfWork:
+    """One pooled connection for everything a request does, checked out on first use.
+
+    Statements from the handler and from the helpers it calls run in one
+    transaction, committed by finish(True) or rolled back by finish(False).
+    Explicit commits inside the request still commit what has run so far
+    (e.g. before sending an email that depends on the rows).
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+        self.failed = False
+        self.finished = False
+        self.clean = False
+
+    def connection(self):
+        if self.conn is None:
+            self.conn = self.pool.acquire(wrapper=SharedConnection)
+        return self.conn
+
+    def finish(self, commit):
+        if self.conn is None or self.finished:
+            return
+        self.finished = True
+        if commit and not self.failed:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.clean = True
+
+    def release(self):
+        if self.conn is not None:
+            # Already committed or rolled back: no need for another rollback on the way back
+            conn, self.conn._conn = self.conn._conn, None
+            self.pool.release(conn, clean=self.clean and not conn.autocommit)
+            self.conn = None
+
+# Define the function to get the current request's shared connection (never close it)
+def request_connection():
+    uow = g.get('db_unit_of_work')
+    if uow is None:
+        uow = g.db_unit_of_work = UnitOfWork(get_pool())
+    return uow.connection()
+
+# Define the function to run a block in the request's unit of work, or in its own transaction outside a request
+@contextmanager
+def unit_of_work():
+    if not has_request_context():
+        with db_connection() as conn:
+            yield conn
+        return
+
+    conn = request_connection()
+    try:
+        yield conn
+    except Exception:
+        # Whatever the caller does with the error, the request's writes must not be committed
+        g.db_unit_of_work.failed = True
+        raise
+
+def _commit_unit_of_work(response):
+    uow = g.get('db_unit_of_work')
+    if uow is None:
+        return response
+    try:
+        uow.finish(commit=response.status_code < 400)
+    except pyodbc.Error as e:
+        print(f"Error committing request transaction: {e}")
+        uow.failed = True
+        response = jsonify({'error': 'Database error while saving changes'})
+        response.status_code = 500
+    return response
+
+def _end_unit_of_work(exc):
+    uow = g.pop('db_unit_of_work', None)
+    if uow is None:
+        return
+    try:
+        # Requests that never reached after_request (errors, Socket.IO events) finish here
+        uow.finish(commit=exc is None)
+    except pyodbc.Error as e:
+        print(f"Error finishing request transaction: {e}")
+    finally:
+        uow.release()
+
+# Define the function to commit/roll back the request's unit of work at the end of every request
+def init_unit_of_work(app):
+    app.after_request(_commit_unit_of_work)
+    app.teardown_request(_end_unit_of_work)
@@ -0,0 +1,294 @@
+# frame_reader.py - Frame sources for the FRT engine (synchronous and prefetching)
+
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from stage_timer import NULL_STAGE_TIMER
+
+
+# Define the function to get the presentation time of the frame just read, in seconds
+def frame_timestamp(cap, frame_index, fps):
+    msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if msec > 0:
+        return msec / 1000.0
+
+    # Some backends do not report positions; fall back to the frame index
+    return frame_index / fps
+
+
+# Define the function to view the start of a flat buffer as a contiguous (height, width, 3) image
+def buffer_view(buffer, height, width):
+    return buffer[:height * width * 3].reshape(height, width, 3)
+
+
+class FrameReader:
+    """Reads, timestamps and resizes frames from a capture on the calling thread.
+
+    Only every `stride`-th frame is retrieved and resized; the frames in
+    between are just grabbed. The initial stride is given to the constructor
+    and the consumer may change `stride` at any time.
+    With retrieve_all=True every frame is returned (e.g. for rendering) and
+    the in-between frames are flagged as not sampled.
+
+    Frames are decoded into one reused buffer and resized into a small ring of
+    preallocated buffers, so a returned frame is only valid until `buffers`
+    further frames have been read.
+
+    When the consumer sets `crop` to a normalized (x0, y0, x1, y1) box, sampled
+    frames are cut to that box from the full-resolution decode and scaled so
+    the longer side is at most the longer output side. The crop applied is
+    returned with each frame.
+
+    A StageTimer passed as timer gets the 'decode' and 'resize' stages.
+    """
+
+    def __init__(self, cap, width, height, realtime=False, retrieve_all=False, buffers=1, stride=1,
+                 timer=NULL_STAGE_TIMER):
+        self.cap = cap
+        self.size = (width, height)
+        self.realtime = realtime
+        self.retrieve_all = retrieve_all
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.stride = stride
+        self.clock_start = time.monotonic()
+        self.frame_index = 0
+        self.next_sample = 0
+        self.crop = None
+        self.max_side = max(width, height)
+        self.timer = timer
+
+        # Preallocated frame buffers, large enough for a full frame or any crop
+        self.decode_buffer = None
+        self.ring = [np.empty(self.max_side * self.max_side * 3, dtype=np.uint8) for _ in range(buffers)]
+        self.ring_slot = 0
+
+        # Counters
+        self.frames_decoded = 0
+        self.frames_retrieved = 0
+        self.decode_seconds = 0.0
+        self.allocations = len(self.ring)
+
+    def _timestamp(self):
+        if self.realtime:
+            return time.monotonic() - self.clock_start
+        return frame_timestamp(self.cap, self.frame_index, self.fps)
+
+    def _resize(self, frame, crop):
+        buffer = self.ring[self.ring_slot]
+        self.ring_slot = (self.ring_slot + 1) % len(self.ring)
+        if crop is None:
+            width, height = self.size
+            return cv2.resize(frame, self.size, dst=buffer_view(buffer, height, width)), None
+
+        frame_height, frame_width = frame.shape[:2]
+        x0, y0 = int(crop[0] * frame_width), int(crop[1] * frame_height)
+        x1, y1 = max(int(crop[2] * frame_width), x0 + 1), max(int(crop[3] * frame_height), y0 + 1)
+        region = frame[y0:y1, x0:x1]
+        scale = min(1.0, self.max_side / max(region.shape[:2]))
+        width = max(1, round(region.shape[1] * scale))
+        height = max(1, round(region.shape[0] * scale))
+        resized = cv2.resize(region, (width, height), dst=buffer_view(buffer, height, width),
+                             interpolation=cv2.INTER_AREA)
+
+        # Report the box actually cut, after rounding to whole pixels
+        return resized, (x0 / frame_width, y0 / frame_height, x1 / frame_width, y1 / frame_height)
+
+    def _next(self):
+        """Return (t, frame, image_width, sampled, crop) for the next frame, or None at the end"""
+        started = time.perf_counter()
+        timer = self.timer
+        try:
+            while self.cap.isOpened():
+                sampled = self.frame_index >= self.next_sample
+                if not sampled and not self.retrieve_all:
+                    stage_started = timer.clock()
+                    if not self.cap.grab():
+                        return None
+                    timer.lap('decode', stage_started)
+                    self.frame_index += 1
+                    self.frames_decoded += 1
+                    continue
+
+                stage_started = timer.clock()
+                ret, frame = self.cap.read(self.decode_buffer)
+                if not ret:
+                    return None
+                stage_started = timer.lap('decode', stage_started)
+                if frame is not self.decode_buffer:
+                    # First frame, the stream changed resolution, or a capture that
+                    # cannot decode in place (a frame store decodes every frame anew)
+                    self.decode_buffer = frame
+                    self.allocations += 1
+                t = self._timestamp()
+                self.frame_index += 1
+                self.frames_decoded += 1
+                self.frames_retrieved += 1
+                if sampled:
+                    self.next_sample = self.frame_index + self.stride - 1
+
+                resized, crop = self._resize(frame, self.crop if sampled else None)
+                timer.lap('resize', stage_started)
+                return t, resized, frame.shape[1], sampled, crop
+            return None
+        finally:
+            self.decode_seconds += time.perf_counter() - started
+
+    def read(self):
+        return self._next()
+
+    def stats(self):
+        return {
+            'framesDecoded': self.frames_decoded,
+            'framesRetrieved': self.frames_retrieved,
+            'decodeSeconds': round(self.decode_seconds, 3),
+            'decodeFps': round(self.frames_decoded / self.decode_seconds, 1) if self.decode_seconds else None,
+            'bufferAllocations': self.allocations,
+            'allocationsPerFrame': round(self.allocations / self.frames_retrieved, 3) if self.frames_retrieved else None
+        }
+
+    def close(self):
+        pass
+
+
+class ThreadedFrameReader(FrameReader):
+    """FrameReader that decodes on a background thread into a bounded buffer.
+
+    OpenCV decoding and MediaPipe inference both release the GIL, so decoding
+    the next frames overlaps with inference on the current one. Frames decoded
+    but never read before the reader is closed (e.g. the test ended early) are
+    counted as dropped. The consumer's time blocked on the queue is the 'queueWait'
+    stage.
+    """
+
+    def __init__(self, cap, width, height, queue_size=8, **kwargs):
+        # The ring holds every queued frame plus the one being decoded and the
+        # one being consumed, so no buffer is overwritten while still in use
+        super().__init__(cap, width, height, buffers=queue_size + 2, **kwargs)
+        self.buffer = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.wait_seconds = 0.0
+        self.depth_total = 0
+        self.depth_max = 0
+        self.reads = 0
+        self.frames_consumed = 0
+        self.thread = threading.Thread(target=self._produce, name='frt-decoder', daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            while not self.stopped.is_set():
+                item = self._next()
+                self._put(item)
+                if item is None:
+                    break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self):
+        depth = self.buffer.qsize()
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+        self.reads += 1
+
+        started = time.perf_counter()
+        item = self.buffer.get()
+        waited = time.perf_counter() - started
+        self.wait_seconds += waited
+        self.timer.add('queueWait', waited)
+
+        if isinstance(item, Exception):
+            raise item
+        if item is not None:
+            self.frames_consumed += 1
+        return item
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'queueSize': self.buffer.maxsize,
+            'queueDepthAvg': round(self.depth_total / self.reads, 2) if self.reads else 0,
+            'queueDepthMax': self.depth_max,
+            'consumerWaitSeconds': round(self.wait_seconds, 3),
+            'framesDropped': self.frames_retrieved - self.frames_consumed
+        })
+        return stats
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class FrameStoreCapture:
+    """cv2.VideoCapture look-alike over a normalized frame store (see video_ingest).
+
+    The store is a file of independently coded JPEG frames read through a
+    memory map, with the offset of every frame in its metadata, so skipped
+    frames cost nothing and a retrieved frame is one JPEG decode. Frames are
+    at a constant frame rate, so timestamps follow from the frame index.
+
+    cv2.imdecode cannot decode into an existing array, so unlike
+    cv2.VideoCapture every retrieved frame is a new allocation; the image
+    argument is ignored rather than copied into.
+    """
+
+    def __init__(self, frames_path, meta):
+        self.meta = meta
+        self.fps = float(meta['fps'])
+        self.data = np.memmap(frames_path, dtype=np.uint8, mode='r')
+        self.offsets = meta['offsets']
+        self.frames = meta['frames']
+        self.position = 0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        if not self.opened or self.position >= self.frames:
+            return False
+        self.position += 1
+        return True
+
+    def retrieve(self, image=None):
+        start, end = self.offsets[self.position - 1], self.offsets[self.position]
+        frame = cv2.imdecode(self.data[start:end], cv2.IMREAD_COLOR)
+        if frame is None:
+            return False, None
+        return True, frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            # Time of the frame just read, as reported by the FFmpeg backend
+            return max(self.position - 1, 0) * 1000.0 / self.fps
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frames)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.meta['width'])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.meta['height'])
+        return 0.0
+
+    def release(self):
+        self.opened = False
+        self.data = None
@@ -0,0 +1,354 @@
+# frt_jobs.py - Background FRT analysis jobs running on a pool of worker processes
+
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of analysis processes and how many jobs may be waiting or running at once
+FRT_WORKERS = int(os.environ.get('FRT_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+FRT_MAX_QUEUE_DEPTH = int(os.environ.get('FRT_MAX_QUEUE_DEPTH', FRT_WORKERS * 4))
+
+# Finished jobs are kept in the table for this long so clients can still poll them
+FRT_JOB_TTL_SECONDS = 60 * 60
+
+# Profile name that picks the analysis profile from the current backlog
+AUTO_PROFILE = 'auto'
+
+# Job states: queued -> running -> completed | failed
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when the analysis queue is at capacity and the caller should retry later"""
+
+
+def _init_worker():
+    # Load the default Pose model up front, in a pool owned by this worker process
+    from frt_processing import get_pose_pool
+    get_pose_pool()
+
+
+def _run_analysis(video_path, render_path=None, profile=None, stage_timing=None, video_hash=None, split_trials=False):
+    from frt_processing import analyze_frt
+
+    started_at = time.time()
+    analysis = analyze_frt(video_path, render_path=render_path, profile=profile, stage_timing=stage_timing,
+                           video_hash=video_hash, split_trials=split_trials)
+    return started_at, time.time(), analysis
+
+def _run_ingest(video_path, video_hash):
+    from video_ingest import normalize_video, apply_retention
+
+    meta = normalize_video(video_path, video_hash)
+    apply_retention()
+    return meta
+
+
+class FRTJobQueue:
+    """Bounded queue of FRT analyses executed by a pool of worker processes"""
+
+    def __init__(self, workers=FRT_WORKERS, max_depth=FRT_MAX_QUEUE_DEPTH, on_complete=None):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.on_complete = on_complete
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.ingest = {'queued': 0, 'completed': 0, 'failed': 0, 'skipped': 0, 'seconds': 0.0}
+
+        # Spawn rather than fork so no worker inherits the parent's MediaPipe threads. Spawned
+        # workers re-import the main module (app.py), which only defines create_app() at import;
+        # the initializer and the job functions live here and never import app.py themselves
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker)
+
+    def active_count(self):
+        # Ingest runs on the same workers, so it counts towards the backlog
+        return sum(1 for job in self.jobs.values() if job['status'] in (QUEUED, RUNNING)) + self.ingest['queued']
+
+    def auto_profile(self, incoming=0):
+        """Trade accuracy for throughput as the backlog grows"""
+        backlog = (self.active_count() + incoming) / self.workers
+        if backlog < 1:
+            return 'accurate'
+        if backlog < 2:
+            return 'tiered'
+        return 'fast'
+
+    def submit(self, user_id, video_path, filename=None, render_path=None, profile=None, stage_timing=None,
+               video_hash=None):
+        with self.lock:
+            self._prune()
+            if self.active_count() >= self.max_depth:
+                raise QueueFullError(f"FRT analysis queue is full ({self.max_depth} jobs)")
+            if profile == AUTO_PROFILE:
+                profile = self.auto_profile()
+            job = self._submit_locked(user_id, video_path, filename, render_path, profile, stage_timing, video_hash)
+
+        job['future'].add_done_callback(lambda f, job_id=job['jobId']: self._finish(job_id, f))
+        return self.to_dict(job)
+
+    def submit_batch(self, user_id, trials, profile=None, stage_timing=None):
+        """Queue several analyses at once, or none if the queue cannot take them all.
+
+        trials is a list of dicts with 'videoPath', 'filename', 'videoHash' and
+        'subjectId', and optionally 'splitTrials'. The jobs run in parallel on
+        the workers; use wait() to collect them.
+        """
+        with self.lock:
+            self._prune()
+            if self.active_count() + len(trials) > self.max_depth:
+                raise QueueFullError(f"FRT analysis queue cannot take {len(trials)} more jobs ({self.max_depth} max)")
+            if profile == AUTO_PROFILE:
+                # One profile for the whole batch, chosen for the backlog it creates
+                profile = self.auto_profile(incoming=len(trials) - 1)
+            jobs = [self._submit_locked(user_id, trial['videoPath'], trial['filename'], None, profile, stage_timing,
+                                        trial['videoHash'], split_trials=trial.get('splitTrials', False),
+                                        subject_id=trial['subjectId'])
+                    for trial in trials]
+
+        for job in jobs:
+            job['future'].add_done_callback(lambda f, job_id=job['jobId']: self._finish(job_id, f))
+        return [self.to_dict(job) for job in jobs]
+
+    def wait(self, job_ids, timeout=None):
+        """Block until the given jobs have finished or timeout seconds have passed; returns their current state"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for job_id in job_ids:
+            with self.lock:
+                job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            job['done'].wait(remaining)
+        return [self.get(job_id) for job_id in job_ids]
+
+    def _submit_locked(self, user_id, video_path, filename, render_path, profile, stage_timing, video_hash,
+                       split_trials=False, subject_id=None):
+        job_id = uuid.uuid4().hex
+        job = {
+            'jobId': job_id,
+            'userId': user_id,
+            'subjectId': subject_id if subject_id is not None else user_id,
+            'filename': filename or os.path.basename(video_path),
+            'status': QUEUED,
+            'profile': profile,
+            'result': None,
+            'analysis': None,
+            'error': None,
+            'submittedAt': time.time(),
+            'startedAt': None,
+            'finishedAt': None,
+            'video': (video_path, video_hash),
+            'done': threading.Event()
+        }
+        self.jobs[job_id] = job
+
+        job['future'] = self.executor.submit(_run_analysis, video_path, render_path, profile, stage_timing,
+                                             video_hash, split_trials)
+        return job
+
+    def submit_ingest(self, video_path, video_hash):
+        """Normalize a clip in the background so later analyses of it skip decoding.
+
+        Ingest is optional work: it is not queued when the analyses already
+        fill the queue. Returns whether it was queued.
+        """
+        with self.lock:
+            if self.active_count() >= self.max_depth:
+                self.ingest['skipped'] += 1
+                return False
+            self.ingest['queued'] += 1
+            future = self.executor.submit(_run_ingest, video_path, video_hash)
+        future.add_done_callback(self._finish_ingest)
+        return True
+
+    def _finish_ingest(self, future):
+        with self.lock:
+            self.ingest['queued'] -= 1
+            try:
+                meta = future.result()
+                if meta.get('skipped'):
+                    self.ingest['skipped'] += 1
+                else:
+                    self.ingest['completed'] += 1
+                    self.ingest['seconds'] += meta.get('ingestSeconds', 0.0)
+            except Exception:
+                traceback.print_exc()
+                self.ingest['failed'] += 1
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            # The executor marks a future as running once it is handed to a worker
+            if job['status'] == QUEUED and job['future'].running():
+                job['status'] = RUNNING
+            return self.to_dict(job)
+
+    def stats(self):
+        with self.lock:
+            finished = [job for job in self.jobs.values() if job['status'] in (COMPLETED, FAILED)]
+            run_times = [job['finishedAt'] - job['startedAt'] for job in finished if job['startedAt']]
+            wait_times = [job['startedAt'] - job['submittedAt'] for job in finished if job['startedAt']]
+
+            # Each worker has its own cache counters, so the hit rate is taken from the job results
+            cache_lookups = [job['analysis']['landmarkCache']['hit'] for job in finished
+                             if job['analysis'] and 'landmarkCache' in job['analysis']]
+            return {
+                'workers': self.workers,
+                'maxDepth': self.max_depth,
+                'active': self.active_count(),
+                'completed': sum(1 for job in finished if job['status'] == COMPLETED),
+                'failed': sum(1 for job in finished if job['status'] == FAILED),
+                'avgQueueSeconds': round(sum(wait_times) / len(wait_times), 3) if wait_times else None,
+                'avgRunSeconds': round(sum(run_times) / len(run_times), 3) if run_times else None,
+                'landmarkCacheHitRate': round(sum(cache_lookups) / len(cache_lookups), 3) if cache_lookups else None,
+                'profiles': self._profile_stats(finished),
+                'modelTiers': self._tier_stats(finished),
+                'modelFallbacks': sum(1 for job in finished if job['status'] == COMPLETED
+                                      and job['analysis'].get('modelFallback')),
+                'stageTimings': self._stage_stats(finished),
+                'ingest': {
+                    'queued': self.ingest['queued'],
+                    'completed': self.ingest['completed'],
+                    'failed': self.ingest['failed'],
+                    'skipped': self.ingest['skipped'],
+                    'avgSeconds': round(self.ingest['seconds'] / self.ingest['completed'], 3) if self.ingest['completed'] else None
+                },
+                'videoSources': self._source_stats(finished)
+            }
+
+    @staticmethod
+    def _profile_stats(finished):
+        profiles = {}
+        for job in finished:
+            if job['status'] != COMPLETED:
+                continue
+            stats = profiles.setdefault(job['analysis']['profile'], {'jobs': 0, 'runSeconds': 0.0})
+            stats['jobs'] += 1
+            stats['runSeconds'] += job['finishedAt'] - job['startedAt']
+        return {profile: {'jobs': stats['jobs'], 'avgRunSeconds': round(stats['runSeconds'] / stats['jobs'], 3)}
+                for profile, stats in profiles.items()}
+
+    @staticmethod
+    def _tier_stats(finished):
+        """Inference latency and landmark visibility per Pose model complexity, across jobs"""
+        tiers = {}
+        for job in finished:
+            if job['status'] != COMPLETED:
+                continue
+            for stats in job['analysis']['pipeline'].get('tiers', {}).values():
+                total = tiers.setdefault(stats['modelComplexity'], {'frames': 0, 'framesWithPose': 0,
+                                                                    'inferenceSeconds': 0.0, 'visibility': 0.0})
+                total['frames'] += stats['frames']
+                total['framesWithPose'] += stats['framesWithPose']
+                total['inferenceSeconds'] += stats['inferenceSeconds']
+                total['visibility'] += (stats['meanVisibility'] or 0) * stats['framesWithPose']
+        return {str(complexity): {
+            'frames': total['frames'],
+            'meanMs': round(1000 * total['inferenceSeconds'] / total['frames'], 2) if total['frames'] else None,
+            'detectionRate': round(total['framesWithPose'] / total['frames'], 3) if total['frames'] else None,
+            'meanVisibility': round(total['visibility'] / total['framesWithPose'], 3) if total['framesWithPose'] else None
+        } for complexity, total in sorted(tiers.items())}
+
+    @staticmethod
+    def _source_stats(finished):
+        """How many completed analyses read the normalized store rather than the original"""
+        sources = {}
+        for job in finished:
+            if job['status'] == COMPLETED:
+                source = job['analysis'].get('videoSource', 'original')
+                sources[source] = sources.get(source, 0) + 1
+        return sources
+
+    @staticmethod
+    def _stage_stats(finished):
+        """Time per pipeline stage, across the jobs that ran with stage timing"""
+        stages = {}
+        wall_seconds = 0.0
+        for job in finished:
+            if job['status'] != COMPLETED or not job['analysis'].get('stageTimings'):
+                continue
+            wall_seconds += job['analysis']['stageTimings']['wallSeconds']
+            for stage, stats in job['analysis']['stageTimings']['stages'].items():
+                total = stages.setdefault(stage, {'calls': 0, 'totalSeconds': 0.0})
+                total['calls'] += stats['calls']
+                total['totalSeconds'] += stats['totalSeconds']
+        return {stage: {
+            'calls': total['calls'],
+            'meanMs': round(1000 * total['totalSeconds'] / total['calls'], 3),
+            'share': round(total['totalSeconds'] / wall_seconds, 3) if wall_seconds else None
+        } for stage, total in stages.items()}
+
+    def _finish(self, job_id, future):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            try:
+                started_at, finished_at, analysis = future.result()
+                job.update(status=COMPLETED, startedAt=started_at, finishedAt=finished_at,
+                           analysis=analysis, result=analysis['riskLevel'])
+            except Exception as e:
+                traceback.print_exc()
+                job.update(status=FAILED, finishedAt=time.time(), error=str(e))
+            snapshot = self.to_dict(job)
+            job['done'].set()
+
+        # A re-analysis that had to decode the original gets the clip normalized for the next one
+        analysis = snapshot['analysis']
+        video_path, video_hash = job['video']
+        if (analysis and video_hash and analysis.get('videoSource') == 'original'
+                and analysis.get('landmarkCache', {}).get('reanalysis')):
+            self.submit_ingest(video_path, video_hash)
+
+        if self.on_complete is not None:
+            try:
+                self.on_complete(snapshot)
+            except Exception:
+                traceback.print_exc()
+
+    def _prune(self):
+        cutoff = time.time() - FRT_JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job['finishedAt'] and job['finishedAt'] < cutoff]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def to_dict(job):
+        """Public view of a job, including its state and timing stats"""
+        data = {key: value for key, value in job.items() if key not in ('userId', 'future', 'done', 'video')}
+        data['queueSeconds'] = round(job['startedAt'] - job['submittedAt'], 3) if job['startedAt'] else None
+        data['runSeconds'] = round(job['finishedAt'] - job['startedAt'], 3) if job['startedAt'] and job['finishedAt'] else None
+        return data
+
+    def owner(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job['userId'] if job else None
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue(on_complete=None):
+    """Return the process-wide job queue, creating the worker pool on first use"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = FRTJobQueue(on_complete=on_complete)
+        elif on_complete is not None:
+            _job_queue.on_complete = on_complete
+        return _job_queue
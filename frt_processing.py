@@ -1,12 +1,24 @@
 import cv2
 import mediapipe as mp
 import numpy as np
+import os
 import time
 import json
-
-# Initialize MediaPipe pose detection
+import threading
+from contextlib import ExitStack, contextmanager
+from pose_pool import PoseSessionPool, DEFAULT_POSE_OPTIONS
+from frame_reader import FrameReader, ThreadedFrameReader, buffer_view
+from landmark_cache import get_landmark_cache, hash_video
+from stage_timer import StageTimer, NULL_STAGE_TIMER
+from video_ingest import find_frame_store, open_video
+
+# Initialize MediaPipe pose detection. Each analysis checks out its own Pose
+# graph from a pool (see get_pose_pool) so concurrent analyses never share
+# tracking state. Pools are created on first use, so importing this module
+# (e.g. in the web process) loads no model.
 mp_pose = mp.solutions.pose
-pose = mp_pose.Pose(static_image_mode=False, model_complexity=1, enable_segmentation=False, min_detection_confidence=0.5)
+pose_pool_size = int(os.environ.get('FRT_POSE_POOL_SIZE', 4))
+default_model_complexity = DEFAULT_POSE_OPTIONS['model_complexity']
 mp_drawing = mp.solutions.drawing_utils
 
 # Initialize variables
@@ -31,30 +43,169 @@ scene_width_cm = 100
 desired_width = 520
 desired_height = 750
 
+# How long the initial posture must be held before the reach is measured
+posture_hold_seconds = 2
+
+# Posture tolerances (normalized image units) and the calibration offset of
+# the reach distance, shared by the per-frame validators and series scoring
+feet_alignment_tolerance = 0.05
+shoulder_alignment_tolerance = 0.05
+ratio_tolerance = 0.075
+arm_height_tolerance = 0.04
+foot_ground_tolerance = 0.05
+reach_offset_cm = 1
+
+# Termination policy: a test is over once the reach has fallen below
+# reach_return_fraction of its peak for reach_return_seconds, after
+# max_analysis_seconds of video, or when nobody has been detected for
+# no_person_abort_seconds
+reach_return_fraction = 0.5
+reach_return_seconds = 1.0
+max_analysis_seconds = 60
+no_person_abort_seconds = 10
+
+# Adaptive sampling for offline analysis: run inference on every Nth frame while
+# the wrist is still, and on every frame while it moves (normalized units per
+# second) and for a short window afterwards so the reach peak is not missed.
+# The speed is taken over at least wrist_motion_window_seconds, so landmark
+# jitter between consecutive frames does not keep sampling dense.
+adaptive_sample_stride = 6
+wrist_motion_threshold = 0.05
+wrist_motion_window_seconds = 0.2
+dense_sampling_seconds = 0.5
+
+# Number of decoded frames buffered ahead of inference when prefetching
+prefetch_queue_size = 4
+
+# Region-of-interest cropping: inference runs on a box around the subject,
+# padded by roi_padding of its size on every side, cut from the full-resolution
+# frame. Cropping is skipped when the box would cover more than roi_max_area of
+# the frame, and the full frame is used again whenever the subject is lost.
+roi_cropping = True
+roi_padding = 0.25
+roi_max_area = 0.8
+
+# Analysis profiles: the Pose model complexity (0 = lite, 1 = full, 2 = heavy)
+# used while waiting for the start posture ('hold') and from the moment the
+# posture is correct until the lower body moves ('measure')
+ANALYSIS_PROFILES = {
+    'fast': {'hold': 0, 'measure': 0},
+    'tiered': {'hold': 0, 'measure': 1},
+    'accurate': {'hold': 1, 'measure': 1},
+    'precise': {'hold': 1, 'measure': 2}
+}
+default_analysis_profile = os.environ.get('FRT_ANALYSIS_PROFILE', 'accurate')
+
+# Per-stage timers and frame counters attached to every analysis as
+# 'stageTimings'; off by default, and each analysis can also ask for them
+stage_timing_enabled = os.environ.get('FRT_STAGE_TIMING', '0') in ('1', 'true')
+
+# Landmark indices used by the FRT validators
+LEFT_SHOULDER = mp_pose.PoseLandmark.LEFT_SHOULDER.value
+RIGHT_SHOULDER = mp_pose.PoseLandmark.RIGHT_SHOULDER.value
+RIGHT_ELBOW = mp_pose.PoseLandmark.RIGHT_ELBOW.value
+RIGHT_WRIST = mp_pose.PoseLandmark.RIGHT_WRIST.value
+LEFT_HIP = mp_pose.PoseLandmark.LEFT_HIP.value
+RIGHT_HIP = mp_pose.PoseLandmark.RIGHT_HIP.value
+LEFT_KNEE = mp_pose.PoseLandmark.LEFT_KNEE.value
+RIGHT_KNEE = mp_pose.PoseLandmark.RIGHT_KNEE.value
+LEFT_ANKLE = mp_pose.PoseLandmark.LEFT_ANKLE.value
+RIGHT_ANKLE = mp_pose.PoseLandmark.RIGHT_ANKLE.value
+LEFT_FOOT_INDEX = mp_pose.PoseLandmark.LEFT_FOOT_INDEX.value
+RIGHT_FOOT_INDEX = mp_pose.PoseLandmark.RIGHT_FOOT_INDEX.value
+
+# (left, right) index pairs for the per-side computations
+HIPS = np.array([LEFT_HIP, RIGHT_HIP])
+KNEES = np.array([LEFT_KNEE, RIGHT_KNEE])
+ANKLES = np.array([LEFT_ANKLE, RIGHT_ANKLE])
+FOOT_INDEXES = np.array([LEFT_FOOT_INDEX, RIGHT_FOOT_INDEX])
+
+NUM_LANDMARKS = 33
+
+# One pool per model complexity; the default model's pool starts with one graph loaded
+pose_pools = {}
+_pose_pools_lock = threading.Lock()
+
+# Complexities whose model could not be loaded (its asset is missing and could not be
+# downloaded), with the time until which they are skipped; they are tried again after
+# model_retry_seconds. Other errors only make the current analysis fall back.
+model_retry_seconds = 600
+_unavailable_models = {}
+
+def unavailable_models():
+    """Complexities currently skipped because their model could not be loaded"""
+    now = time.monotonic()
+    return sorted(complexity for complexity, until in list(_unavailable_models.items()) if until > now)
+
+def get_pose_pool(model_complexity=default_model_complexity):
+    """Return the Pose session pool for a model complexity, creating it on first use"""
+    with _pose_pools_lock:
+        pool = pose_pools.get(model_complexity)
+        if pool is None:
+            size = 1 if model_complexity == default_model_complexity else 0
+            pool = pose_pools[model_complexity] = PoseSessionPool(size=size, max_size=pose_pool_size,
+                                                                  model_complexity=model_complexity)
+        return pool
+
+@contextmanager
+def pose_session(model_complexity):
+    """Check out a Pose graph, falling back to the nearest model that can be loaded.
+
+    Lighter models are tried before heavier ones. Yields (model_complexity
+    actually used, pose).
+    """
+    candidates = [model_complexity] + list(range(model_complexity - 1, -1, -1)) + list(range(model_complexity + 1, 3))
+    skipped = unavailable_models()
+    for complexity in candidates:
+        if complexity in skipped:
+            continue
+        try:
+            pool = get_pose_pool(complexity)
+            pose = pool.acquire()
+        except TimeoutError:
+            raise
+        except (OSError, ImportError) as e:
+            # Missing model asset, or it could not be downloaded
+            print(f"Pose model complexity {complexity} unavailable for {model_retry_seconds} s, "
+                  f"falling back: {str(e)}")
+            _unavailable_models[complexity] = time.monotonic() + model_retry_seconds
+            continue
+        except Exception as e:
+            print(f"Pose model complexity {complexity} failed to start, falling back for this analysis: {str(e)}")
+            continue
+        try:
+            yield complexity, pose
+        finally:
+            pool.release(pose)
+        return
+    raise RuntimeError("No Pose model could be loaded")
+
+# Define the function to convert MediaPipe landmarks into a (33, 4) float32 array of x, y, z, visibility
+def landmarks_to_array(landmarks, out=None):
+    if out is None:
+        out = np.empty((NUM_LANDMARKS, 4), dtype=np.float32)
+    out[:] = [(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks]
+    return out
+
+def _as_points(landmarks):
+    # Validators accept either a landmark array or raw MediaPipe landmarks
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    return landmarks_to_array(landmarks)
+
+def _isclose(a, b, atol):
+    # Scalar equivalent of np.isclose(a, b, atol=atol) without the array overhead
+    return abs(a - b) <= atol + 1e-05 * abs(b)
+
 # Define the function to calculate the ratio of distances between key landmarks
 def calculate_ratios(landmarks):
-    left_hip = np.array([landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].x,
-                         landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].y])
-    right_hip = np.array([landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].x,
-                          landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].y])
-    left_knee = np.array([landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value].x,
-                          landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value].y])
-    right_knee = np.array([landmarks[mp_pose.PoseLandmark.RIGHT_KNEE.value].x,
-                           landmarks[mp_pose.PoseLandmark.RIGHT_KNEE.value].y])
-    left_ankle = np.array([landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].x,
-                           landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].y])
-    right_ankle = np.array([landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].x,
-                            landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].y])
-    
-    hip_to_knee_left = np.linalg.norm(left_hip - left_knee)
-    knee_to_ankle_left = np.linalg.norm(left_knee - left_ankle)
-    hip_to_knee_right = np.linalg.norm(right_hip - right_knee)
-    knee_to_ankle_right = np.linalg.norm(right_knee - right_ankle)
-    
-    ratio_left = hip_to_knee_left / knee_to_ankle_left if knee_to_ankle_left != 0 else 0
-    ratio_right = hip_to_knee_right / knee_to_ankle_right if knee_to_ankle_right != 0 else 0
-    
-    return ratio_left, ratio_right
+    xy = _as_points(landmarks)[:, :2]
+
+    hip_to_knee = np.linalg.norm(xy[HIPS] - xy[KNEES], axis=1)
+    knee_to_ankle = np.linalg.norm(xy[KNEES] - xy[ANKLES], axis=1)
+    ratios = np.divide(hip_to_knee, knee_to_ankle, out=np.zeros(2, dtype=np.float32), where=knee_to_ankle != 0)
+
+    return float(ratios[0]), float(ratios[1])
 
 def calculate_angle(a, b, c):
     ab = np.array(b) - np.array(a)
@@ -67,74 +218,43 @@ def calculate_angle(a, b, c):
 # Define the function to validate the initial posture
 def validate_posture(landmarks):
     issues = []
-
-    # Extract required landmarks
-    left_shoulder = [landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].x,
-                     landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-    right_shoulder = [landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value].x,
-                      landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value].y]
-    left_hip = [landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].x,
-                landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].y]
-    right_hip = [landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].x,
-                 landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].y]
-    left_ankle = [landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].x,
-                  landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].y]
-    right_ankle = [landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].x,
-                   landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].y]
+    xy = _as_points(landmarks)[:, :2]
 
     # Calculate midpoints
-    shoulder_midpoint = [(left_shoulder[0] + right_shoulder[0]) / 2, (left_shoulder[1] + right_shoulder[1]) / 2]
-    hip_midpoint = [(left_hip[0] + right_hip[0]) / 2, (left_hip[1] + right_hip[1]) / 2]
+    shoulder_midpoint = (xy[LEFT_SHOULDER] + xy[RIGHT_SHOULDER]) / 2
+    hip_midpoint = (xy[LEFT_HIP] + xy[RIGHT_HIP]) / 2
 
     # Validate feet position
-    if not np.isclose(left_ankle[1], right_ankle[1], atol=0.05):
+    if not _isclose(xy[LEFT_ANKLE, 1], xy[RIGHT_ANKLE, 1], atol=feet_alignment_tolerance):
         issues.append("Feet should be flat on the floor and aligned.")
 
     # Validate upright posture
-    if shoulder_midpoint[0] < hip_midpoint[0] - 0.05 or shoulder_midpoint[0] > hip_midpoint[0] + 0.05:
+    if (shoulder_midpoint[0] < hip_midpoint[0] - shoulder_alignment_tolerance
+            or shoulder_midpoint[0] > hip_midpoint[0] + shoulder_alignment_tolerance):
         issues.append("Shoulders should be aligned with the hips.")
 
     # Validate arm position (assuming right arm is used for the reach)
-    right_wrist = [landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                   landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-    right_elbow = [landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value].x,
-                   landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value].y]
-
-    if not np.isclose(right_elbow[1], shoulder_midpoint[1], atol=0.1 * (1 + uncertainty)) or right_wrist[1] > right_elbow[1]:
+    right_elbow_y = xy[RIGHT_ELBOW, 1]
+    if not _isclose(right_elbow_y, shoulder_midpoint[1], atol=0.1 * (1 + uncertainty)) or xy[RIGHT_WRIST, 1] > right_elbow_y:
         issues.append("Right arm should be extended forward at shoulder height.")
 
     return issues
 
 # Define the function to get the right arm position
 def get_right_arm_position(landmarks):
-    right_shoulder = [landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value].x,
-                      landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value].y]
-    right_elbow = [landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value].x,
-                   landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value].y]
-    right_wrist = [landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                   landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-    
-    return right_shoulder, right_elbow, right_wrist
+    xy = _as_points(landmarks)[:, :2]
+    return xy[RIGHT_SHOULDER], xy[RIGHT_ELBOW], xy[RIGHT_WRIST]
 
 def validate_feet_touching_ground(landmarks, initial_foot_height):
     issues = []
-
-    # Extract required landmarks
-    left_ankle_y = landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].y
-    right_ankle_y = landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].y
-    left_foot_index_y = landmarks[mp_pose.PoseLandmark.LEFT_FOOT_INDEX.value].y
-    right_foot_index_y = landmarks[mp_pose.PoseLandmark.RIGHT_FOOT_INDEX.value].y
-
-    # Tolerance for considering the feet to be touching the ground
-    foot_tolerance = 0.05
+    y = _as_points(landmarks)[:, 1]
 
     # Validate feet touching the ground
-    if abs(left_foot_index_y - left_ankle_y) > foot_tolerance:
-        print("Left Foot: ------------ ",abs(left_foot_index_y - left_ankle_y))
+    left_gap, right_gap = np.abs(y[FOOT_INDEXES] - y[ANKLES])
+    if left_gap > foot_ground_tolerance:
         issues.append("Left foot should be touching the ground.")
 
-    if abs(right_foot_index_y - right_ankle_y) > foot_tolerance:
-        print("Right Foot: +++++++++++", abs(right_foot_index_y - right_ankle_y))
+    if right_gap > foot_ground_tolerance:
         issues.append("Right foot should be touching the ground.")
 
     return issues
@@ -142,301 +262,851 @@ def validate_feet_touching_ground(landmarks, initial_foot_height):
 # Define the function to validate the lower body posture
 def validate_lower_body_posture(landmarks, initial_ratios):
     issues = []
-
-    left_ankle = [landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].x,
-                  landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value].y]
-    right_ankle = [landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].x,
-                   landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value].y]
-    left_foot_index = [landmarks[mp_pose.PoseLandmark.LEFT_FOOT_INDEX.value].x,
-                       landmarks[mp_pose.PoseLandmark.LEFT_FOOT_INDEX.value].y]
-    right_foot_index = [landmarks[mp_pose.PoseLandmark.RIGHT_FOOT_INDEX.value].x,
-                        landmarks[mp_pose.PoseLandmark.RIGHT_FOOT_INDEX.value].y]
-    right_shoulder, right_elbow, right_wrist = get_right_arm_position(landmarks)
+    points = _as_points(landmarks)
+    right_shoulder, right_elbow, right_wrist = get_right_arm_position(points)
 
     # Validate lower body ratios
-    current_ratios = calculate_ratios(landmarks)
+    current_ratios = calculate_ratios(points)
     for initial, current in zip(initial_ratios, current_ratios):
-        if not np.isclose(initial, current, atol=0.075):
-            print("Difference in Ratios: ", (initial - current))
+        if not _isclose(initial, current, atol=ratio_tolerance):
             issues.append("Lower body alignment has changed.")
 
-    # Validate arm position
-    shoulder_midpoint = [(right_shoulder[0] + right_elbow[0]) / 2, (right_shoulder[1] + right_elbow[1]) / 2]
-    wrist_midpoint = right_wrist  # Right wrist is the target position for validation
-
-    # Check if the elbow is at a similar height as the shoulder
-    if not np.isclose(shoulder_midpoint[1], wrist_midpoint[1], atol=0.04):
+    # Check if the wrist is at the height of the shoulder-elbow midpoint
+    shoulder_midpoint_y = (right_shoulder[1] + right_elbow[1]) / 2
+    if not _isclose(shoulder_midpoint_y, right_wrist[1], atol=arm_height_tolerance):
         issues.append("Arm should be extended forward at shoulder height.")
 
-     # Validate that feet are touching the ground
-    feet_issues = validate_feet_touching_ground(landmarks, initial_foot_height)
-    issues.extend(feet_issues)
-
+    # Validate that feet are touching the ground
+    issues.extend(validate_feet_touching_ground(points, initial_foot_height))
 
     return issues
 
 # Define the function to calculate distance in cm
 def calculate_distance(initial, final, image_width):
-    if initial and final:
-        distance = np.sqrt((final[0] - initial[0])**2 + (final[1] - initial[1])**2)
-        distance_cm = distance * image_width * (scene_width_cm / image_width)
-        print(distance_cm)
-        return distance_cm
+    if initial is not None and final is not None:
+        distance = np.hypot(final[0] - initial[0], final[1] - initial[1])
+        return float(distance * image_width * (scene_width_cm / image_width))
     return 0
 
-def process_frt(video_path,
-initial_position = None,
-final_position = None,
-pose_correct = False,
-pose_start_time = None,
-measurement_started = False,
-initial_hip_position = None,
-initial_knee_position = None,
-initial_ankle_position = None,
-initial_foot_height = None,
-initial_right_arm_position = None,
-initial_ratios = None,
-max_distance_cm = 0,
-uncertainty = 0.1,
-scene_width_cm = 100,
-
-desired_width = 520,
-desired_height = 750):
-    # Open the video file
+# Define the function to map the maximum reach distance to a fall-risk category. The reach is
+# rounded as it is reported (to 0.01 cm) first, so the category always matches the reported
+# maxDistance, and float32 and float64 computations of the same reach agree
+def risk_level(max_distance_cm):
+    max_distance_cm = round(float(max_distance_cm), 2)
+    if max_distance_cm >= 25:
+        return "Low risk of falls"
+    elif 15 <= max_distance_cm < 25:
+        return "Risk of falling is 2x greater than normal"
+    elif max_distance_cm < 15 and max_distance_cm > 0:
+        return "Risk of falling is 4x greater than normal"
+    return None
+
+class FRTSession:
+    """State of one FRT, advanced one frame at a time.
+
+    feed() takes the landmarks of a frame (a (33, 4) array, MediaPipe
+    landmarks, or None when no pose was detected) and its time in seconds,
+    and returns the feedback for that frame. The same session drives the
+    per-frame engine and live streaming. to_dict() and from_dict()
+    checkpoint the state so a test can resume on another worker.
+
+    risk is the provisional result for the reach measured so far; once the
+    termination policy ends the test, finished holds the reason
+    ('reach_returned', 'max_window' or 'no_person') and further frames are
+    ignored.
+    """
+
+    __slots__ = ('initial_position', 'initial_ratios', 'pose_correct', 'pose_start_time',
+                 'max_distance_cm', 'risk', 'last_time', 'first_time', 'last_pose_time',
+                 'returned_since', 'finished')
+
+    def __init__(self):
+        self.initial_position = None
+        self.initial_ratios = None
+        self.pose_correct = False
+        self.pose_start_time = None
+        self.max_distance_cm = 0
+        self.risk = None
+        self.last_time = None
+        self.first_time = None
+        self.last_pose_time = None
+        self.returned_since = None
+        self.finished = None
+
+    @property
+    def posture_seen(self):
+        """True from the first frame of a correct start posture until the lower body moves"""
+        return self.pose_correct or self.pose_start_time is not None
+
+    def finish(self, reason):
+        if self.finished is None:
+            self.finished = reason
+
+    def feed(self, landmarks, t):
+        feedback = {'issues': [], 'posture': None, 'distance': None}
+        if self.finished is not None:
+            return feedback
+        if self.first_time is None:
+            self.first_time = t
+        self.last_time = t
+
+        if landmarks is None:
+            last_seen = self.last_pose_time if self.last_pose_time is not None else self.first_time
+            if t - last_seen >= no_person_abort_seconds:
+                self.finish('no_person')
+            elif t - self.first_time >= max_analysis_seconds:
+                self.finish('max_window')
+            return feedback
+        self.last_pose_time = t
+
+        points = _as_points(landmarks)
+        wrist = points[RIGHT_WRIST, :2]
+
+        # Validate the initial posture until it has been held for 2 seconds
+        if not self.pose_correct:
+            feedback['issues'] = validate_posture(points)
+            if feedback['issues']:
+                self.pose_start_time = None
+                feedback['posture'] = 'Incorrect'
+            elif self.pose_start_time is None:
+                self.pose_start_time = t
+            elif t - self.pose_start_time >= posture_hold_seconds:
+                self.pose_correct = True
+                self.initial_position = (float(wrist[0]), float(wrist[1]))
+                self.initial_ratios = calculate_ratios(points)
+                feedback['posture'] = 'Correct'
+
+        # Measure the reach while the lower body stays in place
+        if self.pose_correct:
+            feedback['issues'] = validate_lower_body_posture(points, self.initial_ratios)
+            if feedback['issues']:
+                self.pose_correct = False
+                self.pose_start_time = None
+                feedback['posture'] = 'Incorrect'
+            else:
+                feedback['distance'] = calculate_distance(self.initial_position, wrist, desired_width)
+                self.max_distance_cm = max(self.max_distance_cm, feedback['distance'] - reach_offset_cm)
+
+        self.risk = risk_level(self.max_distance_cm)
+
+        # The test is over once the wrist has come back from its peak, or the
+        # lower body has moved, for long enough
+        if self.max_distance_cm > 0:
+            reach = feedback['distance'] - reach_offset_cm if feedback['distance'] is not None else None
+            if reach is None or reach < reach_return_fraction * self.max_distance_cm:
+                if self.returned_since is None:
+                    self.returned_since = t
+                if t - self.returned_since >= reach_return_seconds:
+                    self.finish('reach_returned')
+            else:
+                self.returned_since = None
+
+        if t - self.first_time >= max_analysis_seconds:
+            self.finish('max_window')
+        return feedback
+
+    def result(self):
+        return {'riskLevel': self.risk, 'maxDistance': round(max(self.max_distance_cm, 0), 2),
+                'termination': self.finished}
+
+    def to_dict(self):
+        return {
+            'initialPosition': self.initial_position,
+            'initialRatios': self.initial_ratios,
+            'poseCorrect': self.pose_correct,
+            'poseStartTime': self.pose_start_time,
+            'maxDistance': self.max_distance_cm,
+            'lastTime': self.last_time,
+            'firstTime': self.first_time,
+            'lastPoseTime': self.last_pose_time,
+            'returnedSince': self.returned_since,
+            'finished': self.finished
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        session = cls()
+        session.initial_position = tuple(data['initialPosition']) if data['initialPosition'] else None
+        session.initial_ratios = tuple(data['initialRatios']) if data['initialRatios'] else None
+        session.pose_correct = data['poseCorrect']
+        session.pose_start_time = data['poseStartTime']
+        session.max_distance_cm = data['maxDistance']
+        session.last_time = data['lastTime']
+        session.first_time = data['firstTime']
+        session.last_pose_time = data['lastPoseTime']
+        session.returned_since = data['returnedSince']
+        session.finished = data['finished']
+        session.risk = risk_level(session.max_distance_cm)
+        return session
+
+# Define the function to draw the pose skeleton and FRT feedback onto a BGR frame
+def draw_overlay(image, pose_landmarks, overlay):
+    mp_drawing.draw_landmarks(image, pose_landmarks, mp_pose.POSE_CONNECTIONS)
+
+    issues = overlay['issues']
+    for i, issue in enumerate(issues):
+        cv2.putText(image, issue, (10, 30 + i * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
+
+    if overlay['posture'] == 'Incorrect':
+        cv2.putText(image, "Posture: Incorrect", (10, 50 + len(issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
+    elif overlay['posture'] == 'Correct':
+        cv2.putText(image, "Posture: Correct", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2, cv2.LINE_AA)
+
+    if overlay['distance'] is not None:
+        cv2.putText(image, f"Distance: {overlay['distance']:.2f} cm", (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2, cv2.LINE_AA)
+    cv2.putText(image, f"Max Distance: {overlay['max_distance']:.2f} cm", (10, 120 + len(issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2, cv2.LINE_AA)
+
+
+class AnnotatedVideoSink:
+    """Writes annotated frames to a video file so headless analyses can be audited"""
+
+    def __init__(self, output_path, fps=30.0, frame_size=(desired_width, desired_height)):
+        self.output_path = output_path
+        self.writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
+
+    def write(self, image, pose_landmarks, overlay):
+        if pose_landmarks is not None:
+            draw_overlay(image, pose_landmarks, overlay)
+        self.writer.write(image)
+        return True
+
+    def close(self):
+        self.writer.release()
+
+
+class PreviewWindowSink:
+    """Shows annotated frames in an OpenCV window (desktop use only, needs a display)"""
+
+    def __init__(self, window_name='Functional Reach Test'):
+        self.window_name = window_name
+
+    def write(self, image, pose_landmarks, overlay):
+        if pose_landmarks is not None:
+            draw_overlay(image, pose_landmarks, overlay)
+        cv2.imshow(self.window_name, image)
+
+        # Stop when ESC is pressed
+        return cv2.waitKey(10) & 0xFF != 27
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+class _AdaptiveStride:
+    """Chooses the sampling stride from the right wrist's speed between inferred frames"""
+
+    def __init__(self, sample_stride):
+        self.sample_stride = sample_stride
+        self.last_wrist = None
+        self.last_time = None
+        self.dense_until = None
+
+    def update(self, t, wrist):
+        if wrist is not None:
+            if self.last_wrist is None or t < self.last_time:
+                self.last_wrist, self.last_time = wrist, t
+            elif t - self.last_time >= wrist_motion_window_seconds:
+                speed = np.hypot(wrist[0] - self.last_wrist[0], wrist[1] - self.last_wrist[1]) / (t - self.last_time)
+                if speed > wrist_motion_threshold:
+                    self.dense_until = t + dense_sampling_seconds
+                self.last_wrist, self.last_time = wrist, t
+
+        # Sample every frame while the wrist moves and shortly after it settles
+        if self.dense_until is not None and t < self.dense_until:
+            return 1
+        return self.sample_stride
+
+class _TierStats:
+    """Per-tier inference latency and landmark quality"""
+
+    def __init__(self):
+        self.tiers = {}
+
+    def record(self, tier, seconds, points):
+        stats = self.tiers.setdefault(tier, {'frames': 0, 'framesWithPose': 0, 'inferenceSeconds': 0.0,
+                                             'visibility': 0.0})
+        stats['frames'] += 1
+        stats['inferenceSeconds'] += seconds
+        if points is not None:
+            stats['framesWithPose'] += 1
+            stats['visibility'] += float(points[:, 3].mean())
+
+    def stats(self):
+        return {tier: {
+            'frames': stats['frames'],
+            'framesWithPose': stats['framesWithPose'],
+            'inferenceSeconds': round(stats['inferenceSeconds'], 3),
+            'meanMs': round(1000 * stats['inferenceSeconds'] / stats['frames'], 2),
+            'meanVisibility': round(stats['visibility'] / stats['framesWithPose'], 3) if stats['framesWithPose'] else None
+        } for tier, stats in self.tiers.items()}
+
+class _RoiTracker:
+    """Derives the crop for the next inference from the latest landmarks.
+
+    The crop is kept while the subject stays well inside it, so Pose's own
+    tracking sees a stable image, and is recomputed when the subject nears an
+    edge or occupies much less of it than it could.
+    """
+
+    def __init__(self):
+        self.crop = None
+
+    def update(self, points):
+        if points is None:
+            # Tracking lost: search the whole frame again
+            self.crop = None
+            return None
+
+        x0, y0 = np.clip(points[:, :2].min(axis=0), 0, 1)
+        x1, y1 = np.clip(points[:, :2].max(axis=0), 0, 1)
+        pad_x = (x1 - x0) * roi_padding
+        pad_y = (y1 - y0) * roi_padding
+
+        if self.crop is not None:
+            cx0, cy0, cx1, cy1 = self.crop
+            inside = (x0 - pad_x / 2 >= cx0 and y0 - pad_y / 2 >= cy0
+                      and x1 + pad_x / 2 <= cx1 and y1 + pad_y / 2 <= cy1)
+            loose = (cx1 - cx0) * (cy1 - cy0) > 2 * (x1 - x0 + 2 * pad_x) * (y1 - y0 + 2 * pad_y)
+            if inside and not loose:
+                return self.crop
+
+        box = (max(0.0, x0 - pad_x), max(0.0, y0 - pad_y), min(1.0, x1 + pad_x), min(1.0, y1 + pad_y))
+        self.crop = box if (box[2] - box[0]) * (box[3] - box[1]) <= roi_max_area else None
+        return self.crop
+
+# Define the function to map landmarks inferred on a crop back to full-frame coordinates
+def _uncrop(points, crop):
+    if crop is not None:
+        x0, y0, x1, y1 = crop
+        points[:, 0] = x0 + points[:, 0] * (x1 - x0)
+        points[:, 1] = y0 + points[:, 1] * (y1 - y0)
+        # Pose scales z like x
+        points[:, 2] *= x1 - x0
+    return points
+
+def _open_reader(cap, prefetch, realtime=False, retrieve_all=False, stride=1, timer=NULL_STAGE_TIMER):
+    if prefetch:
+        return ThreadedFrameReader(cap, desired_width, desired_height, realtime=realtime,
+                                   retrieve_all=retrieve_all, stride=stride, queue_size=prefetch_queue_size,
+                                   timer=timer)
+    return FrameReader(cap, desired_width, desired_height, realtime=realtime, retrieve_all=retrieve_all,
+                       stride=stride, timer=timer)
+
+def _count_frames(timer, reader, frames_inferred, frames_with_pose):
+    # Frame counters come from the reader's own counts, so nothing is counted per frame
+    if not timer.enabled:
+        return
+    stats = reader.stats()
+    timer.count('framesDecoded', stats['framesDecoded'])
+    timer.count('framesSkipped', stats['framesDecoded'] - stats['framesRetrieved'])
+    timer.count('framesDropped', stats.get('framesDropped', 0))
+    timer.count('framesInferred', frames_inferred)
+    timer.count('framesWithPose', frames_with_pose)
+
+def _run_frt(cap, pose, sink=None, realtime=False, sample_stride=1, prefetch=False, measure_pose=None,
+             timer=NULL_STAGE_TIMER):
+    """Run the FRT state machine over an open capture.
+
+    Drawing only happens when a sink is given; without one the loop does no
+    rendering at all, so its cost is bound by decoding and pose inference.
+
+    Time is taken from the video itself (frame timestamps), so the result does
+    not depend on how fast frames are processed. Only live capture
+    (realtime=True) uses the wall clock.
+
+    With sample_stride > 1 only every Nth frame is inferred until the wrist
+    starts moving, then every frame until it has settled again. With
+    prefetch=True frames are decoded on a background thread while the
+    current frame is being inferred. Without a sink, inference runs on a crop
+    around the subject (see roi_cropping). With measure_pose, that graph is
+    used from the moment the start posture is seen, and pose only before.
+    A StageTimer passed as timer gets every stage of the loop and the frame
+    counters.
+    """
+    reader = _open_reader(cap, prefetch, realtime=realtime, retrieve_all=sink is not None, stride=sample_stride,
+                          timer=timer)
+    sampler = _AdaptiveStride(sample_stride)
+    roi = _RoiTracker() if roi_cropping and sink is None else None
+    tier_stats = _TierStats()
+
+    t = 0.0
+    frt = FRTSession()
+    frames_inferred = 0
+    frames_with_pose = 0
+    inference_seconds = 0.0
+
+    # RGB buffer reused for every inference; Pose copies the pixels it needs
+    rgb_buffer = np.empty(reader.max_side * reader.max_side * 3, dtype=np.uint8)
+    points = np.empty((NUM_LANDMARKS, 4), dtype=np.float32)
+
+    try:
+        while True:
+            item = reader.read()
+            if item is None:
+                break
+            t, frame, image_width, sampled, crop = item
+
+            # Frames between samples are only rendered, never inferred
+            if not sampled:
+                stage_started = timer.clock()
+                written = sink.write(frame, None, None)
+                timer.lap('render', stage_started)
+                if not written:
+                    break
+                continue
+
+            # Convert the BGR image to RGB and detect the pose
+            started = time.perf_counter()
+            stage_started = timer.clock()
+            image = buffer_view(rgb_buffer, *frame.shape[:2])
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=image)
+            image.flags.writeable = False
+            stage_started = timer.lap('color', stage_started)
+            measuring = measure_pose is not None and frt.posture_seen
+            results = (measure_pose if measuring else pose).process(image)
+            stage_started = timer.lap('inference', stage_started)
+            elapsed = time.perf_counter() - started
+            inference_seconds += elapsed
+            frames_inferred += 1
+
+            overlay = None
+            wrist = None
+            if results.pose_landmarks:
+                frames_with_pose += 1
+                _uncrop(landmarks_to_array(results.pose_landmarks.landmark, out=points), crop)
+                wrist = points[RIGHT_WRIST, :2].copy()
+                stage_started = timer.lap('landmarks', stage_started)
+                feedback = frt.feed(points, t)
+                if sink is not None:
+                    overlay = dict(feedback, max_distance=frt.max_distance_cm)
+            else:
+                frt.feed(None, t)
+            stage_started = timer.lap('validation', stage_started)
+            tier_stats.record('measure' if measuring else 'hold', elapsed, points if wrist is not None else None)
+
+            if sink is not None:
+                written = sink.write(frame, results.pose_landmarks, overlay)
+                timer.lap('render', stage_started)
+                if not written:
+                    frt.finish('stopped')
+                    break
+            if frt.finished is not None:
+                break
+
+            reader.stride = sampler.update(t, wrist)
+            if roi is not None:
+                reader.crop = roi.update(points if results.pose_landmarks else None)
+    finally:
+        reader.close()
+
+    frt.finish('end_of_video')
+    _count_frames(timer, reader, frames_inferred, frames_with_pose)
+    analysis = frt.result()
+    analysis.update({
+        'framesDecoded': reader.frames_decoded,
+        'framesInferred': frames_inferred,
+        'framesWithPose': frames_with_pose,
+        'videoSeconds': round(t, 3),
+        'pipeline': dict(reader.stats(),
+                         inferenceSeconds=round(inference_seconds, 3),
+                         inferenceFps=round(frames_inferred / inference_seconds, 1) if inference_seconds else None,
+                         tiers=tier_stats.stats())
+    })
+    return analysis
+
+def extract_landmark_series(cap, pose, sample_stride=1, prefetch=False, measure_pose=None, timer=NULL_STAGE_TIMER,
+                            until_end=False):
+    """Phase 1 of the offline engine: run pose inference over a whole clip.
+
+    Returns the landmarks of every inferred frame as a (frames, 33, 4) float32
+    array (NaN where no pose was found) with the matching timestamps, so the
+    clip can be scored, and re-scored, without touching the video again.
+
+    An FRTSession follows the test as frames are extracted: extraction stops
+    as soon as the termination policy ends it, and with measure_pose that
+    graph is used from the moment the start posture is seen. timer works as
+    in _run_frt. With until_end=True the whole clip is extracted regardless,
+    for recordings that hold several trials (see split_landmark_series) and
+    for scoring with thresholds other than the module settings.
+    """
+    reader = _open_reader(cap, prefetch, stride=sample_stride, timer=timer)
+    sampler = _AdaptiveStride(sample_stride)
+    roi = _RoiTracker() if roi_cropping else None
+    frt = FRTSession()
+    tier_stats = _TierStats()
+    measuring = False
+
+    times = []
+    series = []
+    image_width = None
+    inference_seconds = 0.0
+    frames_cropped = 0
+    frames_with_pose = 0
+    rgb_buffer = np.empty(reader.max_side * reader.max_side * 3, dtype=np.uint8)
+
+    try:
+        while True:
+            item = reader.read()
+            if item is None:
+                break
+            t, frame, image_width, _, crop = item
+
+            started = time.perf_counter()
+            stage_started = timer.clock()
+            image = buffer_view(rgb_buffer, *frame.shape[:2])
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=image)
+            image.flags.writeable = False
+            stage_started = timer.lap('color', stage_started)
+            results = (measure_pose if measuring else pose).process(image)
+            stage_started = timer.lap('inference', stage_started)
+            elapsed = time.perf_counter() - started
+            inference_seconds += elapsed
+            frames_cropped += crop is not None
+
+            points = np.full((NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+            wrist = None
+            if results.pose_landmarks:
+                frames_with_pose += 1
+                _uncrop(landmarks_to_array(results.pose_landmarks.landmark, out=points), crop)
+                wrist = points[RIGHT_WRIST, :2]
+                stage_started = timer.lap('landmarks', stage_started)
+            times.append(t)
+            series.append(points)
+            tier_stats.record('measure' if measuring else 'hold', elapsed, points if wrist is not None else None)
+            frt.feed(points if wrist is not None else None, t)
+            timer.lap('validation', stage_started)
+            if frt.finished is not None and not until_end:
+                break
+            measuring = measure_pose is not None and frt.posture_seen
+
+            reader.stride = sampler.update(t, wrist)
+            if roi is not None:
+                reader.crop = roi.update(points if wrist is not None else None)
+    finally:
+        reader.close()
+
+    frames_inferred = len(series)
+    _count_frames(timer, reader, frames_inferred, frames_with_pose)
+    timer.count('framesCropped', frames_cropped)
+    return {
+        'times': np.array(times, dtype=np.float64),
+        'points': np.stack(series) if series else np.empty((0, NUM_LANDMARKS, 4), dtype=np.float32),
+        'imageWidth': image_width,
+        'framesDecoded': reader.frames_decoded,
+        'pipeline': dict(reader.stats(),
+                         inferenceSeconds=round(inference_seconds, 3),
+                         inferenceFps=round(frames_inferred / inference_seconds, 1) if inference_seconds else None,
+                         framesCropped=frames_cropped,
+                         tiers=tier_stats.stats())
+    }
+
+def _isclose_v(a, b, atol):
+    # Element-wise version of _isclose
+    return np.abs(a - b) <= atol + 1e-05 * np.abs(b)
+
+def score_landmark_series(series, uncertainty=uncertainty, scene_width_cm=scene_width_cm,
+                          hold_seconds=posture_hold_seconds,
+                          feet_alignment_tolerance=feet_alignment_tolerance,
+                          shoulder_alignment_tolerance=shoulder_alignment_tolerance,
+                          ratio_tolerance=ratio_tolerance, arm_height_tolerance=arm_height_tolerance,
+                          foot_ground_tolerance=foot_ground_tolerance, reach_offset_cm=reach_offset_cm,
+                          reach_return_fraction=reach_return_fraction, reach_return_seconds=reach_return_seconds,
+                          max_analysis_seconds=max_analysis_seconds, no_person_abort_seconds=no_person_abort_seconds):
+    """Phase 2 of the offline engine: score a landmark series with NumPy.
+
+    Evaluates the same rules and termination policy as FRTSession, but over
+    the whole clip at once. Every threshold defaults to the module setting and
+    can be overridden, so re-scoring a stored series costs no inference at all.
+    """
+    times = series['times']
+    detected = ~np.isnan(series['points'][:, 0, 0])
+
+    # Cut the series where nobody has been seen for too long, or at the end of the analysis window
+    end_all = len(times)
+    termination = 'end_of_video'
+    if end_all:
+        last_seen = np.maximum.accumulate(np.where(detected, times, times[0]))
+        absent = np.flatnonzero(~detected & (times - last_seen >= no_person_abort_seconds))
+        window = np.flatnonzero(times - times[0] >= max_analysis_seconds)
+        if absent.size and (not window.size or absent[0] <= window[0]):
+            end_all, termination = absent[0] + 1, 'no_person'
+        elif window.size:
+            end_all, termination = window[0] + 1, 'max_window'
+        detected[end_all:] = False
+
+    # Only frames with a detected pose take part in scoring
+    t = times[detected]
+    xy = series['points'][detected, :, :2]
+    x = xy[:, :, 0]
+    y = xy[:, :, 1]
+    n = len(t)
+
+    # Initial posture check for every frame
+    shoulder_mid = (xy[:, LEFT_SHOULDER] + xy[:, RIGHT_SHOULDER]) / 2
+    hip_mid_x = (x[:, LEFT_HIP] + x[:, RIGHT_HIP]) / 2
+    posture_ok = (_isclose_v(y[:, LEFT_ANKLE], y[:, RIGHT_ANKLE], feet_alignment_tolerance)
+                  & (shoulder_mid[:, 0] >= hip_mid_x - shoulder_alignment_tolerance)
+                  & (shoulder_mid[:, 0] <= hip_mid_x + shoulder_alignment_tolerance)
+                  & _isclose_v(y[:, RIGHT_ELBOW], shoulder_mid[:, 1], 0.1 * (1 + uncertainty))
+                  & (y[:, RIGHT_WRIST] <= y[:, RIGHT_ELBOW]))
+
+    # Lower-body ratios, arm height and feet contact for every frame
+    hip_to_knee = np.linalg.norm(xy[:, HIPS] - xy[:, KNEES], axis=2)
+    knee_to_ankle = np.linalg.norm(xy[:, KNEES] - xy[:, ANKLES], axis=2)
+    ratios = np.divide(hip_to_knee, knee_to_ankle, out=np.zeros_like(hip_to_knee), where=knee_to_ankle != 0)
+    arm_ok = _isclose_v((y[:, RIGHT_SHOULDER] + y[:, RIGHT_ELBOW]) / 2, y[:, RIGHT_WRIST], arm_height_tolerance)
+    feet_ok = np.all(np.abs(y[:, FOOT_INDEXES] - y[:, ANKLES]) <= foot_ground_tolerance, axis=1)
+    wrist = xy[:, RIGHT_WRIST]
+
+    # Reach for every frame inside a measurement window, NaN elsewhere
+    reach = np.full(n, np.nan)
+    calibrations = []
+    k = 0
+    while k < n:
+        # Hold window: first frame where the posture has been correct for hold_seconds
+        ok = posture_ok[k:]
+        run_start = np.concatenate(([True], ~ok[:-1])) & ok
+        run_start_time = np.maximum.accumulate(np.where(run_start, t[k:], -np.inf))
+        ready = np.flatnonzero(ok & (t[k:] - run_start_time >= hold_seconds))
+        if not ready.size:
+            break
+        c = k + ready[0]
+        calibrations.append(c)
+
+        # Measurement window: until the lower body or arm leaves its calibrated position
+        lower_body_ok = np.all(_isclose_v(ratios[c], ratios[c:], ratio_tolerance), axis=1) & arm_ok[c:] & feet_ok[c:]
+        failures = np.flatnonzero(~lower_body_ok)
+        end = c + failures[0] if failures.size else n
+        reach[c:end] = np.hypot(*(wrist[c:end] - wrist[c]).T) * scene_width_cm - reach_offset_cm
+        k = end + 1
+
+    # The test is over once the reach has stayed below a fraction of its running peak, or
+    # outside a measurement window, for reach_return_seconds
+    running_max = np.maximum.accumulate(np.fmax(reach, 0)) if n else reach
+    returned = (running_max > 0) & ~(reach >= reach_return_fraction * running_max)
+    run_start = np.concatenate(([True], ~returned[:-1])) & returned
+    run_start_time = np.maximum.accumulate(np.where(run_start, t, -np.inf))
+    done = np.flatnonzero(returned & (t - run_start_time >= reach_return_seconds))
+    last = n - 1
+    ended_at = float(times[end_all - 1]) if end_all else None
+    if done.size:
+        last = done[0]
+        termination = 'reach_returned'
+        ended_at = float(t[last])
+
+    max_distance_cm = float(running_max[last]) if n else 0
+    return {
+        'riskLevel': risk_level(max_distance_cm),
+        'maxDistance': round(max(max_distance_cm, 0), 2),
+        'termination': termination,
+        'calibratedAt': [round(float(t[c]), 3) for c in calibrations if c <= last],
+        'framesMeasured': int(np.count_nonzero(~np.isnan(reach[:last + 1]))),
+        'endedAt': round(ended_at, 3) if ended_at is not None else None
+    }
+
+def split_landmark_series(series, **thresholds):
+    """Score a recording that holds several consecutive trials.
+
+    Each trial is scored from where the previous one ended, with the same
+    rules and termination policy as a single test. Stretches without a
+    calibrated start posture (nobody there, walking back into place) are
+    skipped. Returns one analysis per trial, in order.
+    """
+    times = series['times']
+    trials = []
+    start = 0
+    while start < len(times):
+        analysis = score_landmark_series({'times': times[start:], 'points': series['points'][start:]}, **thresholds)
+        if analysis['calibratedAt']:
+            analysis['startedAt'] = round(float(times[start]), 3)
+            trials.append(analysis)
+        if analysis['termination'] == 'end_of_video' or analysis['endedAt'] is None:
+            break
+        start = max(int(np.searchsorted(times, analysis['endedAt'], side='right')), start + 1)
+    return trials
+
+# Define the function to keep the trials that produced a measurement (a risk level); the others have no reach
+def measured_trials(trials):
+    return [trial for trial in trials if trial['riskLevel'] is not None]
+
+# Define the function to combine the measured trials of one subject: the best of the first three, and the mean of all
+def aggregate_trials(trials):
+    max_distances = [trial['maxDistance'] for trial in measured_trials(trials)]
+    if not max_distances:
+        return {'trials': 0, 'bestOfThree': None, 'mean': None, 'riskLevel': None}
+    best_of_three = max(max_distances[:3])
+    return {
+        'trials': len(max_distances),
+        'bestOfThree': round(best_of_three, 2),
+        'mean': round(sum(max_distances) / len(max_distances), 2),
+        'riskLevel': risk_level(best_of_three)
+    }
+
+def _landmark_cache_key(video_path, video_hash, sample_stride, tiers, source, until_end=False):
+    # Everything that changes the extracted series is part of the key
+    pose_options = {name: value for name, value in DEFAULT_POSE_OPTIONS.items() if name != 'model_complexity'}
+    return get_landmark_cache().key(video_hash or hash_video(video_path),
+                              source=source,
+                              sample_stride=sample_stride,
+                              adaptive=[wrist_motion_threshold, wrist_motion_window_seconds, dense_sampling_seconds],
+                              size=[desired_width, desired_height],
+                              roi=[roi_padding, roi_max_area] if roi_cropping else None,
+                              termination=[reach_return_fraction, reach_return_seconds, max_analysis_seconds,
+                                           no_person_abort_seconds],
+                              pose=pose_options,
+                              tiers=tiers,
+                              until_end=until_end)
+
+def analyze_frt(video_path, render_path=None, sample_stride=adaptive_sample_stride, prefetch=True, thresholds=None,
+                use_cache=True, video_hash=None, profile=None, stage_timing=None, split_trials=False):
+    """Headless FRT analysis of a video file.
+
+    Never opens a window or draws anything. Landmarks for the whole clip are
+    extracted first (sub-sampled adaptively, decoded on a background thread)
+    and then scored in one vectorized pass; thresholds overrides the scoring
+    settings, in which case the whole clip is extracted. Extracted landmarks are cached on disk by video content, so a
+    re-submitted video is only scored. When render_path is given the
+    per-frame engine is used instead so an annotated MP4 can be written there
+    for auditing. profile names the entry of ANALYSIS_PROFILES that picks the
+    Pose models. With stage_timing (default: the module setting) the result
+    also has 'stageTimings', the time spent in each stage and frame counters.
+    Frames come from the clip's normalized store (see video_ingest) when
+    video_hash is given and the store has been written, from the original
+    otherwise; 'landmarkCache' tells whether a miss was a re-analysis, after
+    which the job queue has the store written. With split_trials the clip is a recording of several trials:
+    the result has one analysis per trial under 'trials', their 'aggregate',
+    and the aggregate's best-of-three reach and risk at the top level.
+    """
+    if split_trials and render_path:
+        raise ValueError("Annotated rendering is not available for recordings split into trials")
+    started = time.perf_counter()
+    profile = profile or default_analysis_profile
+    tiers = ANALYSIS_PROFILES[profile]
+    if stage_timing is None:
+        stage_timing = stage_timing_enabled
+    timer = StageTimer() if stage_timing else NULL_STAGE_TIMER
+    # Extraction stops where the default termination policy ends the test, which other
+    # thresholds may not agree with; re-scoring with them needs the whole clip
+    until_end = split_trials or bool(thresholds)
+    has_store = video_hash is not None and find_frame_store(video_hash) is not None
+    source = 'normalized' if has_store else 'original'
+    series = None
+    cache_key = None
+    if render_path is None and use_cache:
+        stage_started = timer.clock()
+        landmark_cache = get_landmark_cache()
+        cache_key = _landmark_cache_key(video_path, video_hash, sample_stride, tiers, source, until_end=until_end)
+        series = landmark_cache.get(cache_key)
+        timer.lap('cacheLookup', stage_started)
+
+    if series is None:
+        # A miss on a clip that was analysed before with other settings makes it worth normalizing
+        reanalysis = cache_key is not None and video_hash is not None and landmark_cache.has_video(video_hash)
+        cap, opened_source = open_video(video_path, video_hash)
+        if opened_source != source:
+            # The store was evicted since the lookup; do not file the series under the wrong key
+            source, cache_key = opened_source, None
+        sink = None
+        if render_path:
+            sink = AnnotatedVideoSink(render_path, fps=cap.get(cv2.CAP_PROP_FPS) or 30.0)
+
+        try:
+            with ExitStack() as stack:
+                hold_complexity, pose = stack.enter_context(pose_session(tiers['hold']))
+                measure_complexity, measure_pose = hold_complexity, None
+                if tiers['measure'] != hold_complexity:
+                    measure_complexity, measure_pose = stack.enter_context(pose_session(tiers['measure']))
+                used_tiers = {'hold': hold_complexity, 'measure': measure_complexity}
+                if sink is not None:
+                    analysis = _run_frt(cap, pose, sink, sample_stride=sample_stride, prefetch=prefetch,
+                                        measure_pose=measure_pose, timer=timer)
+                else:
+                    series = extract_landmark_series(cap, pose, sample_stride=sample_stride, prefetch=prefetch,
+                                                     measure_pose=measure_pose, timer=timer, until_end=until_end)
+        finally:
+            cap.release()
+            if sink is not None:
+                sink.close()
+
+        # Landmarks from a fallback model are not stored under the requested profile
+        if cache_key is not None and used_tiers == tiers:
+            stage_started = timer.clock()
+            landmark_cache.put(cache_key, series)
+            timer.lap('cacheStore', stage_started)
+        cache_hit = False
+    else:
+        used_tiers = tiers
+        cache_hit = True
+        reanalysis = False
+
+    if render_path is None:
+        scoring_started = time.perf_counter()
+        if split_trials:
+            trials = split_landmark_series(series, **(thresholds or {}))
+            aggregate = aggregate_trials(trials)
+            analysis = {'riskLevel': aggregate['riskLevel'], 'maxDistance': aggregate['bestOfThree'] or 0,
+                        'trials': trials, 'aggregate': aggregate}
+        else:
+            analysis = score_landmark_series(series, **(thresholds or {}))
+        timer.add('scoring', time.perf_counter() - scoring_started)
+        detected = ~np.isnan(series['points'][:, 0, 0])
+        analysis.update({
+            'framesDecoded': series['framesDecoded'],
+            'framesInferred': 0 if cache_hit else len(series['times']),
+            'framesWithPose': int(detected.sum()),
+            'videoSeconds': round(float(series['times'][-1]), 3) if len(series['times']) else 0.0,
+            'pipeline': dict(series.get('pipeline', {}), scoringSeconds=round(time.perf_counter() - scoring_started, 4))
+        })
+        if cache_key is not None:
+            analysis['landmarkCache'] = dict(landmark_cache.stats(), hit=cache_hit, reanalysis=reanalysis)
+
+    # Label each tier's stats with the model that actually ran
+    for tier, stats in analysis['pipeline'].get('tiers', {}).items():
+        stats['modelComplexity'] = used_tiers[tier]
+    analysis['profile'] = profile
+    analysis['modelComplexity'] = used_tiers
+    # Set when a requested Pose model could not be used and another complexity stood in
+    analysis['modelFallback'] = used_tiers != tiers
+    analysis['unavailableModels'] = unavailable_models()
+    analysis['videoSource'] = source
+
+    analysis['elapsedSeconds'] = round(time.perf_counter() - started, 3)
+    if timer.enabled:
+        analysis['stageTimings'] = timer.summary()
+    if render_path:
+        analysis['annotatedVideo'] = render_path
+    return analysis
+
+def process_frt(video_path):
+    # Open the video file and show the annotated analysis in a preview window
     cap = cv2.VideoCapture(video_path)
+    sink = PreviewWindowSink()
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
+    try:
+        with get_pose_pool().session() as pose:
+            analysis = _run_frt(cap, pose, sink)
+    finally:
+        # Release the video capture object and close the display window
+        cap.release()
+        sink.close()
 
-        image_height, image_width, _ = frame.shape  # Get image dimensions
-
-        # Resize the frame to the desired width and height
-        frame = cv2.resize(frame, (desired_width, desired_height))
-
-        # Convert the BGR image to RGB
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image.flags.writeable = False
-
-        # Process the image and detect the pose
-        results = pose.process(image)
-
-        # Convert back to BGR
-        image.flags.writeable = True
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-        # Draw the pose annotation on the image
-        if results.pose_landmarks:
-            mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
-
-            # Validate posture
-            if not pose_correct:
-                issues = validate_posture(results.pose_landmarks.landmark)
-                if issues:
-                    pose_correct = False
-                    pose_start_time = None
-                    measurement_started = False
-                    for i, issue in enumerate(issues):
-                        # print(issue)
-                        cv2.putText(image, issue, (10, 30 + i * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
-                    cv2.putText(image, "Posture: Incorrect", (10, 50 + len(issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
-                    # print("Posture Incorrect +++++++++++++++++++++++++++++++++++++++++")
-                else:
-                    if pose_start_time is None:
-                        pose_start_time = time.time()
-                    elif time.time() - pose_start_time >= 2:
-                        pose_correct = True
-                        initial_position = [results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                                            results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-                        initial_hip_position = [(results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_HIP.value].x +
-                                                results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_HIP.value].x) / 2,
-                                                (results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_HIP.value].y +
-                                                results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_HIP.value].y) / 2]
-                        initial_ankle_position = [(results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_ANKLE.value].x +
-                                                results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_ANKLE.value].x) / 2,
-                                                (results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_ANKLE.value].y +
-                                                results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_ANKLE.value].y) / 2]
-                        initial_foot_height = (results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_FOOT_INDEX.value].y +
-                                            results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_FOOT_INDEX.value].y) / 2
-                        initial_right_arm_position = [results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                                                    results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-                        initial_ratios = calculate_ratios(results.pose_landmarks.landmark)
-                        # print("Initial Ratios: ", initial_ratios)
-                        cv2.putText(image, "Posture: Correct", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2, cv2.LINE_AA)
-                        # print("Posture Correct ---------------------------------")
-
-            if pose_correct and initial_hip_position is not None and initial_ankle_position is not None and initial_foot_height is not None:
-                lower_body_issues = validate_lower_body_posture(results.pose_landmarks.landmark, initial_ratios)
-                if lower_body_issues:
-                    pose_correct = False
-                    pose_start_time = None
-                    measurement_started = False
-                    for i, issue in enumerate(lower_body_issues):
-                        cv2.putText(image, issue, (10, 30 + i * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
-                        print(issue)
-                    cv2.putText(image, "Posture: Incorrect", (10, 50 + len(lower_body_issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
-                    cv2.putText(image, f"Max Distance: {max_distance_cm:.2f} cm", (10, 120 + len(lower_body_issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2, cv2.LINE_AA)
-                    # print("Max Distance covered before incorrect lower body posture:", max_distance_cm)
-                else:
-                    final_position = [results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                                    results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-
-                    if not measurement_started:
-                        measurement_started = True
-
-                    # Calculate and display the distance covered
-                    distance_cm = calculate_distance(initial_position, final_position, image_width)
-                    if distance_cm > max_distance_cm:
-                        max_distance_cm = distance_cm - 1
-                    
-                    cv2.putText(image, f"Distance: {distance_cm:.2f} cm", (10, 90 + len(lower_body_issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2, cv2.LINE_AA)
-                    cv2.putText(image, f"Max Distance: {max_distance_cm:.2f} cm", (10, 120 + len(lower_body_issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2, cv2.LINE_AA)
-            cv2.putText(image, f"Max Distance: {max_distance_cm:.2f} cm", (10, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2, cv2.LINE_AA)
-            if max_distance_cm >= 25:
-                return "Low risk of falls"
-            elif 15 <= max_distance_cm < 25:
-                return "Risk of falling is 2x greater than normal"
-            elif max_distance_cm < 15 and max_distance_cm > 0:
-                return "Risk of falling is 4x greater than normal"
-
-        # Display the image
-        cv2.imshow('Functional Reach Test', image)
-
-        # Exit the loop when 'q' is pressed
-        if cv2.waitKey(10) & 0xFF == 27:
-            break
+    return analysis['riskLevel']
 
-    # Release the video capture object and close the display window
-    cap.release()
-    cv2.destroyAllWindows()
-
-def live_frt(initial_position = None,
-final_position = None,
-pose_correct = False,
-pose_start_time = None,
-measurement_started = False,
-initial_hip_position = None,
-initial_knee_position = None,
-initial_ankle_position = None,
-initial_foot_height = None,
-initial_right_arm_position = None,
-initial_ratios = None,
-max_distance_cm = 0,
-uncertainty = 0.1,
-scene_width_cm = 100,
-
-desired_width = 520,
-desired_height = 750):
+def live_frt():
     cap = cv2.VideoCapture(0)
+    sink = PreviewWindowSink()
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        image_height, image_width, _ = frame.shape  # Get image dimensions
-
-        # Resize the frame to the desired width and height
-        frame = cv2.resize(frame, (desired_width, desired_height))
-
-        # Convert the BGR image to RGB
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image.flags.writeable = False
-
-        # Process the image and detect the pose
-        results = pose.process(image)
-
-        # Convert back to BGR
-        image.flags.writeable = True
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-        # Draw the pose annotation on the image
-        if results.pose_landmarks:
-            mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
-
-            # Validate posture
-            if not pose_correct:
-                issues = validate_posture(results.pose_landmarks.landmark)
-                if issues:
-                    pose_correct = False
-                    pose_start_time = None
-                    measurement_started = False
-                    for i, issue in enumerate(issues):
-                        # print(issue)
-                        cv2.putText(image, issue, (10, 30 + i * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
-                    cv2.putText(image, "Posture: Incorrect", (10, 50 + len(issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
-                    # print("Posture Incorrect +++++++++++++++++++++++++++++++++++++++++")
-                else:
-                    if pose_start_time is None:
-                        pose_start_time = time.time()
-                    elif time.time() - pose_start_time >= 2:
-                        pose_correct = True
-                        initial_position = [results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                                            results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-                        initial_hip_position = [(results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_HIP.value].x +
-                                                results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_HIP.value].x) / 2,
-                                                (results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_HIP.value].y +
-                                                results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_HIP.value].y) / 2]
-                        initial_ankle_position = [(results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_ANKLE.value].x +
-                                                results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_ANKLE.value].x) / 2,
-                                                (results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_ANKLE.value].y +
-                                                results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_ANKLE.value].y) / 2]
-                        initial_foot_height = (results.pose_landmarks.landmark[mp_pose.PoseLandmark.LEFT_FOOT_INDEX.value].y +
-                                            results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_FOOT_INDEX.value].y) / 2
-                        initial_right_arm_position = [results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                                                    results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-                        initial_ratios = calculate_ratios(results.pose_landmarks.landmark)
-                        # print("Initial Ratios: ", initial_ratios)
-                        cv2.putText(image, "Posture: Correct", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2, cv2.LINE_AA)
-                        # print("Posture Correct ---------------------------------")
-
-            if pose_correct and initial_hip_position is not None and initial_ankle_position is not None and initial_foot_height is not None:
-                lower_body_issues = validate_lower_body_posture(results.pose_landmarks.landmark, initial_ratios)
-                if lower_body_issues:
-                    pose_correct = False
-                    pose_start_time = None
-                    measurement_started = False
-                    for i, issue in enumerate(lower_body_issues):
-                        cv2.putText(image, issue, (10, 30 + i * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
-                        print(issue)
-                    cv2.putText(image, "Posture: Incorrect", (10, 50 + len(lower_body_issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
-                    cv2.putText(image, f"Max Distance: {max_distance_cm:.2f} cm", (10, 120 + len(lower_body_issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2, cv2.LINE_AA)
-                    # print("Max Distance covered before incorrect lower body posture:", max_distance_cm)
-                else:
-                    final_position = [results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                                    results.pose_landmarks.landmark[mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-
-                    if not measurement_started:
-                        measurement_started = True
-
-                    # Calculate and display the distance covered
-                    distance_cm = calculate_distance(initial_position, final_position, image_width)
-                    if distance_cm > max_distance_cm:
-                        max_distance_cm = distance_cm - 1
-                    
-                    cv2.putText(image, f"Distance: {distance_cm:.2f} cm", (10, 90 + len(lower_body_issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2, cv2.LINE_AA)
-                    cv2.putText(image, f"Max Distance: {max_distance_cm:.2f} cm", (10, 120 + len(lower_body_issues) * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2, cv2.LINE_AA)
-            cv2.putText(image, f"Max Distance: {max_distance_cm:.2f} cm", (10, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2, cv2.LINE_AA)
-            if max_distance_cm >= 25:
-                return "Low risk of falls"
-            elif 15 <= max_distance_cm < 25:
-                return "Risk of falling is 2x greater than normal"
-            elif max_distance_cm < 15 and max_distance_cm > 0:
-                return "Risk of falling is 4x greater than normal"
-
-        # Display the image
-        cv2.imshow('Functional Reach Test', image)
-
-        # Exit the loop when 'q' is pressed
-        if cv2.waitKey(10) & 0xFF == 27:
-            break
+    try:
+        with get_pose_pool().session() as pose:
+            analysis = _run_frt(cap, pose, sink, realtime=True)
+    finally:
+        cap.release()
+        sink.close()
 
-    # Release the video capture object and close the display window
-    cap.release()
-    cv2.destroyAllWindows()
+    if analysis['riskLevel'] is not None:
+        return analysis['riskLevel']
 
-    results_data = {"Max Distance (cm)": max_distance_cm, "Date and Time": time.strftime("%Y-%m-%d %H:%M:%S")}
+    results_data = {"Max Distance (cm)": analysis['maxDistance'], "Date and Time": time.strftime("%Y-%m-%d %H:%M:%S")}
     with open("results.json", "w") as f:
         json.dump(results_data, f)
 
@@ -0,0 +1,162 @@
+# frt_stream.py - Live FRT on frames streamed from the browser over Socket.IO
+
+import threading
+import time
+import traceback
+
+import cv2
+import numpy as np
+
+from frt_processing import get_pose_pool, landmarks_to_array, FRTSession, NUM_LANDMARKS
+
+# Largest encoded frame accepted from a client, and how long to wait for a free Pose graph
+live_stream_max_frame_bytes = 512 * 1024
+live_stream_acquire_timeout = 1.0
+
+# Frames a client may have sent without feedback before it should stop sending
+live_stream_max_in_flight = 2
+
+
+class FRTStream:
+    """Live FRT for one browser connection.
+
+    Frames are processed on a background task, one at a time. Only the newest
+    frame waits in a one-slot mailbox: a frame still waiting when a newer one
+    arrives is dropped, so a slow server falls behind by at most one frame
+    instead of building a backlog.
+    """
+
+    def __init__(self, sid, emit, session=None):
+        self.sid = sid
+        self.emit = emit
+        self.pose = get_pose_pool().acquire(timeout=live_stream_acquire_timeout)
+        self.lock = threading.Lock()
+        self.pending = None
+        self.processing = False
+        self.closed = False
+        self.frames_received = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+
+        self.session = session or FRTSession()
+        self.points = np.empty((NUM_LANDMARKS, 4), dtype=np.float32)
+
+    def push(self, seq, t, data):
+        """Put a frame in the mailbox; returns True when the caller must start a task running run()"""
+        with self.lock:
+            if self.closed:
+                return False
+            self.frames_received += 1
+            if self.pending is not None:
+                self.frames_dropped += 1
+            self.pending = (seq, t, data, time.monotonic())
+            if self.processing:
+                return False
+            self.processing = True
+            return True
+
+    def run(self):
+        """Process frames until the mailbox is empty"""
+        while True:
+            with self.lock:
+                item, self.pending = self.pending, None
+                if item is None or self.closed:
+                    self.processing = False
+                    closed = self.closed
+                    break
+            try:
+                self._process(*item)
+            except Exception as e:
+                traceback.print_exc()
+                self.emit('frt_stream_error', {'error': str(e)})
+                self.close()
+
+        if closed:
+            self._release()
+
+    def _process(self, seq, t, data, received):
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            self.emit('frt_feedback', {'seq': seq, 'error': 'Could not decode frame'})
+            return
+
+        # Use the capture time sent by the client so network jitter does not affect the hold time
+        t = float(t) if t is not None else time.monotonic()
+        if self.session.last_time is not None and t < self.session.last_time:
+            return
+
+        results = self.pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        self.frames_processed += 1
+
+        points = None
+        if results.pose_landmarks:
+            points = landmarks_to_array(results.pose_landmarks.landmark, out=self.points)
+        feedback = self.session.feed(points, t)
+        if feedback['distance'] is not None:
+            feedback['distance'] = round(feedback['distance'], 2)
+
+        feedback.update(self.session.result())
+        feedback.update({
+            'seq': seq,
+            'poseDetected': points is not None,
+            'framesDropped': self.frames_dropped,
+            'latencyMs': round((time.monotonic() - received) * 1000, 1)
+        })
+        self.emit('frt_feedback', feedback)
+
+        # The termination policy decides when the test is over
+        if self.session.finished is not None:
+            self.emit('frt_stream_result', self.result())
+            self.close()
+
+    def result(self):
+        result = self.session.result()
+        result.update({
+            'framesReceived': self.frames_received,
+            'framesProcessed': self.frames_processed,
+            'framesDropped': self.frames_dropped
+        })
+        return result
+
+    def close(self):
+        """Stop accepting frames; the Pose graph goes back to the pool once no frame is in progress"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            release = not self.processing
+        if release:
+            self._release()
+
+    def _release(self):
+        if self.pose is not None:
+            get_pose_pool().release(self.pose)
+            self.pose = None
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+def open_stream(sid, emit, session=None):
+    """Start a live FRT stream for a Socket.IO connection, replacing any previous one.
+
+    session resumes a checkpointed FRTSession instead of starting a new test.
+    """
+    stream = FRTStream(sid, emit, session=session)
+    with _streams_lock:
+        previous = _streams.pop(sid, None)
+        _streams[sid] = stream
+    if previous is not None:
+        previous.close()
+    return stream
+
+def get_stream(sid):
+    with _streams_lock:
+        return _streams.get(sid)
+
+def close_stream(sid):
+    with _streams_lock:
+        stream = _streams.pop(sid, None)
+    if stream is not None:
+        stream.close()
+    return stream
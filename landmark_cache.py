@@ -0,0 +1,153 @@
+# landmark_cache.py - On-disk cache of extracted FRT landmark series, keyed by video content
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Anchored to the application root, not the working directory of whichever process opens it
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+LANDMARK_CACHE_DIR = os.environ.get('LANDMARK_CACHE_DIR', os.path.join(APP_ROOT, 'uploads', 'landmark_cache'))
+
+# Eviction limits: total size of the cache and maximum age of an entry
+LANDMARK_CACHE_MAX_BYTES = int(os.environ.get('LANDMARK_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+LANDMARK_CACHE_MAX_AGE_SECONDS = int(os.environ.get('LANDMARK_CACHE_MAX_AGE_SECONDS', 30 * 24 * 60 * 60))
+
+# Bump when the extraction changes in a way that invalidates stored series
+LANDMARK_CACHE_VERSION = 1
+
+
+def hash_video(video_path, chunk_size=1024 * 1024):
+    """SHA-256 of a video file's content"""
+    digest = hashlib.sha256()
+    with open(video_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LandmarkCache:
+    """Stores landmark series as uncompressed .npz files named after the video hash.
+
+    The key also covers the extraction parameters, so changing the sampling or
+    the model produces a new entry instead of a stale hit. Scoring thresholds
+    are not part of the key: re-scoring a cached series is the point.
+    """
+
+    def __init__(self, directory=None, max_bytes=LANDMARK_CACHE_MAX_BYTES,
+                 max_age_seconds=LANDMARK_CACHE_MAX_AGE_SECONDS):
+        self.directory = directory = directory or LANDMARK_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(video_hash, **params):
+        params['version'] = LANDMARK_CACHE_VERSION
+        tag = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+        return f"{video_hash}-{tag}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                series = {
+                    'times': data['times'],
+                    'points': data['points'],
+                    **json.loads(str(data['meta']))
+                }
+        except (OSError, KeyError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # Touch the entry so size-based eviction removes the least recently used first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return series
+
+    def has_video(self, video_hash):
+        """Whether any entry, for any extraction parameters, exists for a video"""
+        prefix = video_hash + '-'
+        return any(name.startswith(prefix) and name.endswith('.npz') for name in os.listdir(self.directory))
+
+    def put(self, key, series):
+        meta = {name: value for name, value in series.items()
+                if name not in ('times', 'points', 'pipeline')}
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, times=series['times'], points=series['points'], meta=json.dumps(meta))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write landmark cache entry {key}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Drop entries older than max_age_seconds, then the least recently used beyond max_bytes"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+_landmark_cache = None
+_landmark_cache_lock = threading.Lock()
+
+def get_landmark_cache():
+    """Return the process-wide landmark cache, creating it (and its directory) on first use"""
+    global _landmark_cache
+    with _landmark_cache_lock:
+        if _landmark_cache is None:
+            _landmark_cache = LandmarkCache()
+        return _landmark_cache
@@ -0,0 +1,101 @@
+# pose_pool.py - Pool of reusable MediaPipe Pose graphs, one per concurrent FRT analysis
+
+import queue
+import threading
+from contextlib import contextmanager
+
+import mediapipe as mp
+import numpy as np
+
+mp_pose = mp.solutions.pose
+
+# Options used by the FRT engine for every Pose graph
+DEFAULT_POSE_OPTIONS = {
+    'static_image_mode': False,
+    'model_complexity': 1,
+    'enable_segmentation': False,
+    'min_detection_confidence': 0.5
+}
+
+
+class PoseSessionPool:
+    """Thread-safe pool of pre-warmed Pose graphs.
+
+    Pose keeps temporal tracking state between frames, so a graph must never be
+    shared by two analyses at once. Each analysis checks a graph out for the
+    whole video; it is reset on release so the next video starts untracked.
+    """
+
+    def __init__(self, size=1, max_size=4, **pose_options):
+        self.max_size = max(size, max_size)
+        self.pose_options = dict(DEFAULT_POSE_OPTIONS, **pose_options)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+        for _ in range(size):
+            self._created += 1
+            self._idle.put(self._create())
+
+    def _create(self):
+        pose = mp_pose.Pose(**self.pose_options)
+
+        # Run one blank frame so the model is loaded before the first real request
+        pose.process(np.zeros((64, 64, 3), dtype=np.uint8))
+        pose.reset()
+        return pose
+
+    def acquire(self, timeout=None):
+        """Check out an idle graph, creating one if the pool has not reached max_size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        # Reserve a slot under the lock so concurrent callers cannot exceed max_size
+        with self._lock:
+            can_grow = self._created < self.max_size
+            if can_grow:
+                self._created += 1
+        if can_grow:
+            try:
+                return self._create()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No Pose session became available in time")
+
+    def release(self, pose):
+        """Reset the graph's tracking state and return it to the pool"""
+        try:
+            pose.reset()
+        except Exception:
+            # A graph that cannot be reset is dropped and rebuilt on demand
+            pose.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(pose)
+
+    @contextmanager
+    def session(self, timeout=None):
+        pose = self.acquire(timeout)
+        try:
+            yield pose
+        finally:
+            self.release(pose)
+
+    def stats(self):
+        return {'created': self._created, 'idle': self._idle.qsize(), 'maxSize': self.max_size}
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify, session, request, make_response
 from database import get_db_connection
+from stats_rollup import record_frt_results
 import traceback
 import chatbot
 from flask_socketio import emit, join_room
@@ -251,6 +252,7 @@ def chat_with_bot():
                         INSERT INTO FRTResults (UserID, MaxDistance, RiskLevel, Symptoms)
                         VALUES (?, ?, ?, ?)
                     """, (user_id, 0, 'Pending Test' if frt_recommended else 'Not Recommended', formatted_conversation))
+                    record_frt_results(cursor, user_id, [(0, 'Pending Test' if frt_recommended else 'Not Recommended')])
                 
                 conn.commit()
                 conn.close()
@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify, session, redirect
-from database import get_db_connection
+from database import get_db_connection, request_connection
+from stats_rollup import doctor_dashboard_stats
 
 doctor_bp = Blueprint('doctor', __name__, url_prefix='/api/doctor')
 
@@ -66,108 +67,17 @@ def get_doctor_dashboard_stats():
     doctor_id = session.get('user_id')
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = request_connection().cursor()
         
-        # Get current month and previous month
-        from datetime import datetime
-        current_date = datetime.now()
-        current_month = current_date.month
-        current_year = current_date.year
-        
-        # Calculate previous month and year
-        prev_month = current_month - 1 if current_month > 1 else 12
-        prev_year = current_year if current_month > 1 else current_year - 1
-        
-        # 1. Active patients count
-        cursor.execute("""
-            SELECT COUNT(*) as active_patients 
-            FROM PatientProfiles 
-            WHERE DoctorID = (
-                SELECT DoctorID FROM DoctorProfiles WHERE UserID = ?
-            )
-        """, (doctor_id,))
-        active_patients = cursor.fetchone()[0] or 0
-        
-        # Count for previous month (patients who were added this month)
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM PatientProfiles pp
-            JOIN Users u ON pp.UserID = u.UserID
-            WHERE pp.DoctorID = (
-                SELECT DoctorID FROM DoctorProfiles WHERE UserID = ?
-            )
-            AND MONTH(u.CreatedAt) = ? AND YEAR(u.CreatedAt) = ?
-        """, (doctor_id, current_month, current_year))
-        new_patients_this_month = cursor.fetchone()[0] or 0
-        
-        # 2. FRT Tests reviewed count
-        cursor.execute("""
-            SELECT COUNT(*) as tests_reviewed
-            FROM FRTResults fr
-            JOIN PatientProfiles pp ON fr.UserID = pp.UserID
-            WHERE pp.DoctorID = (
-                SELECT DoctorID FROM DoctorProfiles WHERE UserID = ?
-            )
-        """, (doctor_id,))
-        tests_reviewed = cursor.fetchone()[0] or 0
-        
-        # Count tests from this month
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM FRTResults fr
-            JOIN PatientProfiles pp ON fr.UserID = pp.UserID
-            WHERE pp.DoctorID = (
-                SELECT DoctorID FROM DoctorProfiles WHERE UserID = ?
-            )
-            AND MONTH(fr.CreatedAt) = ? AND YEAR(fr.CreatedAt) = ?
-        """, (doctor_id, current_month, current_year))
-        tests_this_month = cursor.fetchone()[0] or 0
-        
-        # Count tests from previous month
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM FRTResults fr
-            JOIN PatientProfiles pp ON fr.UserID = pp.UserID
-            WHERE pp.DoctorID = (
-                SELECT DoctorID FROM DoctorProfiles WHERE UserID = ?
-            )
-            AND MONTH(fr.CreatedAt) = ? AND YEAR(fr.CreatedAt) = ?
-        """, (doctor_id, prev_month, prev_year))
-        tests_prev_month = cursor.fetchone()[0] or 0
-        
-        # 3. Reports generated count
-        cursor.execute("""
-            SELECT COUNT(*) as reports_generated
-            FROM Reports
-            WHERE DoctorID = ?
-        """, (doctor_id,))
-        reports_generated = cursor.fetchone()[0] or 0
-        
-        # Count reports from this month
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM Reports
-            WHERE DoctorID = ?
-            AND MONTH(GeneratedAt) = ? AND YEAR(GeneratedAt) = ?
-        """, (doctor_id, current_month, current_year))
-        reports_this_month = cursor.fetchone()[0] or 0
-        
-        # Count reports from previous month
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM Reports
-            WHERE DoctorID = ?
-            AND MONTH(GeneratedAt) = ? AND YEAR(GeneratedAt) = ?
-        """, (doctor_id, prev_month, prev_year))
-        reports_prev_month = cursor.fetchone()[0] or 0
+        # One totals row and two monthly rows from the rollups kept by stats_rollup
+        (active_patients, new_patients_this_month,
+         tests_reviewed, tests_this_month, tests_prev_month,
+         reports_generated, reports_this_month, reports_prev_month) = doctor_dashboard_stats(cursor, doctor_id)
         
         # Calculate month-over-month changes
         tests_change = tests_this_month - tests_prev_month
         reports_change = reports_this_month - reports_prev_month
         
-        conn.close()
-        
         return jsonify({
             'activePatients': {
                 'count': active_patients,
@@ -184,8 +94,6 @@ def get_doctor_dashboard_stats():
         })
         
     except Exception as e:
-        if 'conn' in locals():
-            conn.close()
         # SECURITY FIX: Don't expose detailed error information to client
         import traceback
         traceback.print_exc()  # Log detailed error for server-side debugging
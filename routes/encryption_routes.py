@@ -1,7 +1,6 @@
 from flask import Blueprint, jsonify, session, request
-from database import get_db_connection
+from database import get_db_connection, request_connection
 from crypto_utils import generate_key_pair
-from setup_tables import setup_encryption_tables
 import traceback
 
 encryption_bp = Blueprint('encryption', __name__, url_prefix='/api/encryption-keys')
@@ -11,9 +10,6 @@ def generate_encryption_keys():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    # Ensure tables exist before proceeding
-    setup_encryption_tables()
-    
     try:
         user_id = session['user_id']
         print(f"Generating encryption keys for user_id: {user_id}")
@@ -30,56 +26,27 @@ def generate_encryption_keys():
             keys = generate_key_pair()
             print(f"Generated server-side encryption keys. Public key length: {len(keys['public_key'])}, private key length: {len(keys['private_key'])}")
         
-        conn = get_db_connection()
+        conn = request_connection()
         cursor = conn.cursor()
         
         try:
-            # Double-check that the UserEncryptionKeys table exists and has correct schema
-            cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'UserEncryptionKeys'")
-            if cursor.fetchone()[0] == 0:
-                print("UserEncryptionKeys table missing, creating now...")
-                cursor.execute("""
-                    CREATE TABLE UserEncryptionKeys (
-                        KeyID INT IDENTITY(1,1) PRIMARY KEY,
-                        UserID INT NOT NULL,
-                        PublicKey NVARCHAR(MAX) NOT NULL,
-                        PrivateKey NVARCHAR(MAX) NOT NULL,
-                        CreatedAt DATETIME DEFAULT GETDATE(),
-                        FOREIGN KEY (UserID) REFERENCES Users(UserID)
-                    )
-                """)
-            
-            # Check if user already has keys
-            cursor.execute("SELECT KeyID FROM UserEncryptionKeys WHERE UserID = ?", (user_id,))
-            existing_key = cursor.fetchone()
-            
-            if existing_key:
-                # Update existing keys
-                print(f"Updating existing keys for user {user_id}")
-                cursor.execute("""
-                    UPDATE UserEncryptionKeys 
-                    SET PublicKey = ?, PrivateKey = ?, CreatedAt = GETDATE()
-                    WHERE UserID = ?
-                """, (keys['public_key'], keys['private_key'], user_id))
-            else:
-                # Create new keys
-                print(f"Inserting new keys for user {user_id}")
-                cursor.execute("""
+            # UserEncryptionKeys is unique on UserID (schema migration 2). The range lock makes a
+            # concurrent first request for the same user wait here and then update the row this
+            # one inserts, instead of colliding with it on the unique index.
+            cursor.execute("""
+                SET NOCOUNT ON;
+                UPDATE UserEncryptionKeys WITH (UPDLOCK, SERIALIZABLE)
+                SET PublicKey = ?, PrivateKey = ?, CreatedAt = GETDATE()
+                WHERE UserID = ?;
+                IF @@ROWCOUNT = 0
                     INSERT INTO UserEncryptionKeys (UserID, PublicKey, PrivateKey)
-                    VALUES (?, ?, ?)
-                """, (user_id, keys['public_key'], keys['private_key']))
+                    VALUES (?, ?, ?);
+                SET NOCOUNT OFF;
+            """, (keys['public_key'], keys['private_key'], user_id,
+                  user_id, keys['public_key'], keys['private_key']))
             
             conn.commit()
             print(f"Successfully saved keys to database for user {user_id}")
-            
-            # Verify keys were saved
-            cursor.execute("SELECT PublicKey, PrivateKey FROM UserEncryptionKeys WHERE UserID = ?", (user_id,))
-            stored_keys = cursor.fetchone()
-            if not stored_keys:
-                print(f"ERROR: Failed to save keys for user {user_id} - verification query returned no results")
-                return jsonify({'error': 'Failed to save encryption keys'}), 500
-                
-            print(f"Verification successful - found stored keys with lengths: {len(stored_keys[0])}, {len(stored_keys[1])}")
             return jsonify({'message': 'Encryption keys generated successfully', 'keys': keys}), 200
             
         except Exception as db_error:
@@ -87,8 +54,6 @@ def generate_encryption_keys():
             print(f"Database error in generate_encryption_keys: {str(db_error)}")
             traceback.print_exc()
             return jsonify({'error': f'Database error: {str(db_error)}'}), 500
-        finally:
-            conn.close()
     except Exception as e:
         print(f"Unexpected error in generate_encryption_keys: {str(e)}")
         traceback.print_exc()
@@ -118,15 +83,19 @@ def trigger_key_generation(user_id):
         # Generate keys for the user
         keys = generate_key_pair()
         
-        # Create new keys
+        # Create new keys, unless a concurrent request created them since the check above
         cursor.execute("""
             INSERT INTO UserEncryptionKeys (UserID, PublicKey, PrivateKey)
-            VALUES (?, ?, ?)
-        """, (user_id, keys['public_key'], keys['private_key']))
+            SELECT ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM UserEncryptionKeys WITH (UPDLOCK, SERIALIZABLE) WHERE UserID = ?)
+        """, (user_id, keys['public_key'], keys['private_key'], user_id))
+        inserted = cursor.rowcount > 0
         
         conn.commit()
         conn.close()
         
+        if not inserted:
+            return jsonify({'message': 'User already has encryption keys'}), 200
         return jsonify({'message': 'Encryption keys generated for user'}), 200
     except Exception as e:
         traceback.print_exc()
@@ -138,14 +107,10 @@ def get_public_key(user_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    # Ensure tables exist
-    setup_encryption_tables()
-    
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = request_connection().cursor()
         
-        # Retrieve the public key
+        # Retrieve the public key (a seek on IX_UserEncryptionKeys_UserID, which includes it)
         cursor.execute("SELECT PublicKey FROM UserEncryptionKeys WHERE UserID = ?", (user_id,))
         key = cursor.fetchone()
         
@@ -159,28 +124,15 @@ def get_public_key(user_id):
         traceback.print_exc()
         print(f"Error in get_public_key: {str(e)}")
         return jsonify({'error': f'Failed to retrieve public key: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 @encryption_bp.route('/user', methods=['GET'])
 def get_user_keys():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    # Ensure tables exist
-    setup_encryption_tables()
-    
     try:
         user_id = session['user_id']
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Ensure the table exists
-        cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'UserEncryptionKeys'")
-        if cursor.fetchone()[0] == 0:
-            setup_encryption_tables()
-            conn.close()
-            return jsonify({'error': 'Encryption keys table created, please retry'}), 503
+        cursor = request_connection().cursor()
         
         cursor.execute("SELECT PublicKey, PrivateKey FROM UserEncryptionKeys WHERE UserID = ?", (user_id,))
         key = cursor.fetchone()
@@ -197,8 +149,6 @@ def get_user_keys():
         traceback.print_exc()
         print(f"Error in get_user_keys: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @encryption_bp.route('/debug', methods=['GET'])
 def debug_encryption_keys():
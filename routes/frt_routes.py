@@ -1,10 +1,15 @@
 from flask import Blueprint, jsonify, session, request, send_file
-from database import get_db_connection
+from flask_socketio import emit
+from werkzeug.exceptions import RequestEntityTooLarge
+from database import get_db_connection, request_connection
 import os
 import time
 import asyncio
-from frt_processing import process_frt, live_frt
-from video_upload import upload_video
+from frt_processing import aggregate_trials, measured_trials, ANALYSIS_PROFILES
+from frt_jobs import get_job_queue, QueueFullError, AUTO_PROFILE, COMPLETED, FAILED
+from frt_stream import open_stream, get_stream, close_stream, live_stream_max_frame_bytes, live_stream_max_in_flight
+from video_upload import upload_video, video_hash_of, FRT_BATCH_MAX_VIDEOS
+from stats_rollup import record_frt_results, record_report
 from utils.pdf_generator import create_medical_report, get_groq_analysis
 
 # Create the directory for storing report files
@@ -13,10 +18,68 @@ os.makedirs(REPORTS_DIR, exist_ok=True)
 
 frt_bp = Blueprint('frt', __name__, url_prefix='/api/frt')
 
+# This will be set from app.py
+socketio = None
+
+def init_socketio(socket_instance):
+    global socketio
+    socketio = socket_instance
+
+    # Live FRT streamed from the browser
+    socket_instance.on_event('frt_stream_start', handle_stream_start)
+    socket_instance.on_event('frt_frame', handle_stream_frame)
+    socket_instance.on_event('frt_stream_stop', handle_stream_stop)
+
+def notify_job_finished(job):
+    """Push a finished FRT job to the owner's Socket.IO room"""
+    user_id = get_job_queue().owner(job['jobId'])
+    if socketio is not None and user_id is not None:
+        socketio.emit('frt_result', job, room=f"user_{user_id}")
+
+def handle_stream_start(data=None):
+    if 'user_id' not in session:
+        emit('frt_stream_error', {'error': 'Not authenticated'})
+        return
+
+    sid = request.sid
+    try:
+        open_stream(sid, lambda event, payload: socketio.emit(event, payload, to=sid))
+    except TimeoutError:
+        emit('frt_stream_error', {'error': 'Live FRT is busy, please try again shortly'})
+        return
+
+    emit('frt_stream_started', {'maxInFlight': live_stream_max_in_flight})
+
+def handle_stream_frame(data):
+    stream = get_stream(request.sid)
+    if stream is None or not isinstance(data, dict):
+        return
+
+    image = data.get('image')
+    if not isinstance(image, (bytes, bytearray)) or len(image) > live_stream_max_frame_bytes:
+        emit('frt_feedback', {'seq': data.get('seq'), 'error': 'Invalid frame'})
+        return
+
+    # Only one task per stream processes frames; it picks up whatever arrives meanwhile
+    if stream.push(data.get('seq'), data.get('t'), image):
+        socketio.start_background_task(stream.run)
+
+def handle_stream_stop(data=None):
+    stream = close_stream(request.sid)
+    if stream is not None:
+        stream.session.finish('stopped')
+        emit('frt_stream_result', stream.result())
+
 # Configure uploads directory
 UPLOAD_DIR = 'uploads'
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Annotated copies of analysed uploads, only written when requested for auditing
+ANNOTATED_DIR = os.path.join(UPLOAD_DIR, 'annotated')
+
+# Batch analysis: how long the request waits for all of its videos (at most FRT_BATCH_MAX_VIDEOS)
+FRT_BATCH_TIMEOUT_SECONDS = 600
+
 @frt_bp.route('/history')
 def get_frt_history():
     if 'user_id' not in session:
@@ -50,6 +113,12 @@ def save_frt_result():
         return jsonify({'error': 'Not authenticated'}), 401
         
     data = request.json
+    # The reach reported by the analysis, in cm; never parsed out of the risk text
+    try:
+        max_distance = float(data.get('maxDistance') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'maxDistance must be a number'}), 400
+
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -57,7 +126,8 @@ def save_frt_result():
         cursor.execute("""
             INSERT INTO FRTResults (UserID, MaxDistance, RiskLevel, Symptoms)
             VALUES (?, ?, ?, ?)
-        """, (session['user_id'], data['maxDistance'], data['riskLevel'], data['symptoms']))
+        """, (session['user_id'], max_distance, data['riskLevel'], data['symptoms']))
+        record_frt_results(cursor, session['user_id'], [(max_distance, data['riskLevel'])])
         conn.commit()
         return jsonify({'message': 'Result saved successfully'}), 200
     except Exception as e:
@@ -69,30 +139,207 @@ def save_frt_result():
 def upload():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
-        
-    if 'video' not in request.files:
+
+    # Parsing the form streams the video to disk; it is aborted once the size limit is exceeded
+    try:
+        files = request.files
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
+
+    if 'video' not in files:
         return jsonify({'error': 'No video file provided'}), 400
 
-    video_file = request.files['video']
+    # Named analysis profile; 'auto' picks one from the current queue depth
+    profile = request.form.get('profile', AUTO_PROFILE)
+    if profile != AUTO_PROFILE and profile not in ANALYSIS_PROFILES:
+        return jsonify({'error': f"Unknown analysis profile '{profile}'"}), 400
+
+    video_file = files['video']
     if video_file:
         filename, error = upload_video(video_file)
         if error:
             return jsonify({'error': error}), 400
         
         video_path = os.path.join(UPLOAD_DIR, filename)
-        result = process_frt(video_path)
-        print(result)
-        return jsonify({'filename': filename, 'result': result}), 200
+
+        # Optionally render an annotated MP4 next to the upload for auditing
+        render_path = None
+        if request.form.get('annotate') in ('1', 'true'):
+            os.makedirs(ANNOTATED_DIR, exist_ok=True)
+            render_path = os.path.join(ANNOTATED_DIR, os.path.splitext(filename)[0] + '.mp4')
+
+        # Optionally attach per-stage timings to the result ('stageTimings'); off unless asked for or enabled globally
+        stage_timing = True if request.form.get('timings') in ('1', 'true') else None
+
+        # Queue the analysis on the worker pool; the client polls or waits for 'frt_result'
+        job_queue = get_job_queue(on_complete=notify_job_finished)
+        try:
+            job = job_queue.submit(
+                session['user_id'], video_path, filename=filename, render_path=render_path, profile=profile,
+                stage_timing=stage_timing, video_hash=video_hash_of(filename))
+        except QueueFullError as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+
+        return jsonify({'filename': filename, 'jobId': job['jobId'], 'status': job['status'],
+                        'profile': job['profile']}), 202
 
     return jsonify({'error': 'File upload failed'}), 500
 
+def _batch_trial_rows(job):
+    """Per-trial rows of a finished batch job; a split recording gives one row per detected trial"""
+    base = {'jobId': job['jobId'], 'subjectId': job['subjectId'], 'filename': job['filename']}
+    if job['status'] != COMPLETED:
+        return [dict(base, trial=1, riskLevel=None, maxDistance=None, error=job['error'] or job['status'])]
+
+    analysis = job['analysis']
+    trials = analysis['trials'] if 'trials' in analysis else [analysis]
+    return [dict(base, trial=i + 1, riskLevel=trial['riskLevel'], maxDistance=trial['maxDistance'],
+                 termination=trial.get('termination'), calibratedAt=trial.get('calibratedAt'))
+            for i, trial in enumerate(trials)]
+
+@frt_bp.route('/batch', methods=['POST'])
+def upload_batch():
+    """Analyse several FRT trials in one request.
+
+    Takes several 'videos', or one recording with split=1 that holds several
+    trials in a row. Optional 'subjectIds' (one per video, or one for all)
+    lets a doctor analyse trials of their own patients. The analyses run in
+    parallel on the workers; the response has every trial's result and, per
+    subject, the best of the first three trials and the mean. All results are
+    written to FRTResults in one transaction.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    try:
+        files = request.files
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
+
+    videos = [video for video in files.getlist('videos') if video]
+    split = request.form.get('split') in ('1', 'true')
+    if not videos:
+        return jsonify({'error': 'No video files provided'}), 400
+    if split and len(videos) != 1:
+        return jsonify({'error': 'Splitting by detected trials takes exactly one recording'}), 400
+    if len(videos) > FRT_BATCH_MAX_VIDEOS:
+        return jsonify({'error': f"At most {FRT_BATCH_MAX_VIDEOS} videos per batch"}), 400
+
+    profile = request.form.get('profile', AUTO_PROFILE)
+    if profile != AUTO_PROFILE and profile not in ANALYSIS_PROFILES:
+        return jsonify({'error': f"Unknown analysis profile '{profile}'"}), 400
+
+    # Subject of each video: the uploader unless given
+    try:
+        subject_ids = [int(subject_id) for subject_id in request.form.getlist('subjectIds')]
+    except ValueError:
+        return jsonify({'error': 'Invalid subject ID format'}), 400
+    if not subject_ids:
+        subject_ids = [session['user_id']] * len(videos)
+    elif len(subject_ids) == 1:
+        subject_ids = subject_ids * len(videos)
+    elif len(subject_ids) != len(videos):
+        return jsonify({'error': 'Give one subject ID per video, or one for all'}), 400
+
+    # Only a doctor may analyse other people's trials, and only for their own patients
+    others = sorted({subject_id for subject_id in subject_ids if subject_id != session['user_id']})
+    if others:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            placeholders = ', '.join('?' for _ in others)
+            cursor.execute(f"""
+                SELECT pp.UserID
+                FROM PatientProfiles pp
+                WHERE pp.DoctorID = (SELECT DoctorID FROM DoctorProfiles WHERE UserID = ?)
+                AND pp.UserID IN ({placeholders})
+            """, (session['user_id'], *others))
+            if len(cursor.fetchall()) != len(others):
+                return jsonify({'error': 'Unauthorized access'}), 403
+        finally:
+            conn.close()
+
+    try:
+        trials = []
+        for video_file, subject_id in zip(videos, subject_ids):
+            filename, error = upload_video(video_file)
+            if error:
+                return jsonify({'error': f"{video_file.filename}: {error}"}), 400
+            trials.append({'videoPath': os.path.join(UPLOAD_DIR, filename), 'filename': filename,
+                           'videoHash': video_hash_of(filename), 'subjectId': subject_id, 'splitTrials': split})
+
+        job_queue = get_job_queue(on_complete=notify_job_finished)
+        try:
+            jobs = job_queue.submit_batch(session['user_id'], trials, profile=profile)
+        except QueueFullError as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+
+        jobs = job_queue.wait([job['jobId'] for job in jobs], timeout=FRT_BATCH_TIMEOUT_SECONDS)
+        if any(job['status'] not in (COMPLETED, FAILED) for job in jobs):
+            return jsonify({'error': 'Batch analysis did not finish in time; nothing was saved',
+                            'jobs': [job['jobId'] for job in jobs]}), 504
+
+        rows = [row for job in jobs for row in _batch_trial_rows(job)]
+        aggregates = {str(subject_id): aggregate_trials([row for row in rows if row['subjectId'] == subject_id])
+                      for subject_id in dict.fromkeys(subject_ids)}
+
+        # Every trial with a result is saved, or none of them
+        symptoms = request.form.get('symptoms')
+        saved = [(row['subjectId'], row['maxDistance'], row['riskLevel'], symptoms)
+                 for row in measured_trials(rows)]
+        if saved:
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.executemany("""
+                    INSERT INTO FRTResults (UserID, MaxDistance, RiskLevel, Symptoms)
+                    VALUES (?, ?, ?, ?)
+                """, saved)
+                for subject_id in dict.fromkeys(row[0] for row in saved):
+                    record_frt_results(cursor, subject_id, [(row[1], row[2]) for row in saved if row[0] == subject_id])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+        return jsonify({'trials': rows, 'aggregates': aggregates, 'saved': len(saved),
+                        'profile': jobs[0]['profile']}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@frt_bp.route('/jobs/<job_id>')
+def get_frt_job(job_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    job_queue = get_job_queue()
+    if job_queue.owner(job_id) != session['user_id']:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify(job_queue.get(job_id))
+
+@frt_bp.route('/jobs/stats')
+def get_frt_job_stats():
+    if 'user_id' not in session or session.get('role') != 'Doctor':
+        return jsonify({'error': 'Unauthorized access'}), 403
+
+    return jsonify(get_job_queue().stats())
+
 @frt_bp.route('/live', methods=['GET'])
 def live_frt_route():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
         
-    result = live_frt()
-    return jsonify({'result': result})
+    # live_frt() opens the server's own camera and a desktop window; a browser's camera
+    # is analysed over the Socket.IO stream instead
+    return jsonify({'error': "Live FRT over HTTP has been removed; stream frames over Socket.IO instead "
+                             "('frt_stream_start', then 'frt_frame', then 'frt_stream_stop')"}), 410
 
 # Route to get the logged-in doctor's own FRT history
 @frt_bp.route('/doctor-history')
@@ -199,8 +446,8 @@ def generate_report():
         return jsonify({'error': 'Missing required parameters'}), 400
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # Shared with the rest of the request; committed once the response is ready
+        cursor = request_connection().cursor()
         
         # Get doctor information
         cursor.execute("""
@@ -309,8 +556,7 @@ def generate_report():
             'FRT',  # Default report type
             report_info['includedTestIds']
         ))
-        
-        conn.commit()
+        record_report(cursor, session['user_id'])
         
         return jsonify({
             'message': 'Report generated successfully',
@@ -321,9 +567,6 @@ def generate_report():
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 @frt_bp.route('/reports/download/<filename>')
 def download_report(filename):
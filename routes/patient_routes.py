@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify, session, request
 from database import get_db_connection
+from stats_rollup import record_doctor_change
 import re
 
 patient_bp = Blueprint('patient', __name__, url_prefix='/api/patient')
@@ -83,21 +84,24 @@ def associate_with_doctor():
     
     # Associate patient with doctor
     try:
-        # First, check if the patient already has a doctor association
-        cursor.execute("SELECT HasDoctor, DoctorID FROM PatientProfiles WHERE UserID = ?", (session['user_id'],))
+        # Update the patient record; the previous values come back from the same statement,
+        # so concurrent requests cannot both move the patient away from the same doctor
+        cursor.execute("""
+            UPDATE PatientProfiles 
+            SET HasDoctor = 1, DoctorID = ? 
+            OUTPUT deleted.HasDoctor, deleted.DoctorID
+            WHERE UserID = ?
+        """, (doctor_id, session['user_id']))
         patient_data = cursor.fetchone()
         
         if patient_data and patient_data[0] and patient_data[1] == doctor_id:
             # Already associated with this doctor
+            conn.rollback()
             conn.close()
             return jsonify({'message': 'You are already associated with this doctor'}), 200
         
-        # Update the patient record
-        cursor.execute("""
-            UPDATE PatientProfiles 
-            SET HasDoctor = 1, DoctorID = ? 
-            WHERE UserID = ?
-        """, (doctor_id, session['user_id']))
+        if patient_data:
+            record_doctor_change(cursor, session['user_id'], patient_data[1], doctor_id)
         
         conn.commit()
         conn.close()
@@ -120,13 +124,18 @@ def remove_doctor_association():
         cursor.execute("""
             UPDATE PatientProfiles 
             SET HasDoctor = 0, DoctorID = NULL 
+            OUTPUT deleted.DoctorID
             WHERE UserID = ?
         """, (session['user_id'],))
+        patient_data = cursor.fetchone()
+        if patient_data:
+            record_doctor_change(cursor, session['user_id'], patient_data[0], None)
         
         conn.commit()
         conn.close()
         
         return jsonify({'message': 'Doctor association removed successfully'}), 200
     except Exception as e:
+        conn.rollback()
         conn.close()
         return jsonify({'error': str(e)}), 500
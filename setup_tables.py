@@ -1,19 +1,65 @@
-from database import get_db_connection
+# setup_tables.py - Versioned schema migrations
+#
+# The schema is brought up to date once, when the app starts (or from the
+# command line), and the applied version is recorded in SchemaVersion.
+# Request handlers can then rely on the tables and indexes below existing
+# instead of checking INFORMATION_SCHEMA on every call.
+#
+#   python setup_tables.py            # apply pending migrations
+#   python setup_tables.py --status   # show the current and latest version
+
+import argparse
 import traceback
 
-def setup_encryption_tables():
-    """Create encryption-related database tables if they don't exist."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+from database import db_connection
+from stats_rollup import create_rollup_tables
 
-    try:
-        # First check if the table exists
-        cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'UserEncryptionKeys'")
-        table_exists = cursor.fetchone()[0] > 0
+# Set once this process has verified that the schema is at SCHEMA_VERSION
+schema_ready = False
+
+
+def _create_encryption_tables(cursor):
+    """Create the encryption key table and the dual-encryption chat columns"""
+    # First check if the table exists
+    cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'UserEncryptionKeys'")
+    table_exists = cursor.fetchone()[0] > 0
+
+    if not table_exists:
+        print("Creating UserEncryptionKeys table...")
+        try:
+            cursor.execute("""
+                CREATE TABLE UserEncryptionKeys (
+                    KeyID INT IDENTITY(1,1) PRIMARY KEY,
+                    UserID INT NOT NULL,
+                    PublicKey NVARCHAR(MAX) NOT NULL,
+                    PrivateKey NVARCHAR(MAX) NOT NULL,
+                    CreatedAt DATETIME DEFAULT GETDATE(),
+                    FOREIGN KEY (UserID) REFERENCES Users(UserID)
+                )
+            """)
+            print("UserEncryptionKeys table created successfully")
+        except Exception as create_error:
+            print(f"Error creating UserEncryptionKeys table: {str(create_error)}")
+            traceback.print_exc()
+            raise create_error
+    else:
+        # Check if the table has the required columns
+        print("Checking UserEncryptionKeys columns...")
+        required_columns = ['KeyID', 'UserID', 'PublicKey', 'PrivateKey', 'CreatedAt']
+    
+        for column in required_columns:
+            cursor.execute(f"""
+                SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
+                WHERE TABLE_NAME = 'UserEncryptionKeys' AND COLUMN_NAME = '{column}'
+            """)
+            has_column = cursor.fetchone()[0] > 0
         
-        if not table_exists:
-            print("Creating UserEncryptionKeys table...")
-            try:
+            if not has_column:
+                print(f"Missing required column: {column}")
+                print("Dropping and recreating UserEncryptionKeys table...")
+            
+                # Drop and recreate the table if it's missing columns
+                cursor.execute("DROP TABLE UserEncryptionKeys")
                 cursor.execute("""
                     CREATE TABLE UserEncryptionKeys (
                         KeyID INT IDENTITY(1,1) PRIMARY KEY,
@@ -24,113 +70,185 @@ def setup_encryption_tables():
                         FOREIGN KEY (UserID) REFERENCES Users(UserID)
                     )
                 """)
-                print("UserEncryptionKeys table created successfully")
-            except Exception as create_error:
-                print(f"Error creating UserEncryptionKeys table: {str(create_error)}")
-                traceback.print_exc()
-                raise create_error
-        else:
-            # Check if the table has the required columns
-            print("Checking UserEncryptionKeys columns...")
-            required_columns = ['KeyID', 'UserID', 'PublicKey', 'PrivateKey', 'CreatedAt']
-            
-            for column in required_columns:
-                cursor.execute(f"""
-                    SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
-                    WHERE TABLE_NAME = 'UserEncryptionKeys' AND COLUMN_NAME = '{column}'
-                """)
-                has_column = cursor.fetchone()[0] > 0
-                
-                if not has_column:
-                    print(f"Missing required column: {column}")
-                    print("Dropping and recreating UserEncryptionKeys table...")
-                    
-                    # Drop and recreate the table if it's missing columns
-                    cursor.execute("DROP TABLE UserEncryptionKeys")
-                    cursor.execute("""
-                        CREATE TABLE UserEncryptionKeys (
-                            KeyID INT IDENTITY(1,1) PRIMARY KEY,
-                            UserID INT NOT NULL,
-                            PublicKey NVARCHAR(MAX) NOT NULL,
-                            PrivateKey NVARCHAR(MAX) NOT NULL,
-                            CreatedAt DATETIME DEFAULT GETDATE(),
-                            FOREIGN KEY (UserID) REFERENCES Users(UserID)
-                        )
-                    """)
-                    print("UserEncryptionKeys table recreated successfully")
-                    break
-
-        # Check if ChatMessages table exists
-        cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'ChatMessages'")
-        chat_table_exists = cursor.fetchone()[0] > 0
-        
-        if chat_table_exists:
-            # Check if the new dual-encryption columns exist
-            cursor.execute("""
-                SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
-                WHERE TABLE_NAME = 'ChatMessages' AND COLUMN_NAME = 'SenderEncryptedMessage'
-            """)
-            has_sender_column = cursor.fetchone()[0] > 0
-            
+                print("UserEncryptionKeys table recreated successfully")
+                break
+
+    # Check if ChatMessages table exists
+    cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'ChatMessages'")
+    chat_table_exists = cursor.fetchone()[0] > 0
+
+    if chat_table_exists:
+        # Check if the new dual-encryption columns exist
+        cursor.execute("""
+            SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
+            WHERE TABLE_NAME = 'ChatMessages' AND COLUMN_NAME = 'SenderEncryptedMessage'
+        """)
+        has_sender_column = cursor.fetchone()[0] > 0
+    
+        cursor.execute("""
+            SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
+            WHERE TABLE_NAME = 'ChatMessages' AND COLUMN_NAME = 'RecipientEncryptedMessage'
+        """)
+        has_recipient_column = cursor.fetchone()[0] > 0
+    
+        # Add the new columns if they don't exist
+        if not has_sender_column:
+            print("Adding SenderEncryptedMessage column to ChatMessages table...")
             cursor.execute("""
-                SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
-                WHERE TABLE_NAME = 'ChatMessages' AND COLUMN_NAME = 'RecipientEncryptedMessage'
+                ALTER TABLE ChatMessages
+                ADD SenderEncryptedMessage NVARCHAR(MAX) NULL
             """)
-            has_recipient_column = cursor.fetchone()[0] > 0
-            
-            # Handle existing EncryptedMessage column
+            print("SenderEncryptedMessage column added successfully")
+        
+        if not has_recipient_column:
+            print("Adding RecipientEncryptedMessage column to ChatMessages table...")
             cursor.execute("""
-                SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
-                WHERE TABLE_NAME = 'ChatMessages' AND COLUMN_NAME = 'EncryptedMessage'
+                ALTER TABLE ChatMessages
+                ADD RecipientEncryptedMessage NVARCHAR(MAX) NULL
             """)
-            has_old_column = cursor.fetchone()[0] > 0
-            
-            # Add the new columns if they don't exist
-            if not has_sender_column:
-                print("Adding SenderEncryptedMessage column to ChatMessages table...")
-                cursor.execute("""
-                    ALTER TABLE ChatMessages
-                    ADD SenderEncryptedMessage NVARCHAR(MAX) NULL
-                """)
-                print("SenderEncryptedMessage column added successfully")
-                
-            if not has_recipient_column:
-                print("Adding RecipientEncryptedMessage column to ChatMessages table...")
-                cursor.execute("""
-                    ALTER TABLE ChatMessages
-                    ADD RecipientEncryptedMessage NVARCHAR(MAX) NULL
-                """)
-                print("RecipientEncryptedMessage column added successfully")
-                
-            # If we're migrating from the old schema, copy data and drop the old column
-            if has_old_column and has_sender_column and has_recipient_column:
-                print("Migrating data from EncryptedMessage to dual-encryption columns...")
-                cursor.execute("""
-                    UPDATE ChatMessages 
-                    SET RecipientEncryptedMessage = EncryptedMessage,
-                        SenderEncryptedMessage = EncryptedMessage
-                    WHERE EncryptedMessage IS NOT NULL
-                """)
-                
-                print("Dropping old EncryptedMessage column...")
-                cursor.execute("""
-                    ALTER TABLE ChatMessages
-                    DROP COLUMN EncryptedMessage
-                """)
-                print("Old column dropped successfully")
-        else:
-            print("ChatMessages table doesn't exist yet. It will be created when needed.")
+            print("RecipientEncryptedMessage column added successfully")
+        
+        # Messages in the old single EncryptedMessage column are moved by migration 5
+    else:
+        print("ChatMessages table doesn't exist yet. It will be created when needed.")
+
+
+def _index_encryption_keys(cursor):
+    """One key pair per user, with the public key readable from the index alone"""
+    # Older code could insert a second row for a user; keep the newest
+    cursor.execute("""
+        DELETE k FROM UserEncryptionKeys k
+        WHERE EXISTS (SELECT 1 FROM UserEncryptionKeys newer
+                      WHERE newer.UserID = k.UserID AND newer.KeyID > k.KeyID)
+    """)
+    if cursor.rowcount > 0:
+        print(f"Removed {cursor.rowcount} superseded encryption key rows")
+    cursor.execute("""
+        CREATE UNIQUE INDEX IX_UserEncryptionKeys_UserID
+        ON UserEncryptionKeys (UserID) INCLUDE (PublicKey)
+    """)
+
+
+def _index_dashboard_dates(cursor):
+    """Indexes for the doctor dashboard's per-month counts"""
+    for name, table, columns in [
+            ('IX_FRTResults_UserID_CreatedAt', 'FRTResults', 'UserID, CreatedAt'),
+            ('IX_Reports_DoctorID_GeneratedAt', 'Reports', 'DoctorID, GeneratedAt'),
+            ('IX_PatientProfiles_DoctorID', 'PatientProfiles', 'DoctorID')]:
+        cursor.execute(f"""
+            IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}' AND object_id = OBJECT_ID('{table}'))
+                CREATE INDEX {name} ON {table} ({columns})
+        """)
+
+
+def _move_single_encrypted_messages(cursor):
+    """Copy ChatMessages.EncryptedMessage into the dual-encryption columns, then drop it"""
+    # Migration 1 once read the column state before adding the new columns, so it
+    # recorded itself as applied without moving anything; this runs the move for real
+    cursor.execute("SELECT COL_LENGTH('ChatMessages', 'EncryptedMessage')")
+    if cursor.fetchone()[0] is None:
+        return
+    for column in ('SenderEncryptedMessage', 'RecipientEncryptedMessage'):
+        cursor.execute(f"""
+            IF COL_LENGTH('ChatMessages', '{column}') IS NULL
+                ALTER TABLE ChatMessages ADD {column} NVARCHAR(MAX) NULL
+        """)
+
+    print("Migrating data from EncryptedMessage to dual-encryption columns...")
+    cursor.execute("""
+        UPDATE ChatMessages
+        SET SenderEncryptedMessage = ISNULL(SenderEncryptedMessage, EncryptedMessage),
+            RecipientEncryptedMessage = ISNULL(RecipientEncryptedMessage, EncryptedMessage)
+        WHERE EncryptedMessage IS NOT NULL
+    """)
+    print(f"Copied {cursor.rowcount} messages")
 
-        conn.commit()
-        print("Encryption tables setup complete!")
+    print("Dropping old EncryptedMessage column...")
+    cursor.execute("ALTER TABLE ChatMessages DROP COLUMN EncryptedMessage")
+    print("Old column dropped successfully")
+
+
+# Ordered list of (version, description, migration); append new ones, never edit applied ones
+MIGRATIONS = [
+    (1, 'Encryption key table and dual-encryption chat columns', _create_encryption_tables),
+    (2, 'Unique index on UserEncryptionKeys.UserID', _index_encryption_keys),
+    (3, 'Date range indexes for the doctor dashboard', _index_dashboard_dates),
+    (4, 'Dashboard statistics rollup tables', create_rollup_tables),
+    (5, 'Move single-encrypted chat messages to the dual-encryption columns', _move_single_encrypted_messages),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+        IF OBJECT_ID('SchemaVersion', 'U') IS NULL
+            CREATE TABLE SchemaVersion (
+                Version INT PRIMARY KEY,
+                Description NVARCHAR(200) NOT NULL,
+                AppliedAt DATETIME NOT NULL DEFAULT GETDATE()
+            )
+    """)
+
+def current_version(cursor):
+    """Highest applied migration, or 0 for a database that has never been migrated"""
+    cursor.execute("SELECT ISNULL(MAX(Version), 0) FROM SchemaVersion")
+    return cursor.fetchone()[0]
+
+def _lock_schema(cursor):
+    """Take the migration lock for the current transaction and return the applied version"""
+    # Serializes app processes starting at the same time; released when the transaction ends
+    cursor.execute("EXEC sp_getapplock @Resource = 'SchemaMigrations', @LockMode = 'Exclusive', "
+                   "@LockOwner = 'Transaction', @LockTimeout = 60000")
+    _ensure_version_table(cursor)
+    return current_version(cursor)
+
+def migrate():
+    """Apply every pending migration, each in its own transaction; returns the schema version"""
+    with db_connection() as conn:
+        version = _lock_schema(conn.cursor())
+
+    for target, description, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # Another process may have applied it in the meantime
+            version = _lock_schema(cursor)
+            if target <= version:
+                continue
+            print(f"Applying schema migration {target}: {description}...")
+            migration(cursor)
+            cursor.execute("INSERT INTO SchemaVersion (Version, Description) VALUES (?, ?)", (target, description))
+            version = target
+    return version
+
+def ensure_schema():
+    """Migrate the schema once per process; raises when it cannot be brought up to date.
+
+    Request handlers rely on the schema instead of checking it, so the
+    application must not start serving without it.
+    """
+    global schema_ready
+    if schema_ready:
         return True
+    try:
+        version = migrate()
     except Exception as e:
-        conn.rollback()
-        print(f"Error setting up encryption tables: {str(e)}")
+        print(f"ERROR: Could not bring the database schema up to date: {str(e)}")
         traceback.print_exc()
-        return False
-    finally:
-        conn.close()
+        raise
+    schema_ready = True
+    print(f"Database schema is at version {version}")
+    return schema_ready
 
 if __name__ == "__main__":
-    setup_encryption_tables()
+    parser = argparse.ArgumentParser(description="Apply versioned database schema migrations")
+    parser.add_argument('--status', action='store_true', help="only show the current and latest schema version")
+    args = parser.parse_args()
+
+    if args.status:
+        with db_connection() as conn:
+            print(f"Schema version {_lock_schema(conn.cursor())} of {SCHEMA_VERSION}")
+    else:
+        print(f"Schema version {migrate()} of {SCHEMA_VERSION}")
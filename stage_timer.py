@@ -0,0 +1,85 @@
+# stage_timer.py - Optional per-stage timers and frame counters for the FRT pipeline
+
+import time
+
+
+class StageTimer:
+    """Accumulates wall time per pipeline stage and named counters.
+
+    Stages are timed by passing the start time along:
+
+        started = timer.clock()
+        ...decode...
+        started = timer.lap('decode', started)
+        ...resize...
+        timer.lap('resize', started)
+
+    Each stage must only be timed from one thread (with prefetching, decode
+    and resize run on the reader thread and everything else on the caller's),
+    so no lock is needed.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = {}
+        self.calls = {}
+        self.max_seconds = {}
+        self.counters = {}
+
+    def clock(self):
+        return time.perf_counter()
+
+    def lap(self, stage, started):
+        """Add the time since started to stage; returns the current time for the next stage"""
+        now = time.perf_counter()
+        self.add(stage, now - started)
+        return now
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        if seconds > self.max_seconds.get(stage, 0.0):
+            self.max_seconds[stage] = seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        wall_seconds = time.perf_counter() - self.started
+        return {
+            'wallSeconds': round(wall_seconds, 3),
+            'stages': {stage: {
+                'calls': self.calls[stage],
+                'totalSeconds': round(seconds, 4),
+                'meanMs': round(1000 * seconds / self.calls[stage], 3),
+                'maxMs': round(1000 * self.max_seconds.get(stage, 0.0), 3),
+                'share': round(seconds / wall_seconds, 3) if wall_seconds else None
+            } for stage, seconds in self.seconds.items()},
+            'counters': dict(self.counters)
+        }
+
+
+class NullStageTimer:
+    """Stand-in used when stage timing is off; every call is a no-op"""
+
+    enabled = False
+
+    def clock(self):
+        return 0.0
+
+    def lap(self, stage, started):
+        return 0.0
+
+    def add(self, stage, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def summary(self):
+        return None
+
+
+NULL_STAGE_TIMER = NullStageTimer()
@@ -69,24 +69,123 @@ function displayFRTButtons() {
     let liveFRTButton = document.createElement("button");
     liveFRTButton.textContent = "Live FRT";
     liveFRTButton.onclick = function() {
-        $.ajax({
-            url: '/api/frt/live',  
-            method: 'GET',
-            success: function(response) {
-                displayBotMessage('Live FRT result: ' + response.result);
-                saveFRTResult(response.result, window.chatHistory || '');
-            },
-            error: function(error) {
-                console.error('Error:', error);
-                displayBotMessage('Error performing Live FRT: ' + (error.responseJSON?.error || 'Unknown error'));
-            }
-        });
+        startLiveFRT();
     };
 
     buttonContainer.appendChild(uploadButton);
     buttonContainer.appendChild(liveFRTButton);
 }
 
+// Live FRT: stream webcam frames to the server and show its feedback as they come back
+const LIVE_FRT_FPS = 15;
+const LIVE_FRT_FRAME_HEIGHT = 360;
+let liveFRT = null;
+
+async function startLiveFRT() {
+    if (liveFRT) {
+        return;
+    }
+
+    let media;
+    try {
+        media = await navigator.mediaDevices.getUserMedia({ video: true });
+    } catch (error) {
+        console.error('Error:', error);
+        displayBotMessage('Error performing Live FRT: camera not available');
+        return;
+    }
+
+    const video = document.createElement('video');
+    video.srcObject = media;
+    video.muted = true;
+    video.playsInline = true;
+    await video.play();
+
+    // Downscale before encoding so each frame stays small
+    const canvas = document.createElement('canvas');
+    canvas.height = LIVE_FRT_FRAME_HEIGHT;
+    canvas.width = Math.round(video.videoWidth * LIVE_FRT_FRAME_HEIGHT / video.videoHeight);
+    const context = canvas.getContext('2d');
+
+    const status = document.createElement('div');
+    status.classList.add('live-frt-status');
+    status.textContent = 'Connecting...';
+    const stopButton = document.createElement('button');
+    stopButton.textContent = 'Stop Live FRT';
+    stopButton.onclick = function() {
+        liveFRT.socket.emit('frt_stream_stop');
+    };
+    const buttonContainer = document.getElementById('button-container');
+    buttonContainer.appendChild(video);
+    buttonContainer.appendChild(status);
+    buttonContainer.appendChild(stopButton);
+
+    liveFRT = { socket: io({ forceNew: true }), media: media, timer: null, sentSeq: -1, ackedSeq: -1, maxInFlight: 2 };
+    const stream = liveFRT;
+
+    function stop() {
+        clearInterval(stream.timer);
+        media.getTracks().forEach(track => track.stop());
+        stream.socket.disconnect();
+        video.remove();
+        status.remove();
+        stopButton.remove();
+        liveFRT = null;
+    }
+
+    stream.socket.on('connect', () => stream.socket.emit('frt_stream_start'));
+
+    stream.socket.on('frt_stream_started', (data) => {
+        stream.maxInFlight = data.maxInFlight;
+        stream.timer = setInterval(() => {
+            // Skip this tick while the server is still working on earlier frames
+            if (stream.sentSeq - stream.ackedSeq >= stream.maxInFlight) {
+                return;
+            }
+            const seq = ++stream.sentSeq;
+            const t = performance.now() / 1000;
+            context.drawImage(video, 0, 0, canvas.width, canvas.height);
+            canvas.toBlob((blob) => {
+                blob.arrayBuffer().then((image) => {
+                    stream.socket.emit('frt_frame', { seq: seq, t: t, image: image });
+                });
+            }, 'image/jpeg', 0.7);
+        }, 1000 / LIVE_FRT_FPS);
+    });
+
+    stream.socket.on('frt_feedback', (data) => {
+        // Frames the server dropped never get feedback, so acknowledge everything up to this one
+        stream.ackedSeq = Math.max(stream.ackedSeq, data.seq);
+        if (data.error) {
+            return;
+        }
+        let text = data.poseDetected ? 'Posture: ' + (data.posture || 'checking') : 'Step into view';
+        if (data.issues.length) {
+            text += ' - ' + data.issues.join(', ');
+        }
+        if (data.distance !== null) {
+            text += ' | Reach: ' + data.distance + ' cm';
+        }
+        text += ' | Max: ' + data.maxDistance + ' cm';
+        status.textContent = text;
+    });
+
+    stream.socket.on('frt_stream_result', (data) => {
+        stop();
+        if (data.riskLevel) {
+            displayBotMessage('Live FRT result: ' + data.riskLevel);
+            saveFRTResult(data.riskLevel, data.maxDistance);
+        } else {
+            displayBotMessage('Live FRT stopped before a reach was measured.');
+        }
+    });
+
+    stream.socket.on('frt_stream_error', (data) => {
+        stop();
+        displayBotMessage('Error performing Live FRT: ' + (data.error || 'Unknown error'));
+    });
+}
+
 // Function to display the user's message
 function displayUserMessage(message) {
     let chat = document.getElementById("chat");
@@ -144,8 +243,8 @@ $('#file-input').change(function() {
         contentType: false,
         processData: false,
         success: function(response) {
-            displayBotMessage('Upload successful! Video result: ' + response.result);
-            saveFRTResult(response.result, window.chatHistory || '');
+            displayBotMessage('Upload successful! Analysing your video...');
+            pollFRTJob(response.jobId);
         },
         error: function(error) {
             console.error('Error:', error);
@@ -154,6 +253,28 @@ $('#file-input').change(function() {
     });
 });
 
+// Poll a queued FRT analysis until the worker pool has finished it
+function pollFRTJob(jobId) {
+    $.ajax({
+        url: '/api/frt/jobs/' + jobId,
+        method: 'GET',
+        success: function(job) {
+            if (job.status === 'completed') {
+                displayBotMessage('Video result: ' + job.result);
+                saveFRTResult(job.result, job.analysis.maxDistance);
+            } else if (job.status === 'failed') {
+                displayBotMessage('Error analysing video: ' + (job.error || 'Unknown error'));
+            } else {
+                setTimeout(function() { pollFRTJob(jobId); }, 1000);
+            }
+        },
+        error: function(error) {
+            console.error('Error:', error);
+            displayBotMessage('Error checking video analysis: ' + (error.responseJSON?.error || 'Unknown error'));
+        }
+    });
+}
+
 // Add new function to save FRT recommendation to history
 async function saveRecommendation(chatHistory) {
     try {
@@ -187,8 +308,9 @@ async function saveRecommendation(chatHistory) {
     }
 }
 
-// Update the saveFRTResult function to use the full conversation history
-async function saveFRTResult(result, symptoms) {
+// Update the saveFRTResult function to use the full conversation history;
+// maxDistance is the measured reach in cm, as reported by the analysis
+async function saveFRTResult(result, maxDistance) {
     try {
         // Get the full conversation history from window.chatHistory
         let conversationText = '';
@@ -204,7 +326,7 @@ async function saveFRTResult(result, symptoms) {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                maxDistance: parseFloat(result.match(/\d+(\.\d+)?/)[0] || 0),
+                maxDistance: maxDistance || 0,
                 riskLevel: result,
                 symptoms: conversationText || 'No conversation recorded'
             })
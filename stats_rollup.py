@@ -0,0 +1,294 @@
+# stats_rollup.py - Per-doctor and per-patient statistics maintained on write
+#
+# The dashboards used to count and average raw FRTResults and Reports on
+# every page load. These rollup tables hold the same numbers, updated by the
+# code that writes results, reports and doctor associations, on the same
+# cursor and so in the same transaction:
+#
+#   PatientStats / PatientMonthlyStats   tests, measured tests, reach sum, last assessment
+#   DoctorStats / DoctorMonthlyStats     associated patients, tests of those patients, reports
+#
+# A dashboard reads one totals row and two monthly rows, whatever the
+# history size. Months are bucketed on the database clock, like the
+# CreatedAt/GeneratedAt defaults of the raw rows.
+#
+#   python stats_rollup.py --rebuild   # recompute every rollup from the raw tables
+
+import argparse
+
+from database import db_connection
+
+# Tests with a reach of 0 are chatbot placeholders ('Pending Test', 'Not Recommended'), not measurements
+MEASURED = "MaxDistance > 0"
+
+CURRENT_MONTH = "DATEFROMPARTS(YEAR(GETDATE()), MONTH(GETDATE()), 1)"
+
+ROLLUP_TABLES_SQL = [
+    """
+    CREATE TABLE PatientStats (
+        PatientID INT PRIMARY KEY,
+        Tests INT NOT NULL DEFAULT 0,
+        MeasuredTests INT NOT NULL DEFAULT 0,
+        ReachSum FLOAT NOT NULL DEFAULT 0,
+        LastTestAt DATETIME NULL,
+        LastRiskLevel VARCHAR(100) NULL,
+        FOREIGN KEY (PatientID) REFERENCES Users(UserID)
+    )
+    """,
+    """
+    CREATE TABLE PatientMonthlyStats (
+        PatientID INT NOT NULL,
+        MonthStart DATE NOT NULL,
+        Tests INT NOT NULL DEFAULT 0,
+        MeasuredTests INT NOT NULL DEFAULT 0,
+        ReachSum FLOAT NOT NULL DEFAULT 0,
+        PRIMARY KEY (PatientID, MonthStart),
+        FOREIGN KEY (PatientID) REFERENCES Users(UserID)
+    )
+    """,
+    """
+    CREATE TABLE DoctorStats (
+        DoctorUserID INT PRIMARY KEY,
+        ActivePatients INT NOT NULL DEFAULT 0,
+        Tests INT NOT NULL DEFAULT 0,
+        Reports INT NOT NULL DEFAULT 0,
+        FOREIGN KEY (DoctorUserID) REFERENCES Users(UserID)
+    )
+    """,
+    """
+    CREATE TABLE DoctorMonthlyStats (
+        DoctorUserID INT NOT NULL,
+        MonthStart DATE NOT NULL,
+        NewPatients INT NOT NULL DEFAULT 0,
+        Tests INT NOT NULL DEFAULT 0,
+        Reports INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (DoctorUserID, MonthStart),
+        FOREIGN KEY (DoctorUserID) REFERENCES Users(UserID)
+    )
+    """
+]
+
+
+# Define the function to wrap a multi-statement write so an error in any statement is raised
+# (NOCOUNT ON), leaving row counts on again for the connection's next user
+def _batch(sql):
+    return f"SET NOCOUNT ON;\n{sql}\nSET NOCOUNT OFF;"
+
+# Define the function to build an UPDATE-or-INSERT of one rollup row, safe under concurrent writers
+def _upsert(table, where, updates, columns, values):
+    return f"""
+        UPDATE {table} WITH (UPDLOCK, SERIALIZABLE) SET {updates} WHERE {where};
+        IF @@ROWCOUNT = 0
+            INSERT INTO {table} ({columns}) VALUES ({values});
+    """
+
+
+def record_frt_results(cursor, patient_id, results):
+    """Add newly inserted FRTResults rows of one patient, given as (maxDistance, riskLevel) pairs"""
+    if not results:
+        return
+    measured = [(float(distance), risk_level) for distance, risk_level in results if float(distance or 0) > 0]
+    reach_sum = sum(distance for distance, _ in measured)
+    last_risk_level = measured[-1][1] if measured else None
+
+    cursor.execute(_batch(f"""
+        DECLARE @PatientID INT = ?, @Tests INT = ?, @Measured INT = ?, @ReachSum FLOAT = ?,
+                @RiskLevel VARCHAR(100) = ?, @Month DATE = {CURRENT_MONTH};
+        DECLARE @DoctorUserID INT = (
+            SELECT dp.UserID FROM PatientProfiles pp
+            JOIN DoctorProfiles dp ON dp.DoctorID = pp.DoctorID
+            WHERE pp.UserID = @PatientID
+        );
+        {_upsert('PatientStats', 'PatientID = @PatientID',
+                 '''Tests = Tests + @Tests, MeasuredTests = MeasuredTests + @Measured, ReachSum = ReachSum + @ReachSum,
+                    LastTestAt = CASE WHEN @Measured > 0 THEN GETDATE() ELSE LastTestAt END,
+                    LastRiskLevel = ISNULL(@RiskLevel, LastRiskLevel)''',
+                 'PatientID, Tests, MeasuredTests, ReachSum, LastTestAt, LastRiskLevel',
+                 '@PatientID, @Tests, @Measured, @ReachSum, CASE WHEN @Measured > 0 THEN GETDATE() END, @RiskLevel')}
+        {_upsert('PatientMonthlyStats', 'PatientID = @PatientID AND MonthStart = @Month',
+                 'Tests = Tests + @Tests, MeasuredTests = MeasuredTests + @Measured, ReachSum = ReachSum + @ReachSum',
+                 'PatientID, MonthStart, Tests, MeasuredTests, ReachSum',
+                 '@PatientID, @Month, @Tests, @Measured, @ReachSum')}
+        IF @DoctorUserID IS NOT NULL
+        BEGIN
+            {_upsert('DoctorStats', 'DoctorUserID = @DoctorUserID', 'Tests = Tests + @Tests',
+                     'DoctorUserID, Tests', '@DoctorUserID, @Tests')}
+            {_upsert('DoctorMonthlyStats', 'DoctorUserID = @DoctorUserID AND MonthStart = @Month',
+                     'Tests = Tests + @Tests', 'DoctorUserID, MonthStart, Tests', '@DoctorUserID, @Month, @Tests')}
+        END
+    """), (patient_id, len(results), len(measured), reach_sum, last_risk_level))
+
+
+def record_report(cursor, doctor_user_id):
+    """Add a newly inserted Reports row of a doctor"""
+    cursor.execute(_batch(f"""
+        DECLARE @DoctorUserID INT = ?, @Month DATE = {CURRENT_MONTH};
+        {_upsert('DoctorStats', 'DoctorUserID = @DoctorUserID', 'Reports = Reports + 1',
+                 'DoctorUserID, Reports', '@DoctorUserID, 1')}
+        {_upsert('DoctorMonthlyStats', 'DoctorUserID = @DoctorUserID AND MonthStart = @Month',
+                 'Reports = Reports + 1', 'DoctorUserID, MonthStart, Reports', '@DoctorUserID, @Month, 1')}
+    """), (doctor_user_id,))
+
+
+def _move_patient(cursor, patient_id, doctor_id, sign):
+    # Adds (sign 1) or removes (sign -1) a patient and all their tests to or from a doctor's rollups
+    cursor.execute(_batch(f"""
+        DECLARE @PatientID INT = ?, @Sign INT = ?;
+        DECLARE @DoctorUserID INT = (SELECT UserID FROM DoctorProfiles WHERE DoctorID = ?);
+        IF @DoctorUserID IS NOT NULL
+        BEGIN
+            DECLARE @Tests INT = ISNULL((SELECT Tests FROM PatientStats WHERE PatientID = @PatientID), 0);
+            {_upsert('DoctorStats', 'DoctorUserID = @DoctorUserID',
+                     'ActivePatients = ActivePatients + @Sign, Tests = Tests + @Sign * @Tests',
+                     'DoctorUserID, ActivePatients, Tests', '@DoctorUserID, @Sign, @Sign * @Tests')}
+
+            -- The patient counts as new in the month their account was created, and brings their tests by month
+            MERGE DoctorMonthlyStats WITH (HOLDLOCK) AS d
+            USING (
+                SELECT MonthStart, SUM(NewPatients) AS NewPatients, SUM(Tests) AS Tests
+                FROM (
+                    SELECT MonthStart, 0 AS NewPatients, Tests FROM PatientMonthlyStats WHERE PatientID = @PatientID
+                    UNION ALL
+                    SELECT DATEFROMPARTS(YEAR(CreatedAt), MONTH(CreatedAt), 1), 1, 0 FROM Users WHERE UserID = @PatientID
+                ) m
+                GROUP BY MonthStart
+            ) AS p
+            ON d.DoctorUserID = @DoctorUserID AND d.MonthStart = p.MonthStart
+            WHEN MATCHED THEN
+                UPDATE SET NewPatients = d.NewPatients + @Sign * p.NewPatients, Tests = d.Tests + @Sign * p.Tests
+            WHEN NOT MATCHED THEN
+                INSERT (DoctorUserID, MonthStart, NewPatients, Tests)
+                VALUES (@DoctorUserID, p.MonthStart, @Sign * p.NewPatients, @Sign * p.Tests);
+        END
+    """), (patient_id, sign, doctor_id))
+
+def record_doctor_change(cursor, patient_id, old_doctor_id, new_doctor_id):
+    """Move a patient's counts between doctors (DoctorProfiles.DoctorID codes, either may be None)"""
+    if old_doctor_id == new_doctor_id:
+        return
+    if old_doctor_id:
+        _move_patient(cursor, patient_id, old_doctor_id, -1)
+    if new_doctor_id:
+        _move_patient(cursor, patient_id, new_doctor_id, 1)
+
+
+def rebuild(cursor):
+    """Recompute every rollup from FRTResults, Reports and PatientProfiles"""
+    cursor.execute(_batch("DELETE FROM PatientMonthlyStats; DELETE FROM PatientStats; "
+                          "DELETE FROM DoctorMonthlyStats; DELETE FROM DoctorStats;"))
+
+    cursor.execute(f"""
+        INSERT INTO PatientMonthlyStats (PatientID, MonthStart, Tests, MeasuredTests, ReachSum)
+        SELECT UserID, DATEFROMPARTS(YEAR(CreatedAt), MONTH(CreatedAt), 1), COUNT(*),
+               COUNT(CASE WHEN {MEASURED} THEN 1 END), ISNULL(SUM(CASE WHEN {MEASURED} THEN MaxDistance END), 0)
+        FROM FRTResults
+        GROUP BY UserID, DATEFROMPARTS(YEAR(CreatedAt), MONTH(CreatedAt), 1)
+    """)
+    cursor.execute(f"""
+        INSERT INTO PatientStats (PatientID, Tests, MeasuredTests, ReachSum, LastTestAt, LastRiskLevel)
+        SELECT t.PatientID, t.Tests, t.MeasuredTests, t.ReachSum, last.CreatedAt, last.RiskLevel
+        FROM (
+            SELECT PatientID, SUM(Tests) AS Tests, SUM(MeasuredTests) AS MeasuredTests, SUM(ReachSum) AS ReachSum
+            FROM PatientMonthlyStats
+            GROUP BY PatientID
+        ) t
+        OUTER APPLY (
+            SELECT TOP 1 CreatedAt, RiskLevel FROM FRTResults
+            WHERE UserID = t.PatientID AND {MEASURED}
+            ORDER BY CreatedAt DESC, ResultID DESC
+        ) last
+    """)
+
+    # Doctors: their associated patients (and those patients' tests), then their reports
+    cursor.execute("""
+        WITH Patients AS (
+            SELECT dp.UserID AS DoctorUserID, pp.UserID AS PatientID, u.CreatedAt
+            FROM PatientProfiles pp
+            JOIN DoctorProfiles dp ON dp.DoctorID = pp.DoctorID
+            JOIN Users u ON u.UserID = pp.UserID
+        )
+        INSERT INTO DoctorMonthlyStats (DoctorUserID, MonthStart, NewPatients, Tests)
+        SELECT DoctorUserID, MonthStart, SUM(NewPatients), SUM(Tests)
+        FROM (
+            SELECT DoctorUserID, DATEFROMPARTS(YEAR(CreatedAt), MONTH(CreatedAt), 1) AS MonthStart,
+                   1 AS NewPatients, 0 AS Tests
+            FROM Patients
+            UNION ALL
+            SELECT p.DoctorUserID, m.MonthStart, 0, m.Tests
+            FROM Patients p
+            JOIN PatientMonthlyStats m ON m.PatientID = p.PatientID
+        ) x
+        GROUP BY DoctorUserID, MonthStart
+    """)
+    cursor.execute("""
+        MERGE DoctorMonthlyStats AS d
+        USING (
+            SELECT DoctorID AS DoctorUserID, DATEFROMPARTS(YEAR(GeneratedAt), MONTH(GeneratedAt), 1) AS MonthStart,
+                   COUNT(*) AS Reports
+            FROM Reports
+            GROUP BY DoctorID, DATEFROMPARTS(YEAR(GeneratedAt), MONTH(GeneratedAt), 1)
+        ) AS r
+        ON d.DoctorUserID = r.DoctorUserID AND d.MonthStart = r.MonthStart
+        WHEN MATCHED THEN UPDATE SET Reports = r.Reports
+        WHEN NOT MATCHED THEN INSERT (DoctorUserID, MonthStart, Reports) VALUES (r.DoctorUserID, r.MonthStart, r.Reports);
+    """)
+    cursor.execute("""
+        INSERT INTO DoctorStats (DoctorUserID, ActivePatients, Tests, Reports)
+        SELECT m.DoctorUserID, ISNULL(p.ActivePatients, 0), m.Tests, m.Reports
+        FROM (
+            SELECT DoctorUserID, SUM(Tests) AS Tests, SUM(Reports) AS Reports
+            FROM DoctorMonthlyStats
+            GROUP BY DoctorUserID
+        ) m
+        LEFT JOIN (
+            SELECT dp.UserID AS DoctorUserID, COUNT(*) AS ActivePatients
+            FROM PatientProfiles pp
+            JOIN DoctorProfiles dp ON dp.DoctorID = pp.DoctorID
+            GROUP BY dp.UserID
+        ) p ON p.DoctorUserID = m.DoctorUserID
+    """)
+
+
+def create_rollup_tables(cursor):
+    """Schema migration: create the rollup tables and fill them from the existing rows"""
+    for statement in ROLLUP_TABLES_SQL:
+        cursor.execute(statement)
+    rebuild(cursor)
+
+
+def doctor_dashboard_stats(cursor, doctor_user_id):
+    """(activePatients, newThisMonth, tests, testsThisMonth, testsPrevMonth, reports, reportsThisMonth, reportsPrevMonth)"""
+    cursor.execute(f"""
+        DECLARE @DoctorUserID INT = ?, @Month DATE = {CURRENT_MONTH};
+        SELECT ISNULL(s.ActivePatients, 0), ISNULL(cur.NewPatients, 0),
+               ISNULL(s.Tests, 0), ISNULL(cur.Tests, 0), ISNULL(prev.Tests, 0),
+               ISNULL(s.Reports, 0), ISNULL(cur.Reports, 0), ISNULL(prev.Reports, 0)
+        FROM (SELECT @DoctorUserID AS DoctorUserID) k
+        LEFT JOIN DoctorStats s ON s.DoctorUserID = k.DoctorUserID
+        LEFT JOIN DoctorMonthlyStats cur ON cur.DoctorUserID = k.DoctorUserID AND cur.MonthStart = @Month
+        LEFT JOIN DoctorMonthlyStats prev
+            ON prev.DoctorUserID = k.DoctorUserID AND prev.MonthStart = DATEADD(month, -1, @Month)
+    """, (doctor_user_id,))
+    return tuple(cursor.fetchone())
+
+def patient_dashboard_stats(cursor, patient_id):
+    """(tests, measuredTests, reachSum, lastTestAt, lastRiskLevel), or None before the first result"""
+    cursor.execute("""
+        SELECT Tests, MeasuredTests, ReachSum, LastTestAt, LastRiskLevel
+        FROM PatientStats WHERE PatientID = ?
+    """, (patient_id,))
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the dashboard statistics rollups")
+    parser.add_argument('--rebuild', action='store_true', help="recompute every rollup from the raw tables")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        with db_connection() as conn:
+            rebuild(conn.cursor())
+        print("Rebuilt the dashboard statistics rollups")
+    else:
+        parser.print_help()
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+pyodbc = pytest.importorskip('pyodbc', exc_type=ImportError)
+
+from database import ConnectionPool, PoolTimeoutError  # noqa: E402
+
+
+class FakeConnection:
+    """Just enough of a pyodbc connection for the pool"""
+
+    def __init__(self):
+        self.autocommit = False
+        self.closed = False
+        self.healthy = True
+        self.rollbacks = 0
+
+    def cursor(self):
+        if not self.healthy:
+            raise pyodbc.OperationalError('Communication link failure')
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def execute(self, sql):
+        pass
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+def _pool(**settings):
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+    return ConnectionPool(connect, **settings), opened
+
+
+def test_reuses_the_most_recently_returned_connection():
+    pool, opened = _pool(min_size=0, max_size=2)
+    first = pool.acquire()
+    first.close()
+    second = pool.acquire()
+    assert len(opened) == 1 and second._conn is opened[0]
+    # close() left no transaction open for the next user
+    assert opened[0].rollbacks == 1
+
+
+def test_evicts_idle_connections_beyond_min_size():
+    pool, opened = _pool(min_size=1, max_size=3, idle_seconds=0.05)
+    connections = [pool.acquire() for _ in range(3)]
+    for conn in connections:
+        conn.close()
+    time.sleep(0.1)
+
+    conn = pool.acquire()
+    stats = pool.stats()
+    assert stats['evictedIdle'] == 2 and stats['size'] == 1
+    # The oldest connections go first; the most recently returned one is kept
+    assert [c.closed for c in opened] == [True, True, False]
+    assert conn._conn is opened[2]
+
+
+def test_replaces_a_connection_that_fails_the_health_check():
+    pool, opened = _pool(min_size=0, max_size=1, ping_after=0)
+    pool.acquire().close()
+    opened[0].healthy = False
+
+    conn = pool.acquire()
+    assert conn._conn is opened[1] and opened[0].closed
+    assert pool.stats()['healthCheckFailures'] == 1
+
+
+def test_times_out_when_exhausted():
+    pool, _ = _pool(min_size=0, max_size=1)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire(timeout=0.05)
+    assert pool.stats()['timeouts'] == 1
+    held.close()
+    pool.acquire(timeout=0.05).close()
@@ -0,0 +1,199 @@
+import json
+import time
+
+import numpy as np
+import pytest
+
+import frt_processing
+from frt_processing import _AdaptiveStride, aggregate_trials, measured_trials, risk_level
+
+
+def _trial(max_distance, risk):
+    return {'maxDistance': max_distance, 'riskLevel': risk}
+
+
+TRIALS = [_trial(20.0, risk_level(20.0)), _trial(0, None), _trial(31.5, risk_level(31.5)), _trial(0, None),
+          _trial(25.0, risk_level(25.0))]
+
+
+def test_aggregate_ignores_unmeasured_trials():
+    aggregate = aggregate_trials(TRIALS)
+    assert aggregate['trials'] == 3
+    # Best of the first three measured trials, not of the first three detected
+    assert aggregate['bestOfThree'] == 31.5
+    assert aggregate['mean'] == round((20.0 + 31.5 + 25.0) / 3, 2)
+    assert aggregate['riskLevel'] == risk_level(31.5)
+
+
+def test_aggregate_without_measurements():
+    assert aggregate_trials([_trial(0, None)]) == {'trials': 0, 'bestOfThree': None, 'mean': None, 'riskLevel': None}
+
+
+def test_batch_rows_aggregate_like_the_split_analysis():
+    # The routes need the database driver and the rest of the web stack
+    frt_routes = pytest.importorskip('routes.frt_routes', exc_type=ImportError)
+
+    analysis = {'trials': TRIALS, 'aggregate': aggregate_trials(TRIALS), 'riskLevel': None, 'maxDistance': 0}
+    job = {'jobId': 'job', 'subjectId': 7, 'filename': 'clip.mp4', 'status': 'completed', 'error': None,
+           'analysis': analysis}
+    rows = frt_routes._batch_trial_rows(job)
+    assert aggregate_trials(rows) == analysis['aggregate']
+    assert len(measured_trials(rows)) == analysis['aggregate']['trials']
+
+
+def _sample(sampler, fps, seconds, wrist_at, jitter=0.0):
+    """Run the sampler over a clip as the reader would; returns the inferred frame times"""
+    rng = np.random.default_rng(0)
+    inferred = []
+    frame = 0
+    while frame < fps * seconds:
+        t = frame / fps
+        inferred.append(t)
+        wrist = np.array(wrist_at(t)) + rng.normal(0, jitter, 2)
+        frame += sampler.update(t, wrist)
+    return inferred
+
+
+def test_adaptive_stride_is_sparse_while_still_despite_jitter():
+    inferred = _sample(_AdaptiveStride(6), fps=30, seconds=4, wrist_at=lambda t: (0.7, 0.3), jitter=0.002)
+    assert len(inferred) == 20
+
+
+def test_adaptive_stride_is_dense_while_the_wrist_moves():
+    # Still for 2 s, reaching at 0.1 per second for 1 s, then still again
+    def wrist_at(t):
+        return 0.7 + 0.1 * min(max(t - 2.0, 0.0), 1.0), 0.3
+
+    inferred = np.array(_sample(_AdaptiveStride(6), fps=30, seconds=5, wrist_at=wrist_at))
+    gaps = np.diff(inferred)
+    moving = (inferred[1:] > 2.0 + 2 * frt_processing.wrist_motion_window_seconds) & (inferred[1:] <= 3.0)
+    assert np.allclose(gaps[moving], 1 / 30)
+    settled = inferred[1:] > 3.0 + frt_processing.dense_sampling_seconds + frt_processing.wrist_motion_window_seconds
+    assert np.allclose(gaps[settled], 6 / 30)
+
+
+def _scripted_series(reach_cms, fps=30):
+    """Landmark series of consecutive scripted trials (see benchmark_frt), one per reach"""
+    from benchmark_frt import as_landmarks, scripted_landmarks
+
+    times = []
+    points = []
+    trial_seconds = 9.0
+    for i, reach_cm in enumerate(reach_cms):
+        for frame in range(int(trial_seconds * fps)):
+            t = frame / fps
+            scripted = scripted_landmarks(t, reach_cm)
+            times.append(i * trial_seconds + t)
+            points.append(frt_processing.landmarks_to_array(as_landmarks(scripted)) if scripted is not None
+                          else np.full((frt_processing.NUM_LANDMARKS, 4), np.nan, dtype=np.float32))
+    return {'times': np.array(times), 'points': np.stack(points)}
+
+
+def test_session_resumes_from_its_checkpoint():
+    series = _scripted_series([20])
+    half = len(series['times']) // 2
+
+    whole = frt_processing.FRTSession()
+    resumed = frt_processing.FRTSession()
+    for i, (t, points) in enumerate(zip(series['times'], series['points'])):
+        landmarks = None if np.isnan(points[0, 0]) else points
+        whole.feed(landmarks, t)
+        if i == half:
+            # Checkpoints go through JSON when a test moves to another worker
+            resumed = frt_processing.FRTSession.from_dict(json.loads(json.dumps(resumed.to_dict())))
+        resumed.feed(landmarks, t)
+
+    assert resumed.to_dict() == whole.to_dict()
+    assert resumed.result() == whole.result()
+    assert whole.result()['maxDistance'] == pytest.approx(20, abs=0.5)
+
+
+def test_split_scores_each_trial():
+    trials = frt_processing.split_landmark_series(_scripted_series([10, 20, 30]))
+    assert [round(trial['maxDistance']) for trial in trials] == [10, 20, 30]
+    assert [trial['riskLevel'] for trial in trials] == [risk_level(10), risk_level(20), risk_level(30)]
+    assert all(trial['termination'] == 'reach_returned' for trial in trials)
+    assert aggregate_trials(trials)['bestOfThree'] == trials[2]['maxDistance']
+
+
+def test_split_matches_single_trial_scoring():
+    series = _scripted_series([25])
+    [trial] = frt_processing.split_landmark_series(series)
+    single = frt_processing.score_landmark_series(series)
+    assert (trial['maxDistance'], trial['riskLevel']) == (single['maxDistance'], single['riskLevel'])
+
+
+@pytest.mark.parametrize('reach_cm', [15, 25])
+def test_engines_agree_at_risk_boundaries(reach_cm):
+    series = _scripted_series([reach_cm])
+    session = frt_processing.FRTSession()
+    for t, points in zip(series['times'], series['points']):
+        session.feed(None if np.isnan(points[0, 0]) else points, t)
+        if session.finished is not None:
+            break
+
+    per_frame = session.result()
+    vectorized = frt_processing.score_landmark_series(series)
+    assert per_frame['maxDistance'] == vectorized['maxDistance'] == reach_cm
+    # Risk follows the reported (rounded) reach in both engines
+    assert per_frame['riskLevel'] == vectorized['riskLevel'] == risk_level(reach_cm)
+
+
+def test_risk_follows_the_reported_reach():
+    assert risk_level(24.999) == risk_level(25.0) == "Low risk of falls"
+    assert risk_level(14.996) == risk_level(15.0) == "Risk of falling is 2x greater than normal"
+    assert risk_level(0.001) is None
+
+
+class _FailingPool:
+    def __init__(self, error):
+        self.error = error
+
+    def acquire(self):
+        raise self.error
+
+    def release(self, pose):
+        pass
+
+
+class _Pool:
+    def acquire(self):
+        return object()
+
+    def release(self, pose):
+        pass
+
+
+@pytest.mark.parametrize('error, blacklisted', [(RuntimeError("graph failed"), False),
+                                                (OSError("model download failed"), True)])
+def test_pose_fallback_only_blacklists_load_failures(monkeypatch, error, blacklisted):
+    monkeypatch.setattr(frt_processing, '_unavailable_models', {})
+    monkeypatch.setattr(frt_processing, 'get_pose_pool',
+                        lambda complexity: _FailingPool(error) if complexity == 2 else _Pool())
+
+    with frt_processing.pose_session(2) as (complexity, pose):
+        assert complexity == 1
+    assert (frt_processing.unavailable_models() == [2]) == blacklisted
+
+    # Once the blacklist expires the model is tried again
+    for complexity in frt_processing._unavailable_models:
+        frt_processing._unavailable_models[complexity] = time.monotonic() - 1
+    monkeypatch.setattr(frt_processing, 'get_pose_pool', lambda complexity: _Pool())
+    with frt_processing.pose_session(2) as (complexity, pose):
+        assert complexity == 2
+
+
+@pytest.mark.parametrize('thresholds, until_end', [(None, False), ({'reach_return_seconds': 3.0}, True)])
+def test_other_thresholds_score_the_whole_clip(monkeypatch, tmp_path, thresholds, until_end):
+    extractions = []
+
+    def extract(cap, pose, **kwargs):
+        extractions.append(kwargs['until_end'])
+        return dict(_scripted_series([20]), framesDecoded=270)
+
+    monkeypatch.setattr(frt_processing, 'get_pose_pool', lambda complexity: _Pool())
+    monkeypatch.setattr(frt_processing, 'extract_landmark_series', extract)
+    analysis = frt_processing.analyze_frt(str(tmp_path / 'missing.mp4'), use_cache=False, thresholds=thresholds)
+    # The default termination policy must not cut the series short of what the thresholds need
+    assert extractions == [until_end]
+    assert round(analysis['maxDistance']) == 20
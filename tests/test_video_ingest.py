@@ -0,0 +1,81 @@
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+
+import video_ingest
+from frame_reader import FrameReader
+from video_ingest import find_frame_store, normalize_video, open_video
+
+
+@pytest.fixture
+def clip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(video_ingest, 'NORMALIZED_DIR', str(tmp_path / 'normalized'))
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 15, (320, 480))
+    for i in range(30):
+        frame = np.zeros((480, 320, 3), dtype=np.uint8)
+        cv2.circle(frame, (160, 40 + 12 * i), 30, (0, 255, 0), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def test_store_keeps_source_resolution_at_a_constant_frame_rate(clip):
+    meta = normalize_video(clip, 'clip', fps=30)
+    assert (meta['width'], meta['height']) == (320, 480)
+    # Each 15 fps source frame is shown for two 30 fps frames
+    assert meta['frames'] == 60
+    assert find_frame_store('clip') == meta
+
+    cap, source = open_video(clip, 'clip')
+    assert source == 'normalized'
+    frames = 0
+    while cap.grab():
+        frames += 1
+        if frames == 21:
+            ok, frame = cap.retrieve()
+            assert ok and frame.shape == (480, 320, 3)
+            assert cap.get(cv2.CAP_PROP_POS_MSEC) == pytest.approx(20 * 1000 / 30)
+    assert frames == 60
+
+
+def test_store_is_skipped_past_the_clip_limit(clip):
+    meta = normalize_video(clip, 'clip', max_bytes=10 * 1024)
+    assert meta['skipped']
+    assert find_frame_store('clip') is None
+    assert open_video(clip, 'clip')[1] == 'original'
+    # The skip is remembered, so the clip is not converted again
+    assert normalize_video(clip, 'clip')['skipped']
+
+
+def test_reader_counts_the_allocations_it_makes(clip):
+    normalize_video(clip, 'clip', fps=30)
+    cap, source = open_video(clip, 'clip')
+    assert source == 'normalized'
+    reader = FrameReader(cap, 160, 240, buffers=1)
+    reader.read()
+
+    # Count the reads that allocated a full frame, measured rather than taken from the counter
+    frame_bytes = 480 * 320 * 3
+    allocating_reads = 0
+    tracemalloc.start()
+    try:
+        while True:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            if reader.read() is None:
+                break
+            _, peak = tracemalloc.get_traced_memory()
+            allocating_reads += peak - before >= frame_bytes
+    finally:
+        tracemalloc.stop()
+    cap.release()
+
+    # Every decode from the store allocates a new frame, and the counters say so
+    assert allocating_reads == 59
+    stats = reader.stats()
+    assert stats['bufferAllocations'] == 1 + 1 + allocating_reads
+    assert stats['allocationsPerFrame'] == pytest.approx(61 / 60, abs=0.001)
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from flask import Blueprint, Flask, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import video_upload
+from video_upload import HashingUploadStream, UploadRequest, upload_video
+
+KB = 1024
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(video_upload, 'MAX_VIDEO_UPLOAD_BYTES', 5 * KB)
+    monkeypatch.setattr(video_upload, 'UPLOAD_CHUNK_SIZE', KB)
+
+    frt_bp = Blueprint('frt', __name__)
+
+    def stored():
+        try:
+            files = request.files
+        except RequestEntityTooLarge as e:
+            return jsonify({'error': e.description}), 413
+        names = [upload_video(video)[0] for key in files for video in files.getlist(key)]
+        return jsonify({'stored': names}), 200
+
+    frt_bp.add_url_rule('/upload', 'upload_frt_video', stored, methods=['POST'])
+    frt_bp.add_url_rule('/batch', 'upload_batch', stored, methods=['POST'])
+
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    app.register_blueprint(frt_bp)
+    return app
+
+
+def _videos(*sizes):
+    return [(io.BytesIO(bytes([i]) * size), f"trial{i}.mp4") for i, size in enumerate(sizes)]
+
+
+def test_batch_accepts_files_each_under_the_limit(app):
+    response = app.test_client().post('/batch', data={'videos': _videos(3 * KB, 3 * KB)})
+    assert response.status_code == 200
+    assert len(set(response.get_json()['stored'])) == 2
+
+
+def test_batch_rejects_a_file_over_the_limit(app):
+    response = app.test_client().post('/batch', data={'videos': _videos(3 * KB, 6 * KB)})
+    assert response.status_code == 413
+
+
+def test_batch_rejects_more_files_than_allowed(app, monkeypatch):
+    monkeypatch.setattr(video_upload, 'FRT_BATCH_MAX_VIDEOS', 2)
+    response = app.test_client().post('/batch', data={'videos': _videos(KB, KB, KB)})
+    assert response.status_code == 413
+
+
+def test_single_upload_takes_one_file(app):
+    client = app.test_client()
+    assert client.post('/upload', data={'video': _videos(4 * KB)}).status_code == 200
+    assert client.post('/upload', data={'video': _videos(3 * KB, 3 * KB)}).status_code == 413
+
+
+def test_stream_hashes_and_aborts_past_max_bytes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stream = HashingUploadStream(max_bytes=4)
+    stream.write(b'abcd')
+    assert stream.size == 4
+    with pytest.raises(RequestEntityTooLarge):
+        stream.write(b'e')
+    assert not (tmp_path / stream.path).exists()
@@ -0,0 +1,268 @@
+# video_ingest.py - Normalizes re-analysed videos once into an all-intra JPEG frame store
+#
+# Uploads arrive in any codec and frame rate, and every analysis decodes the
+# original again, inter-frame dependencies included. When a clip is analysed
+# a second time, ingest converts it once, in a background worker, into
+# independently coded JPEG frames at the source resolution and a constant
+# frame rate. Later analyses read those frames through a memory map: frames
+# that are skipped cost nothing and sampled ones are a single JPEG decode.
+# Keeping the source resolution means region-of-interest crops are cut from
+# the same pixels as when reading the original.
+#
+# Stores larger than NORMALIZED_MAX_CLIP_BYTES are not written; the clip is
+# then always read from the original. Both artefacts are kept under retention
+# rules: originals for ORIGINAL_RETENTION_DAYS, normalized stores (which can
+# always be rebuilt from the original) for NORMALIZED_RETENTION_DAYS and
+# within NORMALIZED_MAX_BYTES, least recently used first.
+#
+#   python video_ingest.py uploads/<hash>.mp4   # normalize one upload
+#   python video_ingest.py --retention          # apply the retention rules
+
+import argparse
+import json
+import os
+import time
+
+import cv2
+
+from frame_reader import FrameStoreCapture, frame_timestamp
+
+UPLOAD_DIR = 'uploads'
+NORMALIZED_DIR = os.path.join(UPLOAD_DIR, 'normalized')
+
+# Frame rate of normalized stores; source frames are repeated or dropped to hit it
+INGEST_FPS = float(os.environ.get('INGEST_FPS', 30))
+
+# Retention rules
+ORIGINAL_RETENTION_DAYS = int(os.environ.get('ORIGINAL_RETENTION_DAYS', 365))
+NORMALIZED_RETENTION_DAYS = int(os.environ.get('NORMALIZED_RETENTION_DAYS', 14))
+NORMALIZED_MAX_BYTES = int(os.environ.get('NORMALIZED_MAX_BYTES', 4 * 1024 * 1024 * 1024))
+
+# Largest store written for one clip, and the JPEG quality of its frames
+NORMALIZED_MAX_CLIP_BYTES = int(os.environ.get('NORMALIZED_MAX_CLIP_BYTES', 256 * 1024 * 1024))
+INGEST_JPEG_QUALITY = int(os.environ.get('INGEST_JPEG_QUALITY', 90))
+
+# Frames written before the store size is extrapolated to the whole clip
+SIZE_ESTIMATE_FRAMES = 30
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+
+# Bump when the store layout or the normalization changes
+FRAME_STORE_VERSION = 2
+
+
+def _store_paths(video_hash):
+    base = os.path.join(NORMALIZED_DIR, video_hash)
+    return base + '.frames', base + '.json'
+
+def _read_meta(video_hash):
+    try:
+        with open(_store_paths(video_hash)[1]) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == FRAME_STORE_VERSION else None
+
+def find_frame_store(video_hash):
+    """Return the metadata of a usable normalized store for a video, or None"""
+    meta = _read_meta(video_hash)
+    if meta is None or meta.get('skipped'):
+        return None
+    try:
+        frames_size = os.path.getsize(_store_paths(video_hash)[0])
+    except OSError:
+        return None
+    if len(meta['offsets']) != meta['frames'] + 1 or frames_size != meta['offsets'][-1]:
+        return None
+    return meta
+
+def open_video(video_path, video_hash=None):
+    """Open a video for analysis: (capture, source), preferring its normalized store when there is one"""
+    if video_hash:
+        meta = find_frame_store(video_hash)
+        if meta is not None:
+            frames_path, meta_path = _store_paths(video_hash)
+            # Reading the store counts as use for the size-based eviction
+            os.utime(meta_path)
+            return FrameStoreCapture(frames_path, meta), 'normalized'
+    return cv2.VideoCapture(video_path), 'original'
+
+
+def _write_meta(meta_path, meta):
+    tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_meta, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, meta_path)
+
+def normalize_video(video_path, video_hash, fps=INGEST_FPS, max_bytes=NORMALIZED_MAX_CLIP_BYTES):
+    """Write the normalized frame store of a video unless it already exists; returns its metadata.
+
+    The store is not written when it would exceed max_bytes, judged from the
+    first SIZE_ESTIMATE_FRAMES frames and enforced while writing; the
+    returned metadata then has 'skipped' set, and is kept so the clip is not
+    tried again.
+    """
+    meta = _read_meta(video_hash)
+    if meta is not None and (meta.get('skipped') or find_frame_store(video_hash) is not None):
+        return meta
+
+    os.makedirs(NORMALIZED_DIR, exist_ok=True)
+    frames_path, meta_path = _store_paths(video_hash)
+    tmp_frames = f"{frames_path}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+
+    cap = cv2.VideoCapture(video_path)
+    source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    source_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    expected_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) / source_fps * fps)
+    encode_params = [cv2.IMWRITE_JPEG_QUALITY, INGEST_JPEG_QUALITY]
+    offsets = [0]
+    source_frames = 0
+    skipped = None
+
+    def write(data):
+        # Returns False once the store is, or is on course to be, larger than max_bytes
+        f.write(data)
+        offsets.append(offsets[-1] + len(data))
+        written = len(offsets) - 1
+        projected = offsets[-1] / written * expected_frames if written >= SIZE_ESTIMATE_FRAMES else 0
+        return max(offsets[-1], projected) <= max_bytes
+
+    try:
+        with open(tmp_frames, 'wb') as f:
+            # Constant frame rate: output frame k shows the latest source frame at or before k / fps
+            current = None
+            first_time = None
+            t = 0.0
+            while skipped is None:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                t = frame_timestamp(cap, source_frames, source_fps)
+                source_frames += 1
+                if first_time is None:
+                    first_time = t
+                t -= first_time
+
+                while current is not None and skipped is None and (len(offsets) - 1) / fps < t:
+                    if not write(current):
+                        skipped = 'size'
+                ok, encoded = cv2.imencode('.jpg', frame, encode_params)
+                if ok:
+                    current = encoded.tobytes()
+                    height, width = frame.shape[:2]
+
+            # The last source frame lasts one source frame interval
+            if current is not None:
+                end = t + 1 / source_fps
+                while skipped is None and (len(offsets) - 1) / fps < end:
+                    if not write(current):
+                        skipped = 'size'
+    except BaseException:
+        if os.path.exists(tmp_frames):
+            os.remove(tmp_frames)
+        raise
+    finally:
+        cap.release()
+
+    written = len(offsets) - 1
+    if written == 0:
+        os.remove(tmp_frames)
+        raise ValueError(f"No frames could be decoded from {video_path}")
+
+    meta = {
+        'version': FRAME_STORE_VERSION,
+        'fps': fps,
+        'sourceFrames': source_frames,
+        'sourceFps': source_fps,
+        'sourceWidth': source_size[0],
+        'sourceHeight': source_size[1],
+        'source': os.path.basename(video_path),
+        'ingestSeconds': round(time.perf_counter() - started, 3)
+    }
+    if skipped is not None:
+        os.remove(tmp_frames)
+        meta['skipped'] = skipped
+        print(f"Not normalizing {video_path}: the store would exceed {max_bytes} bytes")
+        _write_meta(meta_path, meta)
+        return meta
+
+    meta.update(frames=written, width=width, height=height, bytes=offsets[-1], offsets=offsets)
+    # Frames first, metadata last: a store only counts once its metadata exists
+    os.replace(tmp_frames, frames_path)
+    _write_meta(meta_path, meta)
+    return meta
+
+
+def _remove(*paths):
+    removed = False
+    for path in paths:
+        try:
+            os.remove(path)
+            removed = True
+        except OSError:
+            pass
+    return removed
+
+def apply_retention():
+    """Delete originals and normalized stores that are past their retention; returns what was removed"""
+    now = time.time()
+    originals_removed = 0
+    normalized_removed = 0
+
+    # Originals (content-addressed, so the name is the hash) by age
+    originals = set()
+    for name in os.listdir(UPLOAD_DIR) if os.path.isdir(UPLOAD_DIR) else []:
+        path = os.path.join(UPLOAD_DIR, name)
+        stem, extension = os.path.splitext(name)
+        if extension.lower() not in VIDEO_EXTENSIONS or not os.path.isfile(path):
+            continue
+        if now - os.path.getmtime(path) > ORIGINAL_RETENTION_DAYS * 86400:
+            originals_removed += _remove(path)
+        else:
+            originals.add(stem)
+
+    # Normalized stores: by age, when their original is gone, then least recently used beyond the size limit
+    entries = []
+    for name in os.listdir(NORMALIZED_DIR) if os.path.isdir(NORMALIZED_DIR) else []:
+        if not name.endswith('.json'):
+            continue
+        video_hash = name[:-len('.json')]
+        frames_path, meta_path = _store_paths(video_hash)
+        try:
+            last_used = os.path.getmtime(meta_path)
+            size = os.path.getsize(frames_path) if os.path.exists(frames_path) else 0
+        except OSError:
+            continue
+        if now - last_used > NORMALIZED_RETENTION_DAYS * 86400 or video_hash not in originals:
+            normalized_removed += _remove(frames_path, meta_path)
+        else:
+            entries.append((last_used, size, frames_path, meta_path))
+
+    total = sum(size for _, size, _, _ in entries)
+    for _, size, frames_path, meta_path in sorted(entries):
+        if total <= NORMALIZED_MAX_BYTES:
+            break
+        normalized_removed += _remove(frames_path, meta_path)
+        total -= size
+
+    return {'originalsRemoved': originals_removed, 'normalizedRemoved': normalized_removed,
+            'normalizedBytes': total}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Normalize uploaded videos and apply retention rules")
+    parser.add_argument('videos', nargs='*', help="uploaded videos to normalize")
+    parser.add_argument('--retention', action='store_true', help="apply the retention rules")
+    args = parser.parse_args()
+
+    if args.videos:
+        from landmark_cache import hash_video
+        for video_path in args.videos:
+            meta = normalize_video(video_path, hash_video(video_path))
+            if meta.get('skipped'):
+                continue
+            print(f"Normalized {video_path}: {meta['frames']} frames at {meta['fps']} fps, "
+                  f"{meta['bytes']} bytes in {meta['ingestSeconds']} s")
+    if args.retention:
+        print(f"Retention: {apply_retention()}")
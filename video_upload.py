@@ -1,19 +1,179 @@
+import hashlib
 import os
+import tempfile
+import time
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
 
 UPLOAD_DIR = 'uploads'
 
+# Incoming files are streamed here first, on the same filesystem as UPLOAD_DIR so the final move is a rename
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_DIR, 'tmp')
+
+ALLOWED_EXTENSIONS = ['.mp4', '.avi', '.mov']  # Add other video formats if needed
+
+# Largest video accepted, and the chunk size used when a file has to be copied
+MAX_VIDEO_UPLOAD_BYTES = int(os.environ.get('MAX_VIDEO_UPLOAD_BYTES', 200 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Batch analysis takes up to this many videos in one request; other requests take one
+FRT_BATCH_MAX_VIDEOS = 12
+BATCH_UPLOAD_ENDPOINTS = ('frt.upload_batch',)
+
+# Partial files left behind by aborted uploads are removed after this long
+STALE_UPLOAD_SECONDS = 60 * 60
+
+
+class HashingUploadStream:
+    """Temporary file that hashes and counts bytes as the multipart parser writes them.
+
+    The upload is never held in memory: each chunk goes straight to disk, and
+    the transfer is aborted with 413 as soon as it exceeds max_bytes. The
+    temporary file is deleted when the request closes its files, unless
+    upload_video has claimed it.
+    """
+
+    def __init__(self, max_bytes=MAX_VIDEO_UPLOAD_BYTES):
+        os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, suffix='.part', delete=False)
+        self.path = self.file.name
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.claimed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge(f"Video exceeds the {self.max_bytes // (1024 * 1024)} MB upload limit")
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def discard(self):
+        self.file.close()
+        _discard(self.path)
+
+    def close(self):
+        if self.claimed:
+            self.file.close()
+        else:
+            self.discard()
+
+    def __getattr__(self, name):
+        # read, seek, close, ... go to the underlying file
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    """Request class that streams uploaded files through HashingUploadStream.
+
+    Each file is held to MAX_VIDEO_UPLOAD_BYTES as it streams. The request as
+    a whole may carry max_upload_files such files (FRT_BATCH_MAX_VIDEOS on
+    batch endpoints, one elsewhere), plus UPLOAD_CHUNK_SIZE for the form
+    fields and multipart framing.
+    """
+
+    upload_files = 0
+
+    @property
+    def max_upload_files(self):
+        return FRT_BATCH_MAX_VIDEOS if self.endpoint in BATCH_UPLOAD_ENDPOINTS else 1
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_request_bytes = self.max_upload_files * MAX_VIDEO_UPLOAD_BYTES + UPLOAD_CHUNK_SIZE
+        # Reject oversized bodies before any of the file is read, when the client says how big they are
+        if total_content_length is not None and total_content_length > max_request_bytes:
+            raise RequestEntityTooLarge(f"Upload exceeds the {max_request_bytes // (1024 * 1024)} MB request limit")
+        self.upload_files += 1
+        if self.upload_files > self.max_upload_files:
+            raise RequestEntityTooLarge(f"At most {self.max_upload_files} files per request")
+        return HashingUploadStream(max_bytes=MAX_VIDEO_UPLOAD_BYTES)
+
+
+def _spool(video_file):
+    """Return (temp path, sha256 hex, size) of an uploaded file, copying it in chunks if it was not streamed"""
+    stream = video_file.stream
+    if isinstance(stream, HashingUploadStream):
+        stream.claimed = True
+        stream.file.close()
+        return stream.path, stream.digest.hexdigest(), stream.size
+
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, suffix='.part', delete=False) as f:
+        try:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > MAX_VIDEO_UPLOAD_BYTES:
+                    raise RequestEntityTooLarge(
+                        f"Video exceeds the {MAX_VIDEO_UPLOAD_BYTES // (1024 * 1024)} MB upload limit")
+                digest.update(chunk)
+                f.write(chunk)
+        except Exception:
+            f.close()
+            os.remove(f.name)
+            raise
+    return f.name, digest.hexdigest(), size
+
+def _discard(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def _remove_stale_parts():
+    # Uploads aborted mid-transfer (client gone, size limit hit by the parser) leave .part files behind
+    cutoff = time.time() - STALE_UPLOAD_SECONDS
+    for name in os.listdir(UPLOAD_TMP_DIR):
+        path = os.path.join(UPLOAD_TMP_DIR, name)
+        try:
+            if name.endswith('.part') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
 def upload_video(video_file):
-    allowed_extensions = ['.mp4', '.avi', '.mov']  # Add other video formats if needed
-    filename = video_file.filename
+    """Store an uploaded video under a name derived from its content.
+
+    Returns (filename, error). The filename is the SHA-256 of the file plus
+    its extension, so re-uploading the same clip reuses the stored copy, and
+    two different clips with the same client filename never overwrite each
+    other.
+    """
+    filename = video_file.filename or ''
     extension = os.path.splitext(filename)[1].lower()
 
-    if extension not in allowed_extensions:
+    if extension not in ALLOWED_EXTENSIONS:
+        if isinstance(video_file.stream, HashingUploadStream):
+            video_file.stream.discard()
         return None, "Invalid file type. Please upload a video file."
 
+    try:
+        tmp_path, video_hash, size = _spool(video_file)
+    except RequestEntityTooLarge as e:
+        return None, e.description
+
+    if size == 0:
+        _discard(tmp_path)
+        return None, "The uploaded video is empty."
+
     # Ensure the uploads directory exists
     if not os.path.exists(UPLOAD_DIR):
         os.makedirs(UPLOAD_DIR)
 
-    new_path = os.path.join(UPLOAD_DIR, filename)
-    video_file.save(new_path)
-    return filename, None
+    stored_name = video_hash + extension
+    new_path = os.path.join(UPLOAD_DIR, stored_name)
+    if os.path.exists(new_path):
+        # Same content already stored: keep the existing copy, and restart its retention period
+        _discard(tmp_path)
+        os.utime(new_path)
+    else:
+        os.replace(tmp_path, new_path)
+
+    _remove_stale_parts()
+    return stored_name, None
+
+def video_hash_of(filename):
+    """SHA-256 of a stored upload's content, taken from its content-addressed name"""
+    return os.path.splitext(os.path.basename(filename))[0]